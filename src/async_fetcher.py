@@ -0,0 +1,310 @@
+import asyncio
+import os
+import random
+import time
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from scrape_dm_cards import parse_card_html
+from scraper_config import HEADERS, SAVED_PAGES_DIR
+from scraper_metrics import ScraperMetrics
+
+# =========================
+# 設定
+# =========================
+MAX_CONCURRENCY = 4      # 同時に処理する詳細ページ数の上限
+RATE_PER_SEC = 1.0       # ホストごとの平均リクエスト数（秒あたり）
+BURST = 2                # トークンバケットの容量（瞬間的に許すリクエスト数）
+MAX_RETRY = 5
+BACKOFF_BASE = 2.0       # 503 を受けたときの初回待機秒数
+BACKOFF_MAX = 60.0       # 待機秒数の上限
+TIMEOUT_SEC = 10
+KEEPALIVE_SEC = 30
+PARSE_QUEUE_SIZE = 32    # 取得済み・未解析のページを溜めておける数
+
+
+# =========================
+# ホスト単位のレート制限
+# =========================
+class TokenBucket:
+    """トークンバケット方式のレートリミッタ"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """トークンを1つ取得するまで待つ"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def backoff_delay(attempt, retry_after=None):
+    """指数バックオフ（ジッター付き）の待機秒数"""
+    if retry_after is not None:
+        return min(BACKOFF_MAX, retry_after)
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt))
+    return delay * random.uniform(0.5, 1.0)
+
+
+# =========================
+# 非同期詳細ページフェッチャー
+# =========================
+class AsyncDetailFetcher:
+    """コネクションを使い回して詳細ページを並行取得する"""
+
+    def __init__(self, concurrency=MAX_CONCURRENCY, rate=RATE_PER_SEC,
+                 burst=BURST, max_retry=MAX_RETRY, cache=None, offline=False,
+                 parse_pool=None, parse_workers=1, metrics=None):
+        """cache（HttpCache）を渡すと条件付きリクエストで再取得を省き、
+        offline=True ではネットワークに一切アクセスせずキャッシュだけを使う。
+        parse_pool（ProcessPoolExecutor）を渡すとHTML解析を別プロセスで行う。
+        metrics（ScraperMetrics）にはリクエスト・解析ごとのレイテンシと再試行数を記録する"""
+        self.concurrency = concurrency
+        self.rate = rate
+        self.burst = burst
+        self.max_retry = max_retry
+        self.cache = cache
+        self.offline = offline
+        self.parse_pool = parse_pool
+        self.parse_workers = parse_workers
+        self.metrics = metrics or ScraperMetrics(log_path=None)
+        self.session = None
+        self.errors = {}  # URL -> 最後のエラー内容
+        self._semaphore = None
+        self._buckets = {}
+
+    async def open(self):
+        if self.offline:
+            return
+        connector = aiohttp.TCPConnector(
+            limit=self.concurrency,
+            limit_per_host=self.concurrency,
+            keepalive_timeout=KEEPALIVE_SEC,
+        )
+        self.session = aiohttp.ClientSession(
+            headers=HEADERS,
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=TIMEOUT_SEC),
+        )
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def _bucket(self, url):
+        host = urlsplit(url).netloc
+        if host not in self._buckets:
+            self._buckets[host] = TokenBucket(self.rate, self.burst)
+        return self._buckets[host]
+
+    async def fetch_body(self, url):
+        """HTML（bytes）を取得する（取得不能なら None）"""
+        if self.offline:
+            body = self.cache.load_body(url) if self.cache else None
+            if body is None:
+                self.errors[url] = "キャッシュなし（オフライン）"
+            return body
+
+        async with self._semaphore:
+            conditional = self.cache is not None
+            for attempt in range(self.max_retry):
+                if attempt:
+                    self.metrics.incr("retries")
+                await self._bucket(url).acquire()
+                retry_after = None
+                headers = self.cache.conditional_headers(url) if conditional else {}
+                start = time.perf_counter()
+                try:
+                    async with self.session.get(url, headers=headers) as res:
+                        if res.status == 503:
+                            self.metrics.incr("http_503")
+                            value = res.headers.get("Retry-After", "")
+                            retry_after = float(value) if value.isdigit() else None
+                            raise aiohttp.ClientResponseError(
+                                res.request_info, res.history, status=503, message="503"
+                            )
+                        if res.status == 304 and self.cache:
+                            self.metrics.incr("not_modified")
+                            self.metrics.observe("detail_fetch", time.perf_counter() - start)
+                            body = self.cache.load_body(url)
+                            if body is not None:
+                                self.cache.mark_validated(url)
+                                return body
+                            # キャッシュの本文が消えている → 条件なしで取り直す
+                            self.metrics.incr("cache_body_missing")
+                            conditional = False
+                            continue
+                        res.raise_for_status()
+                        body = await res.read()
+                        self.metrics.observe("detail_fetch", time.perf_counter() - start)
+                        if self.cache:
+                            self.cache.store(url, body, res.headers, kind="detail")
+                        return body
+
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    self.metrics.incr("fetch_errors")
+                    self.errors[url] = str(e) or type(e).__name__
+                    delay = backoff_delay(attempt, retry_after)
+                    print(f"詳細取得失敗（{attempt+1}/{self.max_retry}）: {url} ({e}) {delay:.1f}秒待機")
+                    await asyncio.sleep(delay)
+
+        self.metrics.incr("details_failed")
+        print("スキップ（取得不能）:", url)
+        return None
+
+    async def parse(self, url, body):
+        """HTMLを解析する（プロセスプールがあればそちらで実行）"""
+        start = time.perf_counter()
+        try:
+            if self.parse_pool is None:
+                card = parse_card_html(body)
+            else:
+                loop = asyncio.get_running_loop()
+                card = await loop.run_in_executor(self.parse_pool, parse_card_html, body)
+            self.metrics.observe("parse", time.perf_counter() - start)
+            self.metrics.incr("details_ok")
+            return card
+        except Exception as e:
+            self.metrics.incr("parse_failures")
+            self.errors[url] = f"解析失敗: {e}"
+            print(f"詳細解析失敗: {url} ({e})")
+            return None
+
+    async def fetch_card(self, url):
+        self.errors.pop(url, None)
+        body = await self.fetch_body(url)
+        if body is None:
+            return None
+        return await self.parse(url, body)
+
+    async def fetch_cards(self, urls):
+        """URLリストの順番どおりにカード情報を返す（失敗分は None）
+
+        取得ステージと解析ステージをキューでつなぎ、解析の間も次のページの取得を進める"""
+        results = [None] * len(urls)
+        queue = asyncio.Queue(maxsize=PARSE_QUEUE_SIZE)
+
+        async def fetch_stage(i, url):
+            self.errors.pop(url, None)
+            body = await self.fetch_body(url)
+            if body is not None:
+                await queue.put((i, url, body))
+
+        async def parse_stage():
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                i, url, body = item
+                results[i] = await self.parse(url, body)
+
+        parsers = [asyncio.create_task(parse_stage()) for _ in range(self.parse_workers)]
+        try:
+            await asyncio.gather(*(fetch_stage(i, url) for i, url in enumerate(urls)))
+        finally:
+            for _ in parsers:
+                await queue.put(None)
+            await asyncio.gather(*parsers)
+        return results
+
+
+def fetch_card_details(urls, **kwargs):
+    """同期コードから一括取得するためのヘルパー"""
+    async def run():
+        async with AsyncDetailFetcher(**kwargs) as fetcher:
+            return await fetcher.fetch_cards(urls)
+    return asyncio.run(run())
+
+
+# =========================
+# ローカル検証用ハーネス
+# =========================
+def serve_saved_pages(directory, port=0, fail_rate=0.0):
+    """保存済みのカードページをローカルHTTPサーバーで配信する（503の擬似発生付き）"""
+    import functools
+    import threading
+    from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(SimpleHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive を有効にする
+
+        def do_GET(self):
+            if random.random() < fail_rate:
+                self.send_response(503)
+                self.send_header("Retry-After", "1")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            super().do_GET()
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(
+        ("127.0.0.1", port), functools.partial(Handler, directory=directory)
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="保存済みカードページで非同期フェッチャーを検証する")
+    parser.add_argument("--dir", default=SAVED_PAGES_DIR)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--concurrency", type=int, default=MAX_CONCURRENCY)
+    parser.add_argument("--rate", type=float, default=20.0)
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.dir):
+        print(f"❌ 保存済みページのディレクトリがありません: {args.dir}（--dir で指定してください）")
+        return
+    pages = sorted(name for name in os.listdir(args.dir) if name.endswith(".html"))
+    if not pages:
+        print(f"❌ HTMLファイルがありません: {args.dir}")
+        return
+
+    server = serve_saved_pages(args.dir, fail_rate=args.fail_rate)
+    base = f"http://127.0.0.1:{server.server_address[1]}/"
+    try:
+        start = time.perf_counter()
+        cards = fetch_card_details(
+            [base + name for name in pages],
+            concurrency=args.concurrency,
+            rate=args.rate,
+            burst=args.concurrency,
+        )
+        elapsed = time.perf_counter() - start
+    finally:
+        server.shutdown()
+
+    ok = [card for card in cards if card]
+    for name, card in zip(pages, cards):
+        print(f"{name}: {card['card_name'] if card else '取得失敗'}")
+    print(f"\n✅ {len(ok)}/{len(pages)}件 取得 ({elapsed:.2f}秒)")
+
+
+if __name__ == "__main__":
+    main()
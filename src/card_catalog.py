@@ -0,0 +1,109 @@
+import argparse
+import csv
+import json
+import sys
+import time
+from pathlib import Path
+
+from card_index import CardNameIndex
+
+MANIFEST_NAME = "index_manifest.json"  # prepare_database.py が書き出す、有効なインデックスの情報
+LEGACY_CARDS_CSV = Path("data") / "cards.csv"
+NUMERIC_FIELDS = ("cost", "power")
+
+
+def resolve_index(base_dir=None):
+    """有効なインデックスのマニフェストとカードデータの場所 → (マニフェストのdict または None, CSVのパス)
+
+    マニフェストが無ければ従来の data/cards.csv を使う"""
+    base_dir = Path(base_dir) if base_dir else Path(__file__).parent
+    manifest_path = base_dir / "chroma_db" / MANIFEST_NAME
+    if manifest_path.exists():
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        return manifest, manifest_path.parent / manifest["cards_csv"]
+    return None, base_dir / LEGACY_CARDS_CSV
+
+
+def _value(field, text):
+    # pandas で読んだ時と同じく、空欄は None、コスト・パワーは数値にする
+    if text is None or text == "":
+        return None
+    if field in NUMERIC_FIELDS:
+        try:
+            number = float(text)
+        except ValueError:
+            return text
+        return int(number) if number.is_integer() else number
+    return text
+
+
+class CardCatalog:
+    """カード名の補完・カード引きだけを行う軽量版（pandas・Chroma・Ollama 不要）
+
+    検索エンジン（search.py）を読み込むほどではないツール・CLI 用。
+    card_idx は search.py と同じく CSV の行番号"""
+
+    def __init__(self, version, cards, name_index):
+        self.version = version
+        self.cards = cards            # card_idx -> カードのdict
+        self.name_index = name_index
+
+    @classmethod
+    def load(cls, base_dir=None, keywords=None):
+        base_dir = Path(base_dir) if base_dir else Path(__file__).parent
+        manifest, csv_path = resolve_index(base_dir)
+        with open(csv_path, "r", encoding="utf-8-sig", newline="") as f:
+            cards = {
+                idx: {field: _value(field, text) for field, text in row.items()}
+                for idx, row in enumerate(csv.DictReader(f))
+            }
+        if keywords is None:
+            keywords_path = base_dir / "data" / "keywords.txt"
+            keywords = []
+            if keywords_path.exists():
+                with open(keywords_path, "r", encoding="utf-8") as f:
+                    keywords = [line.strip() for line in f if line.strip()]
+        name_index = CardNameIndex.build(
+            ((idx, card["card_name"]) for idx, card in cards.items() if card.get("card_name")),
+            keywords=keywords,
+            races=(card["race"] for card in cards.values() if card.get("race")),
+        )
+        return cls(manifest["version"] if manifest else "legacy", cards, name_index)
+
+    def complete(self, text, limit=25, kinds=None):
+        """入力途中の文字列から、カード名・公式キーワード・種族の候補を返す"""
+        return self.name_index.complete(text, limit=limit, kinds=kinds)
+
+    def lookup_card(self, name, max_distance=2):
+        """カード名でカードを引く。戻り値は (カードのdict または None, 候補名のリスト)"""
+        matches = self.name_index.lookup(name, max_distance=max_distance)
+        if not matches:
+            return None, []
+        card_idx = matches[0]["card_idx"]
+        return {**self.cards[card_idx], "card_idx": card_idx}, [m["label"] for m in matches]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="カード名の補完・カード引き（検索エンジンを読み込まない軽量版）")
+    parser.add_argument("--complete", metavar="TEXT", help="入力途中の文字列から候補を出す")
+    parser.add_argument("--card", metavar="NAME", help="カード名でカードを引く")
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--base-dir", default=None, help="data/ と chroma_db/ の場所（省略時は src）")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    catalog = CardCatalog.load(args.base_dir)
+    print(f"インデックス: {catalog.version}（{len(catalog.cards)}枚, {time.perf_counter() - start:.2f}秒）",
+          file=sys.stderr)
+
+    if args.complete is not None:
+        for entry in catalog.complete(args.complete, limit=args.limit):
+            print(json.dumps(entry, ensure_ascii=False))
+    if args.card is not None:
+        card, candidates = catalog.lookup_card(args.card)
+        print(json.dumps({"card": card, "candidates": candidates}, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+import re
+import unicodedata
+
+# 区切り記号（「・」や空白）は入力で省略されることが多いので無視する
+_IGNORED_CHARS = re.compile(r"[\s・･\-‐－/／]")
+RACE_SEPARATOR = re.compile(r"\s*[/／]\s*")
+
+
+def normalize_name(text):
+    """名前照合用の正規化: NFKC・小文字化・区切り記号の除去・ひらがな→カタカナ"""
+    text = unicodedata.normalize("NFKC", str(text)).lower()
+    text = _IGNORED_CHARS.sub("", text)
+    return "".join(
+        chr(ord(ch) + 0x60) if "ぁ" <= ch <= "ゖ" else ch
+        for ch in text
+    )
+
+
+def bigrams(text):
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+def bounded_edit_distance(a, b, max_distance):
+    """レーベンシュタイン距離。max_distance を超えたら打ち切って None を返す"""
+    if abs(len(a) - len(b)) > max_distance:
+        return None
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (ca != cb),
+            ))
+        if min(current) > max_distance:
+            return None
+        previous = current
+    return previous[-1] if previous[-1] <= max_distance else None
+
+
+# =========================
+# 前方一致用のトライ
+# =========================
+class PrefixTrie:
+    def __init__(self):
+        self.root = {}
+
+    def insert(self, key, value):
+        node = self.root
+        for ch in key:
+            node = node.setdefault(ch, {})
+        node.setdefault(None, []).append(value)
+
+    def prefix(self, prefix, limit):
+        """prefix で始まるキーの値を、短いキーから順に最大 limit 件返す"""
+        node = self.root
+        for ch in prefix:
+            node = node.get(ch)
+            if node is None:
+                return []
+        results = []
+        level = [node]
+        while level and len(results) < limit:
+            next_level = []
+            for current in level:
+                results.extend(current.get(None, []))
+                next_level.extend(child for ch, child in current.items() if ch is not None)
+            level = next_level
+        return results[:limit]
+
+
+# =========================
+# カード名・キーワード・種族の索引
+# =========================
+class CardNameIndex:
+    """オートコンプリートと /card の名前解決に使う索引（LLM・ベクトル検索を使わない）
+
+    エントリは {"label": 表示名, "kind": "card" / "keyword" / "race", "card_idx": index or None}"""
+
+    def __init__(self):
+        self.entries = []
+        self.keys = []
+        self.trie = PrefixTrie()
+        self.postings = {}   # バイグラム -> エントリ番号の集合（部分一致・あいまい検索用）
+        self.exact = {}      # 正規化済みの名前 -> エントリ番号（カードのみ）
+
+    @classmethod
+    def build(cls, cards, keywords=(), races=()):
+        """cards は (card_idx, card_name) の列"""
+        index = cls()
+        for card_idx, name in cards:
+            index.add(name, "card", int(card_idx))
+        for keyword in keywords:
+            index.add(keyword, "keyword")
+        seen_races = set()
+        for race_field in races:
+            for race in RACE_SEPARATOR.split(str(race_field)):
+                if race and race not in seen_races:
+                    seen_races.add(race)
+                    index.add(race, "race")
+        return index
+
+    def add(self, label, kind, card_idx=None):
+        key = normalize_name(label)
+        if not key:
+            return
+        entry_id = len(self.entries)
+        self.entries.append({"label": label, "kind": kind, "card_idx": card_idx})
+        self.keys.append(key)
+        self.trie.insert(key, entry_id)
+        for gram in bigrams(key):
+            self.postings.setdefault(gram, set()).add(entry_id)
+        if kind == "card":
+            self.exact.setdefault(key, entry_id)
+
+    def complete(self, text, limit=25, kinds=None):
+        """前方一致を優先し、足りなければ部分一致で補う"""
+        key = normalize_name(text)
+        if not key:
+            return []
+
+        def allowed(entry_id):
+            return kinds is None or self.entries[entry_id]["kind"] in kinds
+
+        found = [i for i in self.trie.prefix(key, limit * 4) if allowed(i)][:limit]
+        if len(found) < limit and len(key) >= 2:
+            grams = bigrams(key)
+            candidates = set.intersection(*(self.postings.get(g, set()) for g in grams))
+            seen = set(found)
+            infix = sorted(
+                (i for i in candidates if i not in seen and allowed(i) and key in self.keys[i]),
+                key=lambda i: (len(self.keys[i]), i),
+            )
+            found.extend(infix[:limit - len(found)])
+        return [self.entries[i] for i in found]
+
+    def lookup(self, name, max_distance=2, limit=5):
+        """カード名を解決する。完全一致ならその1件、無ければ編集距離 max_distance 以内の候補を近い順に返す"""
+        key = normalize_name(name)
+        if key in self.exact:
+            return [self.entries[self.exact[key]]]
+
+        # バイグラムを多く共有するカードだけ距離を計算する
+        overlap = {}
+        for gram in bigrams(key):
+            for i in self.postings.get(gram, ()):
+                if self.entries[i]["kind"] == "card":
+                    overlap[i] = overlap.get(i, 0) + 1
+        candidates = sorted(overlap, key=overlap.get, reverse=True)[:200]
+
+        scored = []
+        for i in candidates:
+            distance = bounded_edit_distance(key, self.keys[i], max_distance)
+            if distance is not None:
+                scored.append((distance, len(self.keys[i]), i))
+        scored.sort()
+        return [self.entries[i] for _, _, i in scored[:limit]]
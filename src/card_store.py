@@ -0,0 +1,148 @@
+import csv
+import os
+import sqlite3
+import time
+from pathlib import Path
+
+DATA_DIR = Path(__file__).parent / "data"
+CARD_DB = DATA_DIR / "cards.db"
+CSV_SNAPSHOT = DATA_DIR / "cards.csv"
+
+# 検索用スナップショット（cards.csv）の列。この順で書き出す
+CSV_FIELDS = [
+    "card_name",
+    "civilization",
+    "color_type",
+    "card_type",
+    "cost",
+    "power",
+    "race",
+    "text",
+    "tags"
+]
+
+
+# =========================
+# カードデータの保存先（SQLite）
+# =========================
+class CardStore:
+    """カード名をキーにしたカードDB。スクレイパーの書き込み先であり、cards.csv の元データ"""
+
+    def __init__(self, path=CARD_DB):
+        self.path = str(path)
+        self.conn = sqlite3.connect(self.path, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        columns = ",\n".join(f"{field} TEXT NOT NULL DEFAULT ''" for field in CSV_FIELDS[1:])
+        self.conn.executescript(f"""
+            CREATE TABLE IF NOT EXISTS cards (
+                card_name TEXT PRIMARY KEY,
+                {columns},
+                detail_url TEXT,
+                first_seen REAL NOT NULL,
+                last_modified REAL NOT NULL
+            );
+            -- 取得済みの詳細URL（再録で同じカード名のURLが複数あるため cards とは別に持つ）
+            CREATE TABLE IF NOT EXISTS seen_details (
+                url TEXT PRIMARY KEY,
+                card_name TEXT NOT NULL,
+                fetched_at REAL NOT NULL
+            );
+            -- 以前のDBのカードも取得済みとして扱う（最初の差分クロールで全件を取り直さない）
+            INSERT OR IGNORE INTO seen_details(url, card_name, fetched_at)
+                SELECT detail_url, card_name, last_modified FROM cards WHERE detail_url IS NOT NULL;
+        """)
+
+    def close(self):
+        self.conn.close()
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM cards").fetchone()[0]
+
+    def names(self):
+        return {row[0] for row in self.conn.execute("SELECT card_name FROM cards")}
+
+    def seen_count(self):
+        return self.conn.execute("SELECT COUNT(*) FROM seen_details").fetchone()[0]
+
+    def known_detail_urls(self, urls):
+        """urls のうち、詳細ページを取得済みのもの（差分クロール用）"""
+        known = set()
+        for url in urls:
+            if self.conn.execute("SELECT 1 FROM seen_details WHERE url = ?", (url,)).fetchone():
+                known.add(url)
+        return known
+
+    def mark_seen(self, entries):
+        """(詳細URL, カード名) を取得済みとして記録する（旧 seen_cards.json の取り込み用）"""
+        now = time.time()
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO seen_details(url, card_name, fetched_at) VALUES (?, ?, ?)",
+                ((url, name, now) for url, name in entries if url and name),
+            )
+
+    def upsert_many(self, cards):
+        """カードをまとめて1トランザクションで登録・更新する。
+
+        内容が変わったカードだけ last_modified を更新する。戻り値は (追加数, 更新数)。
+        分割したワーカーが同じカード名（再録）を同時に書いても衝突しないよう、
+        存在確認と書き込みを1文ずつで行い、件数は changes() で数える"""
+        now = time.time()
+        inserted = updated = 0
+        insert_sql = (
+            f"INSERT INTO cards({', '.join(CSV_FIELDS)}, detail_url, first_seen, last_modified) "
+            f"VALUES ({', '.join('?' * len(CSV_FIELDS))}, ?, ?, ?) "
+            "ON CONFLICT(card_name) DO NOTHING"
+        )
+        update_sql = (
+            f"UPDATE cards SET {', '.join(f'{field} = ?' for field in CSV_FIELDS[1:])}, "
+            "detail_url = COALESCE(?, detail_url), last_modified = ? "
+            f"WHERE card_name = ? AND ({' OR '.join(f'{field} IS NOT ?' for field in CSV_FIELDS[1:])})"
+        )
+        seen_sql = "INSERT OR REPLACE INTO seen_details(url, card_name, fetched_at) VALUES (?, ?, ?)"
+        with self.conn:
+            for card in cards:
+                if not card.get("card_name"):
+                    continue
+                values = tuple(str(card.get(field) or "") for field in CSV_FIELDS)
+                if card.get("detail_url"):
+                    self.conn.execute(seen_sql, (card["detail_url"], values[0], now))
+                self.conn.execute(insert_sql, values + (card.get("detail_url"), now, now))
+                if self._changes():
+                    inserted += 1
+                    continue
+                self.conn.execute(update_sql, values[1:] + (card.get("detail_url"), now, values[0]) + values[1:])
+                updated += self._changes()
+        return inserted, updated
+
+    def _changes(self):
+        return self.conn.execute("SELECT changes()").fetchone()[0]
+
+    def import_csv(self, csv_path=CSV_SNAPSHOT):
+        """既存の cards.csv を取り込む（列数の合わない行はスキップ）。戻り値は (取り込み数, スキップ数)"""
+        cards = []
+        skipped = 0
+        with open(csv_path, newline="", encoding="utf-8-sig") as f:
+            for row in csv.DictReader(f):
+                # 列が多すぎる行は None キー、少なすぎる行は None 値になる
+                if None in row or None in row.values():
+                    skipped += 1
+                    continue
+                cards.append(row)
+        inserted, updated = self.upsert_many(cards)
+        return inserted + updated, skipped
+
+    def export_csv(self, csv_path=CSV_SNAPSHOT):
+        """検索用の cards.csv を書き出す。
+
+        行の順番（= DataFrame の index = ChromaDB の card_{idx}）は登録順で固定される"""
+        csv_path = str(csv_path)
+        tmp_path = f"{csv_path}.{os.getpid()}.tmp"  # 同時に書き出すプロセスと一時ファイルを共有しない
+        cursor = self.conn.execute(f"SELECT {', '.join(CSV_FIELDS)} FROM cards ORDER BY rowid")
+        with open(tmp_path, "w", newline="", encoding="utf-8-sig") as f:
+            writer = csv.writer(f)
+            writer.writerow(CSV_FIELDS)
+            writer.writerows(cursor)
+        os.replace(tmp_path, csv_path)
+        return len(self)
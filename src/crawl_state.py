@@ -0,0 +1,209 @@
+import os
+import socket
+import sqlite3
+import time
+
+from scraper_config import BASE_DIR
+
+# =========================
+# 設定
+# =========================
+CRAWL_DB = os.path.join(BASE_DIR, "data", "crawl_state.db")
+MAX_ATTEMPTS = 3    # これを超えて失敗した項目は再試行しない
+LEASE_SEC = 600     # 他ホストのワーカーが処理中のまま放置した項目を取り戻すまでの秒数
+
+PENDING = "pending"
+IN_PROGRESS = "in_progress"
+DONE = "done"
+FAILED = "failed"
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+# =========================
+# クロール状態（ページ・詳細URLのフロンティア）
+# =========================
+class CrawlState:
+    """一覧ページと詳細URLの処理状況を SQLite に保存し、中断・再開・分散実行を可能にする"""
+
+    def __init__(self, path=CRAWL_DB, worker_id=None, max_attempts=MAX_ATTEMPTS):
+        self.path = path
+        self.worker_id = worker_id or default_worker_id()
+        self.max_attempts = max_attempts
+        # isolation_level=None: トランザクションは BEGIN IMMEDIATE で明示的に張る
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA busy_timeout=30000")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS pages (
+                page INTEGER PRIMARY KEY,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                worker TEXT,
+                updated_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS details (
+                url TEXT PRIMARY KEY,
+                page INTEGER NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                updated_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS idx_pages_status ON pages(status, page);
+            CREATE INDEX IF NOT EXISTS idx_details_page ON details(page, status);
+        """)
+
+    def close(self):
+        self.conn.close()
+
+    def _transaction(self):
+        conn = self.conn
+
+        class Transaction:
+            def __enter__(self):
+                conn.execute("BEGIN IMMEDIATE")
+                return conn
+
+            def __exit__(self, exc_type, exc, tb):
+                conn.execute("ROLLBACK" if exc_type else "COMMIT")
+
+        return Transaction()
+
+    # ---------- ページ ----------
+    def seed_pages(self, start_page, end_page):
+        """ページ範囲をフロンティアに登録する（登録済みのページはそのまま）"""
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO pages(page) VALUES (?)",
+                ((page,) for page in range(start_page, end_page + 1)),
+            )
+
+    def page_count(self):
+        """フロンティアに登録済みのページ数（状態を問わない）"""
+        return self.conn.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+
+    def recover(self):
+        """異常終了したワーカーが処理中のまま残したページを pending に戻す"""
+        host = socket.gethostname()
+        now = time.time()
+        released = 0
+        with self._transaction() as conn:
+            rows = conn.execute(
+                "SELECT page, worker, updated_at FROM pages WHERE status = ?", (IN_PROGRESS,)
+            ).fetchall()
+            for page, worker, updated_at in rows:
+                worker_host, _, pid = (worker or "").rpartition(":")
+                if worker_host == host and pid.isdigit():
+                    dead = not _pid_alive(int(pid))
+                else:
+                    dead = (updated_at or 0) < now - LEASE_SEC
+                if dead:
+                    conn.execute(
+                        "UPDATE pages SET status = ?, worker = NULL WHERE page = ?",
+                        (PENDING, page),
+                    )
+                    released += 1
+        return released
+
+    def claim_page(self):
+        """未処理（または再試行可能な失敗）ページを1つ確保する。無ければ None"""
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT page FROM pages WHERE status IN (?, ?) AND attempts < ? "
+                "ORDER BY page LIMIT 1",
+                (PENDING, FAILED, self.max_attempts),
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE pages SET status = ?, worker = ?, attempts = attempts + 1, updated_at = ? "
+                "WHERE page = ?",
+                (IN_PROGRESS, self.worker_id, time.time(), row[0]),
+            )
+            return row[0]
+
+    def iter_pages(self):
+        """確保できる限りページを返し続ける"""
+        while True:
+            page = self.claim_page()
+            if page is None:
+                return
+            yield page
+
+    def complete_page(self, page):
+        self.conn.execute(
+            "UPDATE pages SET status = ?, last_error = NULL, updated_at = ? WHERE page = ?",
+            (DONE, time.time(), page),
+        )
+
+    def fail_page(self, page, error):
+        self.conn.execute(
+            "UPDATE pages SET status = ?, last_error = ?, updated_at = ? WHERE page = ?",
+            (FAILED, str(error), time.time(), page),
+        )
+
+    # ---------- 詳細URL ----------
+    def add_details(self, page, urls):
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO details(url, page) VALUES (?, ?)",
+                ((url, page) for url in urls),
+            )
+
+    def pending_details(self, urls):
+        """urls のうち、まだ取得していない（または再試行可能な）ものだけを順序を保って返す"""
+        done = set()
+        for url in urls:
+            row = self.conn.execute(
+                "SELECT status, attempts FROM details WHERE url = ?", (url,)
+            ).fetchone()
+            if row and (row[0] == DONE or row[1] >= self.max_attempts):
+                done.add(url)
+        return [url for url in urls if url not in done]
+
+    def complete_detail(self, url):
+        self.conn.execute(
+            "UPDATE details SET status = ?, attempts = attempts + 1, last_error = NULL, "
+            "updated_at = ? WHERE url = ?",
+            (DONE, time.time(), url),
+        )
+
+    def fail_detail(self, url, error):
+        self.conn.execute(
+            "UPDATE details SET status = ?, attempts = attempts + 1, last_error = ?, "
+            "updated_at = ? WHERE url = ?",
+            (FAILED, str(error), time.time(), url),
+        )
+
+    # ---------- 集計 ----------
+    def summary(self):
+        result = {}
+        for table in ("pages", "details"):
+            rows = self.conn.execute(
+                f"SELECT status, COUNT(*) FROM {table} GROUP BY status"
+            ).fetchall()
+            result[table] = dict(rows)
+        return result
+
+    def failures(self, limit=20):
+        return self.conn.execute(
+            "SELECT 'page', page, attempts, last_error FROM pages WHERE status = ? "
+            "UNION ALL "
+            "SELECT 'detail', url, attempts, last_error FROM details WHERE status = ? "
+            "LIMIT ?",
+            (FAILED, FAILED, limit),
+        ).fetchall()
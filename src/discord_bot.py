@@ -5,14 +5,22 @@ import os
 from dotenv import load_dotenv
 from pathlib import Path
 import sys
+import io
+import json
+import time
+import asyncio
+from array import array
 
-# search.py をインポート
 sys.path.append(str(Path(__file__).parent))
-from search import DuelMastersHybridSearch
+from search_executor import SearchExecutor, SearchRejected, normalize_query
+from search_metrics import SearchMetrics, summary_lines
 
 # 環境変数を読み込み
 load_dotenv()
 TOKEN = os.getenv('DISCORD_TOKEN')
+# 設定されていれば検索サーバー（search_server.py）に接続し、Bot内にインデックスを持たない
+SEARCH_SERVER_URL = os.getenv('SEARCH_SERVER_URL')
+HELP_VERSION_TIMEOUT_SEC = 2  # /help でインデックスのバージョンを待つ上限（応答期限は3秒）
 
 # Bot の設定
 intents = discord.Intents.default()
@@ -22,6 +30,26 @@ bot = commands.Bot(command_prefix='!', intents=intents)
 # 検索システムを初期化（起動時に1回だけ）
 searcher = None
 
+# 検索はワーカースレッドで実行する（重い検索が他のコマンドを止めないように）
+executor = SearchExecutor()
+
+# Bot側の処理時間（ページの整形・応答まで）。検索パイプライン側は searcher が計測する
+bot_metrics = SearchMetrics(log_path=None)
+
+def create_searcher():
+    """検索サーバーのクライアント、または Bot 内の検索エンジンを作る（重い import もここで行う）"""
+    if SEARCH_SERVER_URL:
+        from search_client import SearchClient
+        client = SearchClient(SEARCH_SERVER_URL)
+        print(f"検索サーバー: {SEARCH_SERVER_URL} ({client.health()['cards']}枚)")
+        return client
+    
+    from search import DuelMastersHybridSearch
+    engine = DuelMastersHybridSearch()
+    # prepare_database.py でインデックスを再構築したら再起動なしで切り替える
+    engine.start_watcher()
+    return engine
+
 @bot.event
 async def on_ready():
     """Bot起動時の処理"""
@@ -30,11 +58,12 @@ async def on_ready():
     print(f'✅ {bot.user} としてログインしました')
     print(f'サーバー数: {len(bot.guilds)}')
     
-    # 検索システムを初期化
+    # 検索システムを初期化（モジュールの読み込み・インデックスの読み込みはイベントループの外で行う）
     print("検索システムを初期化中...")
     try:
-        searcher = DuelMastersHybridSearch()
-        print("✅ 検索システム準備完了！")
+        started = time.perf_counter()
+        searcher = await asyncio.to_thread(create_searcher)
+        print(f"✅ 検索システム準備完了！（{time.perf_counter() - started:.1f}秒）")
     except Exception as e:
         print(f"❌ 検索システムの初期化エラー: {e}")
     
@@ -45,96 +74,416 @@ async def on_ready():
     except Exception as e:
         print(f"❌ コマンド同期エラー: {e}")
 
+# =========================
+# 検索結果の表示
+# =========================
+DISPLAY_FIELDS = ['card_name', 'civilization', 'card_type', 'cost', 'power', 'race', 'text']
+TEXT_PREVIEW_LEN = 100  # 一覧で表示する効果テキストの長さ
+
+
+def has_value(value):
+    return bool(value) and str(value) != 'nan'
+
+
+class CardLookup:
+    """全ビューで共有する card_idx -> 表示用レコード の表
+
+    1枚につき1レコードしか持たないため、カード総数で頭打ちになる。
+    インデックスの再構築で同じ card_idx が別のカードを指すようになったら新しい表に切り替え、
+    古い表は、それを参照しているビューがタイムアウトすれば解放される"""
+    
+    def __init__(self):
+        self.records = {}
+    
+    def remember(self, ranked_df):
+        """検索結果を表に登録し、(card_idx の配列, 参照すべき表) を返す"""
+        cards = ranked_df[DISPLAY_FIELDS].to_dict(orient='records')
+        card_ids = array('i', (int(idx) for idx in ranked_df.index))
+        
+        if any(idx in self.records and self.records[idx]['card_name'] != card['card_name']
+               for idx, card in zip(card_ids, cards)):
+            self.records = {}
+        
+        for idx, card in zip(card_ids, cards):
+            if idx in self.records:
+                continue
+            if has_value(card['text']) and len(str(card['text'])) > TEXT_PREVIEW_LEN:
+                card['text'] = str(card['text'])[:TEXT_PREVIEW_LEN] + "..."
+            self.records[idx] = card
+        return card_ids, self.records
+
+
+card_lookup = CardLookup()
+
+
+# ページネーション用のViewクラス
+class PaginationView(discord.ui.View):
+    """カードID の配列と共有の表だけを持ち、各ページは初回表示時に1回だけ整形してキャッシュする"""
+    
+    def __init__(self, card_ids, records, per_page=5):
+        super().__init__(timeout=180)  # 3分でタイムアウト
+        self.per_page = per_page
+        self.current_page = 0
+        self.set_results(card_ids, records)
+    
+    def set_results(self, card_ids, records):
+        """表示するカードを差し替える（整形済みのページは破棄）"""
+        self.card_ids = card_ids
+        self.records = records
+        self.max_page = max(0, (len(card_ids) - 1) // self.per_page)
+        self.current_page = min(self.current_page, self.max_page)
+        self.pages = {}
+        
+        # 5件以下ならボタンを削除
+        if len(card_ids) <= self.per_page:
+            self.clear_items()
+    
+    def format_page(self):
+        """現在のページを整形（キャッシュ済みならそれを返す）"""
+        page = self.pages.get(self.current_page)
+        if page is None:
+            page = self.pages[self.current_page] = self._render(self.current_page)
+        return page
+    
+    def _render(self, page_no):
+        with bot_metrics.span("render", candidates=self.per_page):
+            return self._render_page(page_no)
+    
+    def _render_page(self, page_no):
+        total = len(self.card_ids)
+        start = page_no * self.per_page
+        
+        # 5件以下の場合はページ番号を表示しない
+        if total <= self.per_page:
+            lines = [f"**検索結果: {total}件**\n"]
+        else:
+            lines = [f"**検索結果: {total}件** （ページ {page_no + 1}/{self.max_page + 1}）\n"]
+        
+        for i, idx in enumerate(self.card_ids[start:start + self.per_page], start + 1):
+            card = self.records[idx]
+            lines.append(f"**【{i}】{card['card_name']}**")
+            lines.append(f"└ 文明: {card['civilization']} | タイプ: {card['card_type']}")
+            lines.append(f"└ コスト: {card['cost']} | パワー: {card['power']}")
+            if has_value(card['race']):
+                lines.append(f"└ 種族: {card['race']}")
+            if has_value(card['text']):
+                lines.append(f"└ 効果: {card['text']}")
+            lines.append("")
+        
+        return "\n".join(lines) + "\n"
+    
+    @discord.ui.button(label="◀️ 前へ", style=discord.ButtonStyle.primary)
+    async def previous_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+        if self.current_page > 0:
+            self.current_page -= 1
+            await interaction.response.edit_message(content=self.format_page(), view=self)
+        else:
+            await interaction.response.send_message("最初のページです", ephemeral=True)
+    
+    @discord.ui.button(label="次へ ▶️", style=discord.ButtonStyle.primary)
+    async def next_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+        if self.current_page < self.max_page:
+            self.current_page += 1
+            await interaction.response.edit_message(content=self.format_page(), view=self)
+        else:
+            await interaction.response.send_message("最後のページです", ephemeral=True)
+
+
+def run_search(query, on_provisional=None):
+    """検索パイプライン本体（ブロッキング処理なのでワーカースレッドで実行する）"""
+    return searcher.find_cards(query, top_k=50, on_provisional=on_provisional)
+
+
 @bot.tree.command(name="search", description="デュエル・マスターズのカードを検索")
 @app_commands.describe(query="検索条件（例: コスト5以上の革命チェンジ先のドラゴン）")
 async def search_card(interaction: discord.Interaction, query: str):
     """カード検索コマンド"""
+    if searcher is None:
+        await interaction.response.send_message("❌ 検索システムの準備ができていません", ephemeral=True)
+        return
+    
+    started = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    deferred = asyncio.Event()
+    provisional = []
+    
+    async def show_provisional(cards_df):
+        """暫定の上位結果を先に表示する（確定結果で置き換える）"""
+        await deferred.wait()
+        view = PaginationView(*card_lookup.remember(cards_df))
+        await interaction.edit_original_response(
+            content=view.format_page() + "-# 🔄 暫定結果です。ランキングを計算中…", view=None
+        )
+        bot_metrics.observe("reply.first", time.perf_counter() - started)
+    
+    def on_provisional(cards_df):
+        # ワーカースレッドから呼ばれるので、表示はイベントループに任せる
+        provisional.append(asyncio.run_coroutine_threadsafe(show_provisional(cards_df), loop))
+    
+    # 混雑状況・ユーザーごとの上限を確認してから受け付ける
+    try:
+        ticket = executor.submit(interaction.user.id, normalize_query(query), run_search, query, on_provisional)
+    except SearchRejected as e:
+        await interaction.response.send_message(e.message, ephemeral=True)
+        return
     
     # 即座に応答（処理が長い場合のため）
     await interaction.response.defer()
+    deferred.set()
     
     try:
-        # 検索実行
-        conditions = searcher.extract_search_conditions(query)
+        if ticket.queued:
+            await interaction.edit_original_response(
+                content=f"⏳ 検索が混み合っています。順番待ち中です（{ticket.queued}件目）"
+            )
         
-        if not conditions:
-            await interaction.followup.send("❌ 検索条件の抽出に失敗しました")
-            return
+        # 検索実行（ワーカースレッド上。イベントループはブロックしない）
+        ranked_df, error = await ticket.wait()
         
-        filtered_df = searcher.filter_by_conditions(conditions)
+        # 暫定結果の表示が終わってから確定結果で上書きする
+        for future in provisional:
+            try:
+                await asyncio.wrap_future(future)
+            except Exception as e:
+                print(f"暫定結果の表示エラー: {e}")
         
-        if len(filtered_df) == 0:
-            await interaction.followup.send("❌ 条件に合うカードが見つかりませんでした")
+        if error:
+            await interaction.edit_original_response(content=error)
             return
         
-        ranked_df = searcher.rank_by_vector_search(filtered_df, query, top_k=50)
-        
-        # ページネーション用のViewクラス
-        class PaginationView(discord.ui.View):
-            def __init__(self, cards_df, per_page=5):
-                super().__init__(timeout=180)  # 3分でタイムアウト
-                self.cards_df = cards_df
-                self.per_page = per_page
-                self.current_page = 0
-                self.max_page = (len(cards_df) - 1) // per_page
-                
-                # 5件以下ならボタンを削除
-                if len(cards_df) <= per_page:
-                    self.clear_items()
-                
-            def format_page(self):
-                """現在のページを整形"""
-                start = self.current_page * self.per_page
-                end = start + self.per_page
-                page_cards = self.cards_df.iloc[start:end]
-                
-                # 5件以下の場合はページ番号を表示しない
-                if len(self.cards_df) <= self.per_page:
-                    result_text = f"**検索結果: {len(self.cards_df)}件**\n\n"
-                else:
-                    result_text = f"**検索結果: {len(self.cards_df)}件** （ページ {self.current_page + 1}/{self.max_page + 1}）\n\n"
-                
-                for i, (idx, card) in enumerate(page_cards.iterrows(), start + 1):
-                    result_text += f"**【{i}】{card['card_name']}**\n"
-                    result_text += f"└ 文明: {card['civilization']} | タイプ: {card['card_type']}\n"
-                    result_text += f"└ コスト: {card['cost']} | パワー: {card['power']}\n"
-                    
-                    if card['race'] and str(card['race']) != 'nan':
-                        result_text += f"└ 種族: {card['race']}\n"
-                    
-                    # 効果テキストを短縮
-                    if card['text'] and str(card['text']) != 'nan':
-                        text = str(card['text'])[:100] + "..." if len(str(card['text'])) > 100 else str(card['text'])
-                        result_text += f"└ 効果: {text}\n"
-                    
-                    result_text += "\n"
-                
-                return result_text
-            
-            @discord.ui.button(label="◀️ 前へ", style=discord.ButtonStyle.primary)
-            async def previous_button(self, interaction: discord.Interaction, button: discord.ui.Button):
-                if self.current_page > 0:
-                    self.current_page -= 1
-                    await interaction.response.edit_message(content=self.format_page(), view=self)
-                else:
-                    await interaction.response.send_message("最初のページです", ephemeral=True)
-            
-            @discord.ui.button(label="次へ ▶️", style=discord.ButtonStyle.primary)
-            async def next_button(self, interaction: discord.Interaction, button: discord.ui.Button):
-                if self.current_page < self.max_page:
-                    self.current_page += 1
-                    await interaction.response.edit_message(content=self.format_page(), view=self)
-                else:
-                    await interaction.response.send_message("最後のページです", ephemeral=True)
-        
         # ページネーションビューを作成
-        view = PaginationView(ranked_df)
-        await interaction.followup.send(view.format_page(), view=view)
+        view = PaginationView(*card_lookup.remember(ranked_df))
+        await interaction.edit_original_response(content=view.format_page(), view=view)
+        
+        elapsed = time.perf_counter() - started
+        bot_metrics.observe("reply.final", elapsed)
+        if not provisional:
+            bot_metrics.observe("reply.first", elapsed)
         
     except Exception as e:
         await interaction.followup.send(f"❌ エラーが発生しました: {str(e)}")
         print(f"検索エラー: {e}")
 
+
+async def search_autocomplete(interaction: discord.Interaction, current: str):
+    """入力中の最後の語をカード名・公式キーワード・種族で補完する（LLMは使わない）"""
+    if searcher is None or not current.strip():
+        return []
+    head, _, last = current.rpartition(" ")
+    try:
+        entries = await bot.loop.run_in_executor(None, searcher.complete, last or current, 25)
+    except Exception as e:
+        print(f"補完エラー: {e}")
+        return []
+    choices = []
+    for entry in entries:
+        value = f"{head} {entry['label']}" if head else entry['label']
+        if len(value) <= 100:
+            choices.append(app_commands.Choice(name=value, value=value))
+    return choices
+
+
+async def card_name_autocomplete(interaction: discord.Interaction, current: str):
+    """/card 用: カード名だけを補完する"""
+    if searcher is None or not current.strip():
+        return []
+    try:
+        entries = await bot.loop.run_in_executor(None, searcher.complete, current, 25, ["card"])
+    except Exception as e:
+        print(f"補完エラー: {e}")
+        return []
+    return [
+        app_commands.Choice(name=entry['label'], value=entry['label'])
+        for entry in entries if len(entry['label']) <= 100
+    ]
+
+
+search_card.autocomplete("query")(search_autocomplete)
+
+
+def format_card_detail(card):
+    """1枚分の詳細を整形"""
+    text = f"**{card['card_name']}**\n"
+    text += f"└ 文明: {card['civilization']} | タイプ: {card['card_type']}\n"
+    text += f"└ コスト: {card['cost']} | パワー: {card['power']}\n"
+    if card.get('race'):
+        text += f"└ 種族: {card['race']}\n"
+    if card.get('text'):
+        text += f"└ 効果:\n{card['text']}\n"
+    return text[:2000]
+
+
+async def send_similar(interaction, card_idx, card_name, civilization=None, cost_min=None, cost_max=None):
+    """事前計算した類似グラフから「似たカード」を返信する"""
+    civilizations = [civilization] if civilization else None
+    try:
+        similar_df, error = await bot.loop.run_in_executor(
+            None, lambda: searcher.similar_cards(
+                card_idx, civilizations=civilizations, cost_min=cost_min, cost_max=cost_max
+            )
+        )
+    except Exception as e:
+        await interaction.response.send_message(f"❌ エラーが発生しました: {str(e)}", ephemeral=True)
+        print(f"類似カードエラー: {e}")
+        return
+    
+    if error:
+        await interaction.response.send_message(error, ephemeral=True)
+        return
+    
+    view = PaginationView(*card_lookup.remember(similar_df))
+    await interaction.response.send_message(content=f"🔍 **{card_name}** に似たカード\n" + view.format_page(), view=view)
+
+
+class CardView(discord.ui.View):
+    """/card の結果に付けるボタン"""
+    
+    def __init__(self, card_idx, card_name):
+        super().__init__(timeout=180)
+        self.card_idx = card_idx
+        self.card_name = card_name
+    
+    @discord.ui.button(label="似たカード", style=discord.ButtonStyle.secondary)
+    async def similar_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await send_similar(interaction, self.card_idx, self.card_name)
+
+
+@bot.tree.command(name="card", description="カード名でカードを表示（多少の表記揺れ・誤字は自動で補正）")
+@app_commands.describe(name="カード名")
+@app_commands.autocomplete(name=card_name_autocomplete)
+async def card_command(interaction: discord.Interaction, name: str):
+    """カード名引きコマンド（ベクトル検索・LLMを使わない）"""
+    if searcher is None:
+        await interaction.response.send_message("❌ 検索システムの準備ができていません", ephemeral=True)
+        return
+    
+    try:
+        card, candidates = await bot.loop.run_in_executor(None, searcher.lookup_card, name)
+    except Exception as e:
+        await interaction.response.send_message(f"❌ エラーが発生しました: {str(e)}", ephemeral=True)
+        print(f"カード引きエラー: {e}")
+        return
+    
+    if card is None:
+        await interaction.response.send_message(
+            f"「{name}」に一致するカードが見つかりませんでした。`/search` もお試しください", ephemeral=True
+        )
+        return
+    
+    content = format_card_detail(card)
+    others = [label for label in candidates if label != card['card_name']]
+    if others:
+        content += "\n-# 他の候補: " + " / ".join(others)
+    await interaction.response.send_message(content[:2000], view=CardView(card['card_idx'], card['card_name']))
+
+
+@bot.tree.command(name="similar", description="指定したカードに似たカードを表示")
+@app_commands.describe(
+    name="カード名",
+    civilization="文明で絞り込み（例: 火）",
+    cost_min="コストの下限",
+    cost_max="コストの上限",
+)
+@app_commands.autocomplete(name=card_name_autocomplete)
+async def similar_command(interaction: discord.Interaction, name: str, civilization: str = None,
+                          cost_min: int = None, cost_max: int = None):
+    """似たカードコマンド（LLMを使わず即答する）"""
+    if searcher is None:
+        await interaction.response.send_message("❌ 検索システムの準備ができていません", ephemeral=True)
+        return
+    
+    try:
+        card, _ = await bot.loop.run_in_executor(None, searcher.lookup_card, name)
+    except Exception as e:
+        await interaction.response.send_message(f"❌ エラーが発生しました: {str(e)}", ephemeral=True)
+        print(f"カード引きエラー: {e}")
+        return
+    
+    if card is None:
+        await interaction.response.send_message(f"「{name}」に一致するカードが見つかりませんでした", ephemeral=True)
+        return
+    
+    await send_similar(interaction, card['card_idx'], card['card_name'], civilization, cost_min, cost_max)
+
+def collect_stats():
+    """(区間ごとの集計, Prometheus 形式のテキスト) を検索側とBot側を合わせて返す"""
+    if isinstance(getattr(searcher, "metrics", None), SearchMetrics):
+        spans, prometheus = searcher.metrics.snapshot(), searcher.metrics.prometheus()
+    else:
+        spans, prometheus = searcher.metrics_snapshot()
+    for name, stats in bot_metrics.snapshot().items():
+        spans[f"bot.{name}"] = stats
+    return spans, prometheus + bot_metrics.prometheus().replace('span="', 'span="bot.')
+
+
+@bot.tree.command(name="searchstats", description="（管理者用）検索の区間ごとの処理時間を表示")
+@app_commands.describe(format="summary: 一覧 / prometheus: Prometheus形式 / jsonl: JSON")
+@app_commands.choices(format=[
+    app_commands.Choice(name="summary", value="summary"),
+    app_commands.Choice(name="prometheus", value="prometheus"),
+    app_commands.Choice(name="jsonl", value="jsonl"),
+])
+@app_commands.default_permissions(administrator=True)
+async def search_stats(interaction: discord.Interaction, format: str = "summary"):
+    """検索パイプラインの計測結果（管理者用）"""
+    if searcher is None:
+        await interaction.response.send_message("❌ 検索システムの準備ができていません", ephemeral=True)
+        return
+    
+    spans, prometheus = await bot.loop.run_in_executor(None, collect_stats)
+    if format == "prometheus":
+        body = prometheus
+    elif format == "jsonl":
+        body = json.dumps({"ts": round(time.time(), 3), "event": "summary", "spans": spans}, ensure_ascii=False) + "\n"
+    else:
+        lines = summary_lines(spans)
+        body = "\n".join(lines) or "まだ計測データがありません"
+    
+    if len(body) > 1900:
+        await interaction.response.send_message(
+            file=discord.File(io.BytesIO(body.encode("utf-8")), filename=f"search_stats.{'txt' if format != 'jsonl' else 'jsonl'}"),
+            ephemeral=True,
+        )
+    else:
+        await interaction.response.send_message(f"```\n{body}\n```", ephemeral=True)
+
+
+@bot.tree.command(name="searchprofile", description="（管理者用）1件の検索を cProfile / tracemalloc 付きで実行")
+@app_commands.describe(query="計測する検索条件")
+@app_commands.default_permissions(administrator=True)
+async def search_profile(interaction: discord.Interaction, query: str):
+    """1リクエスト分のトレース・プロファイルを返す（管理者用）"""
+    if searcher is None:
+        await interaction.response.send_message("❌ 検索システムの準備ができていません", ephemeral=True)
+        return
+    
+    await interaction.response.defer(ephemeral=True)
+    
+    def run_profile():
+        if isinstance(getattr(searcher, "metrics", None), SearchMetrics):
+            with searcher.metrics.trace(query, cpu=True, memory=True) as trace:
+                searcher.find_cards(query, top_k=50)
+            return trace.to_dict()
+        return searcher.profile(query)
+    
+    try:
+        trace = await bot.loop.run_in_executor(None, run_profile)
+    except Exception as e:
+        await interaction.followup.send(f"❌ エラーが発生しました: {str(e)}", ephemeral=True)
+        return
+    
+    spans = "\n".join(
+        f"{span['name']}: {span['ms']:.0f}ms" + (f" ({span['candidates']}件)" if "candidates" in span else "")
+        for span in trace["spans"]
+    )
+    summary = f"合計 {trace['total_ms']:.0f}ms / メモリピーク {trace.get('peak_kb', '-')}KB\n{spans}"
+    await interaction.followup.send(
+        f"```\n{summary[:1800]}\n```",
+        file=discord.File(io.BytesIO(trace.get("profile", "").encode("utf-8")), filename="profile.txt"),
+        ephemeral=True,
+    )
+
+
 @bot.tree.command(name="help", description="使い方を表示")
 async def help_command(interaction: discord.Interaction):
     """ヘルプコマンド"""
@@ -143,6 +492,8 @@ async def help_command(interaction: discord.Interaction):
 
 **使い方:**
 `/search` コマンドで検索ができます
+`/card` コマンドでカード名から直接カードを表示できます
+`/similar` コマンド（または `/card` の「似たカード」ボタン）で似たカードを表示できます
 **カード検索を行う場合は、BotとのDM（ダイレクトメッセージ）でご利用ください！**
 
 **検索例:**
@@ -152,6 +503,7 @@ async def help_command(interaction: discord.Interaction):
 • `/search 自然の重量マッハファイター`
 • `/search ハンデスできる軽量クリーチャー`
 • `/search 軽量バウンス呪文`
+• `/card ボルシャック・ドラゴン`
 
 
 **注意事項:**
@@ -159,6 +511,16 @@ async def help_command(interaction: discord.Interaction):
 • キーワードなどは略さず、できるだけ正確に入力してください。例：「5コス」ではなく「5コスト」
 • 問題が発生した場合は管理者にお問い合わせください
     """
+    if searcher is not None:
+        # 検索サーバー経由だと index_version は HTTP 呼び出しになるので、イベントループの外で取る
+        # （応答期限に間に合わなければバージョンの表示だけ省く）
+        try:
+            version = await asyncio.wait_for(
+                bot.loop.run_in_executor(None, lambda: searcher.index_version), timeout=HELP_VERSION_TIMEOUT_SEC
+            )
+            help_text += f"\n-# インデックス: {version}"
+        except Exception:
+            pass
     await interaction.response.send_message(help_text)
 
 # Bot を起動
@@ -0,0 +1,163 @@
+import math
+import os
+import unicodedata
+import zlib
+from collections import Counter
+
+import numpy as np
+
+# =========================
+# 設定
+# =========================
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "ollama")  # "ollama" または "hashed"
+OLLAMA_MODEL = "nomic-embed-text"
+OLLAMA_DIM = 768
+HASHED_DIM = 256           # 射影後の次元
+HASHED_BUCKETS = 1 << 15   # n-gram をハッシュする先の数
+HASHED_NGRAMS = (1, 2, 3)  # 使う文字 n-gram の長さ
+HASHED_SEED = 0
+
+
+class EmbeddingMismatch(RuntimeError):
+    """インデックスを構築した埋め込みと、検索側の埋め込みの設定が違う"""
+
+
+# =========================
+# Ollama（nomic-embed-text）
+# =========================
+class OllamaEmbedder:
+    """Ollama のサーバーで埋め込みを計算する（従来の動作）"""
+
+    backend = "ollama"
+
+    def __init__(self, model=OLLAMA_MODEL, dim=OLLAMA_DIM):
+        self.model = model
+        self.dim = dim
+
+    def embed(self, text):
+        import ollama_router
+
+        return ollama_router.embeddings(model=self.model, prompt=text)['embedding']
+
+    def embed_many(self, texts):
+        import ollama_router
+
+        return ollama_router.embed(model=self.model, input=list(texts))['embeddings']
+
+    def describe(self):
+        return {"backend": self.backend, "model": self.model, "dim": self.dim}
+
+    def save(self, path):
+        return None
+
+    @classmethod
+    def from_metadata(cls, meta, index_dir):
+        return cls(model=meta.get("model", OLLAMA_MODEL), dim=meta.get("dim", OLLAMA_DIM))
+
+
+# =========================
+# プロセス内の文字 n-gram 埋め込み
+# =========================
+class HashedNgramEmbedder:
+    """文字 n-gram を TF-IDF で重み付けし、乱数の射影で低次元にする（外部サーバー・モデル不要）
+
+    IDF はインデックス構築時に fit() でカードのテキストから求め、インデックスと一緒に保存する。
+    射影行列は seed から毎回同じものを作るので保存しない"""
+
+    backend = "hashed"
+
+    def __init__(self, dim=HASHED_DIM, buckets=HASHED_BUCKETS, ngrams=HASHED_NGRAMS, seed=HASHED_SEED, idf=None):
+        self.dim = dim
+        self.buckets = buckets
+        self.ngrams = tuple(ngrams)
+        self.seed = seed
+        self.idf = idf if idf is not None else np.ones(buckets, dtype=np.float32)
+        # ±1 の乱数射影（Achlioptas）。buckets × dim
+        rng = np.random.default_rng(seed)
+        self.projection = (rng.integers(0, 2, size=(buckets, dim), dtype=np.int8) * 2 - 1).astype(np.float32)
+        self.projection /= math.sqrt(dim)
+
+    def _buckets(self, text):
+        text = unicodedata.normalize("NFKC", str(text)).lower()
+        counts = Counter()
+        for n in self.ngrams:
+            for i in range(len(text) - n + 1):
+                # Python の hash() は実行ごとに変わるので crc32 を使う
+                counts[zlib.crc32(text[i:i + n].encode("utf-8")) % self.buckets] += 1
+        return counts
+
+    def fit(self, texts):
+        """コーパスの文書頻度から IDF を求める"""
+        df = np.zeros(self.buckets, dtype=np.float64)
+        n_docs = 0
+        for text in texts:
+            n_docs += 1
+            for bucket in self._buckets(text):
+                df[bucket] += 1
+        self.idf = (np.log((1 + n_docs) / (1 + df)) + 1).astype(np.float32)
+        return self
+
+    def embed(self, text):
+        return self.embed_many([text])[0]
+
+    def embed_many(self, texts):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            counts = self._buckets(text)
+            if not counts:
+                continue
+            buckets = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+            tf = np.log1p(np.fromiter(counts.values(), dtype=np.float32, count=len(counts)))
+            vectors[row] = (tf * self.idf[buckets]) @ self.projection[buckets]
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors /= np.where(norms == 0, 1, norms)
+        return vectors.tolist()
+
+    def describe(self):
+        return {
+            "backend": self.backend,
+            "dim": self.dim,
+            "buckets": self.buckets,
+            "ngrams": list(self.ngrams),
+            "seed": self.seed,
+        }
+
+    def save(self, path):
+        """IDF を保存する（インデックスと一緒に使う）"""
+        np.save(path, self.idf)
+        return path
+
+    @classmethod
+    def from_metadata(cls, meta, index_dir):
+        idf = np.load(index_dir / meta["state"]) if meta.get("state") else None
+        return cls(dim=meta["dim"], buckets=meta["buckets"], ngrams=meta["ngrams"], seed=meta["seed"], idf=idf)
+
+
+BACKENDS = {
+    OllamaEmbedder.backend: OllamaEmbedder,
+    HashedNgramEmbedder.backend: HashedNgramEmbedder,
+}
+
+
+def create_embedder(backend=None):
+    """インデックス構築用に新しい埋め込みを作る"""
+    backend = backend or EMBEDDING_BACKEND
+    if backend not in BACKENDS:
+        raise ValueError(f"不明な埋め込みバックエンド: {backend}（{', '.join(BACKENDS)} のいずれか）")
+    return BACKENDS[backend]()
+
+
+def load_embedder(meta, index_dir, expected_backend=None):
+    """インデックスの記録（manifest の embedding）から埋め込みを復元する
+
+    expected_backend と違うバックエンドで構築されていたら EmbeddingMismatch"""
+    meta = meta or OllamaEmbedder().describe()  # 記録の無い旧インデックスは Ollama で構築されたもの
+    expected_backend = expected_backend or EMBEDDING_BACKEND
+    if meta["backend"] != expected_backend:
+        raise EmbeddingMismatch(
+            f"インデックスは埋め込み '{meta['backend']}' で構築されていますが、検索側の設定は "
+            f"'{expected_backend}' です（EMBEDDING_BACKEND を合わせるか、prepare_database.py で再構築してください）"
+        )
+    if meta["backend"] not in BACKENDS:
+        raise EmbeddingMismatch(f"不明な埋め込みバックエンド: {meta['backend']}")
+    return BACKENDS[meta["backend"]].from_metadata(meta, index_dir)
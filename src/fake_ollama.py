@@ -0,0 +1,140 @@
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from semantic_cache import rule_based_conditions
+
+# =========================
+# 設定
+# =========================
+EMBED_DIM = 768  # nomic-embed-text と同じ次元
+
+
+def fake_vector(text, dim=EMBED_DIM):
+    """文字バイグラムをハッシュして作る決定的なベクトル（共通の文字列が多いほど類似度が高い）"""
+    vector = np.zeros(dim, dtype=np.float32)
+    text = str(text)
+    for i in range(max(len(text) - 1, 1)):
+        digest = hashlib.blake2b(text[i:i + 2].encode("utf-8"), digest_size=8).digest()
+        h = int.from_bytes(digest, "little")
+        vector[h % dim] += 1.0 if (h >> 32) & 1 else -1.0
+    norm = np.linalg.norm(vector)
+    return (vector / norm if norm else vector).tolist()
+
+
+# =========================
+# ollama の代役
+# =========================
+class FakeOllama:
+    """ollama.chat / embeddings / embed の代役（レイテンシは設定可能、ベクトルは決定的）
+
+    install() でプロセス内の ollama モジュールを差し替え、serve() で Ollama 互換の HTTP サーバーとして動く"""
+
+    def __init__(self, dim=EMBED_DIM, chat_latency=0.0, embed_latency=0.0, embed_item_latency=0.0,
+                 keywords=(), races=(), conditions=None, error_rate=0.0):
+        self.dim = dim
+        self.chat_latency = chat_latency              # chat 1回あたりの秒数
+        self.embed_latency = embed_latency            # 埋め込み呼び出し1回あたりの秒数
+        self.embed_item_latency = embed_item_latency  # 埋め込み1件ごとに加算する秒数
+        self.keywords = list(keywords)
+        self.races = list(races)
+        self.conditions = conditions  # クエリ -> 条件 dict の関数（省略時はルールベース）
+        self.error_rate = error_rate  # serve() で 500 を返す割合（ルーターの切り離しの確認用）
+        self.calls = {"chat": 0, "embeddings": 0, "embed": 0, "embed_items": 0}
+        self._lock = threading.Lock()
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self.calls[name] += n
+
+    def chat(self, model=None, messages=None, options=None, **kwargs):
+        self._count("chat")
+        time.sleep(self.chat_latency)
+        prompt = messages[-1]["content"] if messages else ""
+        match = re.search(r"検索クエリ: 「(.*?)」", prompt)
+        query = match.group(1) if match else prompt
+        if self.conditions is not None:
+            conditions = self.conditions(query)
+        else:
+            conditions = rule_based_conditions(query, self.keywords, self.races)
+        return {"model": model, "message": {"role": "assistant", "content": json.dumps(conditions, ensure_ascii=False)}}
+
+    def embeddings(self, model=None, prompt=None, **kwargs):
+        self._count("embeddings")
+        self._count("embed_items")
+        time.sleep(self.embed_latency + self.embed_item_latency)
+        return {"embedding": fake_vector(prompt, self.dim)}
+
+    def embed(self, model=None, input=None, **kwargs):
+        texts = [input] if isinstance(input, str) else list(input)
+        self._count("embed")
+        self._count("embed_items", len(texts))
+        time.sleep(self.embed_latency + self.embed_item_latency * len(texts))
+        return {"model": model, "embeddings": [fake_vector(text, self.dim) for text in texts]}
+
+    def install(self):
+        """プロセス内の ollama.chat / embeddings / embed をこの代役に差し替える"""
+        import ollama
+
+        ollama.chat = self.chat
+        ollama.embeddings = self.embeddings
+        ollama.embed = self.embed
+        return self
+
+    def serve(self, host="127.0.0.1", port=0):
+        """Ollama 互換の HTTP サーバーをバックグラウンドで起動する（OLLAMA_HOST に渡して使う）"""
+        server = ThreadingHTTPServer((host, port), _make_handler(self))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+def _make_handler(fake):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _failed(self):
+            if fake.error_rate and random.random() < fake.error_rate:
+                self._reply(500, {"error": "fake ollama: injected error"})
+                return True
+            return False
+
+        def _reply(self, status, payload):
+            data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self._failed():
+                return
+            if self.path == "/api/tags":
+                self._reply(200, {"models": []})
+            else:
+                self._reply(404, {"error": "not found"})
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if self._failed():
+                return
+            if self.path == "/api/chat":
+                result = fake.chat(body.get("model"), body.get("messages"))
+                self._reply(200, {**result, "created_at": "1970-01-01T00:00:00Z", "done": True})
+            elif self.path == "/api/embeddings":
+                self._reply(200, fake.embeddings(body.get("model"), body.get("prompt")))
+            elif self.path == "/api/embed":
+                self._reply(200, fake.embed(body.get("model"), body.get("input")))
+            else:
+                self._reply(404, {"error": "not found"})
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
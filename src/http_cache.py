@@ -0,0 +1,96 @@
+import gzip
+import hashlib
+import json
+import os
+import time
+
+from scraper_config import BASE_DIR
+
+CACHE_DIR = os.path.join(BASE_DIR, "data", "http_cache")
+
+
+# =========================
+# ディスク上のHTTPレスポンスキャッシュ
+# =========================
+class HttpCache:
+    """URLをキーに本文（gzip圧縮）と ETag / Last-Modified を保存する"""
+
+    def __init__(self, directory=CACHE_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _paths(self, url):
+        key = hashlib.sha1(url.encode("utf-8")).hexdigest()
+        base = os.path.join(self.directory, key[:2], key)
+        return base + ".json", base + ".html.gz"
+
+    def get_meta(self, url):
+        meta_path, _ = self._paths(url)
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def load_body(self, url):
+        """キャッシュ済みの本文（bytes）を返す。無ければ None"""
+        _, body_path = self._paths(url)
+        if not os.path.exists(body_path):
+            return None
+        with gzip.open(body_path, "rb") as f:
+            return f.read()
+
+    def conditional_headers(self, url):
+        """条件付きリクエスト用のヘッダー（本文が残っていなければ送らない。304 を受けても使えないため）"""
+        meta = self.get_meta(url)
+        headers = {}
+        if meta and os.path.exists(self._paths(url)[1]):
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+        return headers
+
+    def store(self, url, body, headers, kind):
+        """200 レスポンスを保存する（kind: "listing" / "detail"）"""
+        meta_path, body_path = self._paths(url)
+        os.makedirs(os.path.dirname(meta_path), exist_ok=True)
+
+        tmp_path = body_path + ".tmp"
+        with gzip.open(tmp_path, "wb", compresslevel=6) as f:
+            f.write(body)
+        os.replace(tmp_path, body_path)
+
+        meta = {
+            "url": url,
+            "kind": kind,
+            "etag": headers.get("ETag"),
+            "last_modified": headers.get("Last-Modified"),
+            "fetched_at": time.time(),
+            "validated_at": time.time(),
+        }
+        self._write_meta(meta_path, meta)
+
+    def mark_validated(self, url):
+        """304 Not Modified を受けたときに検証日時だけ更新する"""
+        meta_path, _ = self._paths(url)
+        meta = self.get_meta(url)
+        if meta:
+            meta["validated_at"] = time.time()
+            self._write_meta(meta_path, meta)
+
+    def _write_meta(self, meta_path, meta):
+        tmp_path = meta_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp_path, meta_path)
+
+    def iter_entries(self, kind=None):
+        """キャッシュ済みエントリのメタデータを列挙する（オフライン再解析用）"""
+        for root, _, files in os.walk(self.directory):
+            for name in sorted(files):
+                if not name.endswith(".json"):
+                    continue
+                with open(os.path.join(root, name), encoding="utf-8") as f:
+                    meta = json.load(f)
+                if kind is None or meta.get("kind") == kind:
+                    yield meta
@@ -0,0 +1,117 @@
+import argparse
+import json
+import re
+import subprocess
+import sys
+from pathlib import Path
+
+SRC_DIR = Path(__file__).parent
+
+# モジュール -> (import にかけてよい時間 ms, import してはいけない重い依存)
+# 補完・カード引き・ベンチマークの代役などの軽いツールが、重い依存を読み込まないことを確かめる
+BUDGETS = {
+    "card_catalog": (60, ["pandas", "numpy", "chromadb", "ollama"]),
+    "card_index": (30, ["pandas", "numpy", "chromadb", "ollama"]),
+    "search_client": (80, ["pandas", "chromadb", "ollama"]),
+    "search_executor": (80, ["pandas", "chromadb", "ollama"]),
+    "search_metrics": (80, ["pandas", "chromadb", "ollama"]),
+    "latency_stats": (10, ["pandas", "numpy", "chromadb", "ollama"]),
+    "ollama_router": (80, ["pandas", "chromadb", "ollama"]),
+    "text_normalize": (30, ["pandas", "numpy", "chromadb", "ollama"]),
+    "fake_ollama": (250, ["pandas", "chromadb"]),
+    "embeddings": (250, ["pandas", "chromadb", "ollama"]),
+    "search": (700, ["chromadb", "ollama", "discord"]),
+    "discord_bot": (700, ["chromadb", "ollama", "pandas"]),
+}
+
+# 入っていない環境ではスキップしてよい外部パッケージ（import 名）。これ以外の import 失敗は不合格にする
+OPTIONAL_PACKAGES = {"aiohttp", "bs4", "chromadb", "discord", "dotenv", "lxml", "numpy", "ollama", "pandas",
+                     "requests", "selenium"}
+_MISSING_MODULE = re.compile(r"ModuleNotFoundError: No module named '([^']+)'")
+
+
+def measure(module, python=sys.executable):
+    """python -X importtime で1回 import する → (累計 ms, 読み込まれたモジュール名の集合)
+
+    import 失敗時は ImportError。見つからなかったモジュールがあれば、そのトップレベルの名前を name に入れる"""
+    result = subprocess.run(
+        [python, "-X", "importtime", "-c", f"import {module}"],
+        cwd=SRC_DIR, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        last_line = result.stderr.strip().splitlines()[-1] if result.stderr.strip() else module
+        missing = _MISSING_MODULE.search(last_line)
+        raise ImportError(last_line, name=missing.group(1).split(".")[0] if missing else None)
+    total_us = None
+    imported = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue  # 見出し行
+        imported.add(name.strip())
+        if name.strip() == module and not name.startswith("  "):
+            total_us = int(cumulative)
+    return (total_us or 0) / 1000, imported
+
+
+def check(module, budget_ms, forbidden, repeat=3, scale=1.0):
+    """repeat 回計測して最小値を予算と比べる（初回はディスクキャッシュの影響を受けるため）
+
+    任意の外部パッケージが入っていないだけならスキップ。それ以外で import できなければ不合格"""
+    try:
+        runs = [measure(module) for _ in range(repeat)]
+    except ImportError as e:
+        status = "skip" if e.name in OPTIONAL_PACKAGES else "fail"
+        return {"module": module, "status": status, "reason": str(e)}
+    ms = min(run[0] for run in runs)
+    imported = runs[0][1]
+    loaded = sorted(dep for dep in forbidden if any(name == dep or name.startswith(dep + ".") for name in imported))
+    over = ms > budget_ms * scale
+    return {
+        "module": module,
+        "status": "fail" if over or loaded else "ok",
+        "ms": round(ms, 1),
+        "budget_ms": round(budget_ms * scale, 1),
+        "forbidden_loaded": loaded,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="import にかかる時間の予算と、重い依存の読み込みを確認する")
+    parser.add_argument("modules", nargs="*", default=list(BUDGETS), help="確認するモジュール（省略時はすべて）")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--scale", type=float, default=1.0, help="予算の倍率（遅いマシン・CI用）")
+    parser.add_argument("--json", action="store_true", help="結果を JSON で出力する")
+    args = parser.parse_args()
+
+    results = []
+    for module in args.modules:
+        budget_ms, forbidden = BUDGETS.get(module, (float("inf"), []))
+        results.append(check(module, budget_ms, forbidden, repeat=args.repeat, scale=args.scale))
+
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+    else:
+        for r in results:
+            if r["status"] == "skip":
+                print(f"➖ {r['module']:<16} スキップ（{r['reason']}）")
+                continue
+            if "reason" in r:
+                print(f"❌ {r['module']:<16} import に失敗（{r['reason']}）")
+                continue
+            mark = "✅" if r["status"] == "ok" else "❌"
+            line = f"{mark} {r['module']:<16} {r['ms']:>8.1f}ms / 予算 {r['budget_ms']:.0f}ms"
+            if r["forbidden_loaded"]:
+                line += f"  読み込まれた重い依存: {', '.join(r['forbidden_loaded'])}"
+            print(line)
+
+    failed = [r["module"] for r in results if r["status"] == "fail"]
+    if failed:
+        print(f"\n❌ 予算超過・重い依存の読み込み・import の失敗: {', '.join(failed)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+from collections import defaultdict, deque
+
+# =========================
+# レイテンシの集計（スクレイパー・検索・Ollama ルーターで共通）
+# =========================
+LATENCY_WINDOW = 1000  # パーセンタイル計算に使う直近のサンプル数
+
+
+def percentile(sorted_values, p):
+    """昇順に並んだ値の p パーセンタイル（最近傍法）"""
+    if not sorted_values:
+        return None
+    k = max(0, min(len(sorted_values) - 1, round(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[k]
+
+
+def quantiles(values, ps):
+    """値の {"p50": ..., "p99": ...}（値が無ければ None）"""
+    ordered = sorted(values)
+    return {f"p{p}": percentile(ordered, p) for p in ps}
+
+
+def latency_window(window=LATENCY_WINDOW):
+    """直近 window 件の処理時間（秒）"""
+    return deque(maxlen=window)
+
+
+def latency_windows(window=LATENCY_WINDOW):
+    """名前 -> 直近 window 件の処理時間（秒）"""
+    return defaultdict(lambda: latency_window(window))
@@ -0,0 +1,346 @@
+import argparse
+import json
+import os
+import random
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from latency_stats import latency_window, percentile, quantiles
+
+# =========================
+# 設定
+# =========================
+# カンマ区切りの Ollama の URL。どちらも未設定なら従来どおり既定の1台（OLLAMA_HOST）を使う
+OLLAMA_CHAT_HOSTS = os.getenv("OLLAMA_CHAT_HOSTS", "")
+OLLAMA_EMBED_HOSTS = os.getenv("OLLAMA_EMBED_HOSTS", "")  # 未設定なら chat と同じ URL（ただし別のプール）
+CHAT_TIMEOUT = 120.0   # chat 1回のタイムアウト（秒）
+EMBED_TIMEOUT = 30.0   # 埋め込み1回のタイムアウト（秒）
+RETRIES = 1            # 失敗時に別のバックエンドで再試行する回数
+MAX_FAILURES = 3       # 連続でこの回数失敗したら切り離す
+SLOW_FACTOR = 3.0      # 他のバックエンドの中央値のこの倍より遅ければ切り離す
+SLOW_MIN_SECONDS = 0.5  # これより速ければ遅いとは見なさない
+EJECT_SECONDS = 10.0   # 切り離す時間（続けて切り離されるたびに倍、EJECT_MAX_SECONDS まで）
+EJECT_MAX_SECONDS = 300.0
+HEALTH_INTERVAL = 15.0  # ヘルスチェック（/api/tags）の間隔（秒）
+EWMA_ALPHA = 0.2       # レイテンシの移動平均の重み
+
+
+class NoBackendAvailable(RuntimeError):
+    """プール内のどのバックエンドでも処理できなかった"""
+
+
+def parse_hosts(value):
+    return [host.strip() for host in value.split(",") if host.strip()]
+
+
+# =========================
+# バックエンド（Ollama 1台）
+# =========================
+class Backend:
+    """Ollama 1台分のクライアントと状態（処理中の数・レイテンシ・切り離し）"""
+
+    def __init__(self, host, timeout):
+        self.host = host
+        self.name = host.split("://", 1)[-1].rstrip("/")
+        self.timeout = timeout
+        self.outstanding = 0
+        self.requests = 0
+        self.errors = 0
+        self.ejections = 0
+        self.consecutive_failures = 0
+        self.consecutive_ejections = 0
+        self.ejected_until = 0.0
+        self.ewma = None  # 秒
+        self.latencies = latency_window()  # 直近のレイテンシ（秒）
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            import ollama
+
+            self._client = ollama.Client(host=self.host, timeout=self.timeout)
+        return self._client
+
+    def available(self, now):
+        return now >= self.ejected_until
+
+    def eject(self, now, reason):
+        self.consecutive_ejections += 1
+        seconds = min(EJECT_SECONDS * 2 ** (self.consecutive_ejections - 1), EJECT_MAX_SECONDS)
+        self.ejected_until = now + seconds
+        self.ejections += 1
+        self.ewma = None  # 戻った時に古い値で再び切り離さないように
+        print(f"⚠️  Ollama {self.name} を {seconds:.0f}秒切り離します（{reason}）")
+
+    def snapshot(self, now):
+        latency = quantiles(self.latencies, (50, 95))
+        return {
+            "host": self.host,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "errors": self.errors,
+            "ejections": self.ejections,
+            "ejected": not self.available(now),
+            "ewma_ms": round(self.ewma * 1000, 1) if self.ewma is not None else None,
+            **{f"{key}_ms": round(seconds * 1000, 1) if seconds is not None else None
+               for key, seconds in latency.items()},
+        }
+
+
+# =========================
+# プール（用途ごとのバックエンドの集まり）
+# =========================
+class BackendPool:
+    """処理中の少ないバックエンドを選び、失敗・遅延が続くものは一時的に切り離す"""
+
+    def __init__(self, name, hosts, timeout, metrics=None):
+        self.name = name
+        self.backends = [Backend(host, timeout) for host in hosts]
+        self.metrics = metrics
+        self._lock = threading.Lock()
+
+    def _acquire(self, exclude=()):
+        """処理中が最も少ないバックエンドを選んで処理中に数える（同数ならレイテンシの小さい方）"""
+        now = time.monotonic()
+        with self._lock:
+            candidates = [b for b in self.backends if b not in exclude and b.available(now)]
+            if not candidates:
+                # すべて切り離し中なら、戻りが最も早いものを使う（全停止にはしない）
+                candidates = sorted(
+                    (b for b in self.backends if b not in exclude), key=lambda b: b.ejected_until
+                )[:1]
+            if not candidates:
+                return None
+            random.shuffle(candidates)
+            backend = min(candidates, key=lambda b: (b.outstanding, b.ewma or 0.0))
+            backend.outstanding += 1
+            backend.requests += 1
+            return backend
+
+    def _median_ewma(self, exclude, now):
+        values = [b.ewma for b in self.backends if b is not exclude and b.available(now) and b.ewma is not None]
+        return statistics.median(values) if values else None
+
+    def _healthy_count(self, now):
+        return sum(1 for b in self.backends if b.available(now))
+
+    def _release(self, backend, seconds, error=None):
+        now = time.monotonic()
+        with self._lock:
+            backend.outstanding -= 1
+            if error is not None:
+                backend.errors += 1
+                backend.consecutive_failures += 1
+                if backend.consecutive_failures >= MAX_FAILURES and self._healthy_count(now) > 1:
+                    backend.consecutive_failures = 0
+                    backend.eject(now, f"{MAX_FAILURES}回連続で失敗: {error}")
+                return
+            backend.consecutive_failures = 0
+            backend.consecutive_ejections = 0
+            backend.latencies.append(seconds)
+            backend.ewma = seconds if backend.ewma is None else (
+                EWMA_ALPHA * seconds + (1 - EWMA_ALPHA) * backend.ewma
+            )
+            others = self._median_ewma(backend, now)
+            if (others is not None and backend.ewma > SLOW_MIN_SECONDS
+                    and backend.ewma > SLOW_FACTOR * others and self._healthy_count(now) > 1):
+                backend.eject(now, f"遅延 {backend.ewma * 1000:.0f}ms（他の中央値 {others * 1000:.0f}ms）")
+        if self.metrics is not None:
+            self.metrics.observe(f"ollama.{self.name}.{backend.name}", seconds)
+
+    def call(self, method, **kwargs):
+        """method（chat / embeddings / embed）を選んだバックエンドで呼ぶ。失敗したら別のバックエンドで再試行"""
+        tried = []
+        last_error = None
+        for _ in range(1 + RETRIES):
+            backend = self._acquire(exclude=tried)
+            if backend is None:
+                break
+            tried.append(backend)
+            start = time.perf_counter()
+            try:
+                result = getattr(backend.client, method)(**kwargs)
+            except Exception as e:
+                self._release(backend, time.perf_counter() - start, error=e)
+                last_error = e
+                continue
+            self._release(backend, time.perf_counter() - start)
+            return result
+        raise NoBackendAvailable(f"{self.name}: すべてのバックエンドで失敗しました（{last_error}）") from last_error
+
+    def health_check(self):
+        """各バックエンドの /api/tags を確認し、応答しないものを切り離す"""
+        for backend in self.backends:
+            try:
+                backend.client.list()
+            except Exception as e:
+                now = time.monotonic()
+                with self._lock:
+                    if backend.available(now) and self._healthy_count(now) > 1:
+                        backend.eject(now, f"ヘルスチェック失敗: {e}")
+
+    def snapshot(self):
+        now = time.monotonic()
+        with self._lock:
+            return [backend.snapshot(now) for backend in self.backends]
+
+
+# =========================
+# ルーター
+# =========================
+class OllamaRouter:
+    """chat と埋め込みを、それぞれ別のプールの Ollama に振り分ける（ollama.chat などと同じ呼び方）"""
+
+    def __init__(self, chat_hosts, embed_hosts=None, metrics=None):
+        embed_hosts = embed_hosts or chat_hosts
+        self.chat_pool = BackendPool("chat", chat_hosts, CHAT_TIMEOUT, metrics)
+        self.embed_pool = BackendPool("embed", embed_hosts, EMBED_TIMEOUT, metrics)
+        self._health_thread = None
+
+    @classmethod
+    def from_env(cls, metrics=None):
+        """OLLAMA_CHAT_HOSTS / OLLAMA_EMBED_HOSTS から作る。どちらも未設定なら None"""
+        chat_hosts = parse_hosts(OLLAMA_CHAT_HOSTS)
+        embed_hosts = parse_hosts(OLLAMA_EMBED_HOSTS)
+        if not chat_hosts and not embed_hosts:
+            return None
+        return cls(chat_hosts or embed_hosts, embed_hosts or chat_hosts, metrics)
+
+    def set_metrics(self, metrics):
+        self.chat_pool.metrics = metrics
+        self.embed_pool.metrics = metrics
+
+    def chat(self, **kwargs):
+        return self.chat_pool.call("chat", **kwargs)
+
+    def embeddings(self, **kwargs):
+        return self.embed_pool.call("embeddings", **kwargs)
+
+    def embed(self, **kwargs):
+        return self.embed_pool.call("embed", **kwargs)
+
+    def start_health_checks(self, interval=HEALTH_INTERVAL):
+        if self._health_thread is not None:
+            return
+
+        def loop():
+            while True:
+                time.sleep(interval)
+                for pool in (self.chat_pool, self.embed_pool):
+                    pool.health_check()
+
+        self._health_thread = threading.Thread(target=loop, daemon=True, name="ollama-health")
+        self._health_thread.start()
+
+    def snapshot(self):
+        return {"chat": self.chat_pool.snapshot(), "embed": self.embed_pool.snapshot()}
+
+
+# =========================
+# 呼び出し口（未設定なら従来どおり ollama モジュールを直接使う）
+# =========================
+_router = None
+_router_lock = threading.Lock()
+_router_loaded = False
+
+
+def get_router():
+    """環境変数から作ったルーター（プロセスで1つ）。複数台の設定が無ければ None"""
+    global _router, _router_loaded
+    if not _router_loaded:
+        with _router_lock:
+            if not _router_loaded:
+                _router = OllamaRouter.from_env()
+                if _router is not None:
+                    _router.start_health_checks()
+                _router_loaded = True
+    return _router
+
+
+def chat(**kwargs):
+    router = get_router()
+    if router is not None:
+        return router.chat(**kwargs)
+    import ollama
+
+    return ollama.chat(**kwargs)
+
+
+def embeddings(**kwargs):
+    router = get_router()
+    if router is not None:
+        return router.embeddings(**kwargs)
+    import ollama
+
+    return ollama.embeddings(**kwargs)
+
+
+def embed(**kwargs):
+    router = get_router()
+    if router is not None:
+        return router.embed(**kwargs)
+    import ollama
+
+    return ollama.embed(**kwargs)
+
+
+# =========================
+# スタブサーバーでの動作確認
+# =========================
+def main():
+    parser = argparse.ArgumentParser(description="Ollama ルーターの振り分け・切り離しをスタブサーバーで確かめる")
+    parser.add_argument("--backends", type=int, default=3, help="起動するスタブサーバーの数")
+    parser.add_argument("--slow", type=int, default=1, help="そのうち遅いサーバーの数")
+    parser.add_argument("--failing", type=int, default=1, help="そのうちエラーを返すサーバーの数")
+    parser.add_argument("--latency", type=float, default=0.05, help="通常のサーバーの chat の秒数")
+    parser.add_argument("--slow-latency", type=float, default=1.0, help="遅いサーバーの chat の秒数")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+
+    from fake_ollama import FakeOllama
+    from search_metrics import SearchMetrics
+
+    servers, hosts = [], []
+    for i in range(args.backends):
+        slow = i < args.slow
+        failing = args.slow <= i < args.slow + args.failing
+        fake = FakeOllama(chat_latency=args.slow_latency if slow else args.latency,
+                          error_rate=1.0 if failing else 0.0)
+        server = fake.serve()
+        servers.append(server)
+        hosts.append(f"http://127.0.0.1:{server.server_address[1]}")
+        kind = "遅い" if slow else "エラー" if failing else "通常"
+        print(f"スタブ {i}: {hosts[-1]}（{kind}）")
+
+    metrics = SearchMetrics(log_path=None)
+    router = OllamaRouter(hosts, metrics=metrics)
+    messages = [{"role": "user", "content": "検索クエリ: 「火のドラゴン」"}]
+
+    def one(_):
+        start = time.perf_counter()
+        try:
+            router.chat(model="llama3.1:8b", messages=messages)
+            return time.perf_counter() - start, None
+        except NoBackendAvailable as e:
+            return time.perf_counter() - start, str(e)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(one, range(args.requests)))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(seconds for seconds, _ in results)
+    failures = sum(1 for _, error in results if error)
+    print(f"\n{args.requests}件 / {elapsed:.2f}秒 | 失敗 {failures}件 | "
+          f"p50 {percentile(latencies, 50) * 1000:.0f}ms p95 {percentile(latencies, 95) * 1000:.0f}ms")
+    print(json.dumps(router.snapshot(), ensure_ascii=False, indent=2))
+    for server in servers:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from scrape_dm_cards import HTML_PARSER, parse_card_html
+from http_cache import HttpCache, CACHE_DIR
+from scraper_config import SAVED_PAGES_DIR
+
+
+# =========================
+# 解析のみのベンチマーク
+# =========================
+def load_corpus(directory=None, limit=None):
+    """保存済みHTML（ディレクトリ指定時）またはHTTPキャッシュの詳細ページを読み込む"""
+    bodies = []
+    if directory:
+        for name in sorted(os.listdir(directory)):
+            if name.endswith(".html"):
+                with open(os.path.join(directory, name), "rb") as f:
+                    bodies.append(f.read())
+    else:
+        cache = HttpCache(CACHE_DIR)
+        for meta in cache.iter_entries(kind="detail"):
+            bodies.append(cache.load_body(meta["url"]))
+    return bodies[:limit] if limit else bodies
+
+
+def _parse_chunk(bodies, parser):
+    return [parse_card_html(body, parser) for body in bodies]
+
+
+def bench_serial(bodies, parser):
+    start = time.perf_counter()
+    _parse_chunk(bodies, parser)
+    return time.perf_counter() - start
+
+
+def bench_pool(bodies, parser, workers, chunk_size=64):
+    chunks = [bodies[i:i + chunk_size] for i in range(0, len(bodies), chunk_size)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # プロセス起動時間を計測に含めないよう先に温めておく
+        list(pool.map(_parse_chunk, chunks[:workers], [parser] * min(workers, len(chunks))))
+        start = time.perf_counter()
+        list(pool.map(_parse_chunk, chunks, [parser] * len(chunks)))
+        return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="詳細ページ解析のベンチマーク（ネットワーク不使用）")
+    parser.add_argument("--dir", default=None,
+                        help=f"保存済みHTMLのディレクトリ（例: {SAVED_PAGES_DIR}）。省略時はHTTPキャッシュ")
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--repeat", type=int, default=1, help="コーパスを水増しする倍数")
+    parser.add_argument("--workers", type=int, nargs="*", default=[1, 2, 4, os.cpu_count()])
+    args = parser.parse_args()
+
+    bodies = load_corpus(args.dir, args.limit) * args.repeat
+    if not bodies:
+        print("❌ 解析対象のページがありません")
+        return
+    print(f"コーパス: {len(bodies)}ページ / 既定パーサー: {HTML_PARSER}\n")
+
+    parsers = ["html.parser"] + (["lxml"] if HTML_PARSER == "lxml" else [])
+    for name in parsers:
+        elapsed = bench_serial(bodies, name)
+        print(f"[{name}] 直列: {elapsed:.2f}秒 ({len(bodies) / elapsed:.0f}ページ/秒)")
+
+    for workers in sorted(set(args.workers)):
+        elapsed = bench_pool(bodies, HTML_PARSER, workers)
+        print(f"[{HTML_PARSER}] {workers}プロセス: {elapsed:.2f}秒 ({len(bodies) / elapsed:.0f}ページ/秒)")
+
+
+if __name__ == "__main__":
+    main()
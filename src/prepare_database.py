@@ -1,19 +1,35 @@
 import pandas as pd
 import chromadb
 from chromadb.config import Settings
-import ollama
 import json
 from pathlib import Path
 import time
+import os
+
+from card_store import CardStore, CARD_DB
+from similarity_graph import build_knn_graph, save_graph
+from embeddings import create_embedder
+
+MANIFEST_NAME = "index_manifest.json"  # 検索側（search.py）が監視する、有効なインデックスの情報
+COLLECTION_PREFIX = "duel_masters_cards_"
+KEEP_VERSIONS = 2  # 検索中の旧バージョンを壊さないよう、直近のバージョンは残しておく
+EMBED_RETRIES = 3  # バッチの埋め込みに失敗した時の再試行回数（それでも駄目なら1件ずつ取り直す）
 
 class DuelMastersDataProcessor:
-    def __init__(self):
-        # スクリプトの場所を基準にパスを設定
-        script_dir = Path(__file__).parent
+    def __init__(self, base_dir=None, embedding_backend=None):
+        # スクリプトの場所を基準にパスを設定（base_dir 指定時はその下の data/ と chroma_db/）
+        script_dir = Path(base_dir) if base_dir else Path(__file__).parent
         self.data_dir = script_dir / "data"
+        self.index_dir = script_dir / "chroma_db"
+        self.collection_name = None
         self.cards_df = None
         self.keywords = []
         self.tags = []
+        self.embedding_failures = 0  # 直近の process_and_store で埋め込みを取れなかったカード数
+        
+        # 埋め込みのバックエンド（省略時は環境変数 EMBEDDING_BACKEND、既定は Ollama）
+        self.embedder = create_embedder(embedding_backend)
+        self.embedding_meta = self.embedder.describe()
         
         # ChromaDB クライアント初期化
         self.chroma_client = chromadb.PersistentClient(
@@ -25,42 +41,23 @@ class DuelMastersDataProcessor:
         """CSVとテキストファイルを読み込み"""
         print("データを読み込み中...")
         
-        # CSVファイル読み込み（複数の方法を試す）
         csv_path = self.data_dir / "cards.csv"
+
+        # カードDBがあれば、そこから検索用スナップショットを書き出す
+        card_db = self.data_dir / CARD_DB.name
+        if card_db.exists():
+            store = CardStore(card_db)
+            exported = store.export_csv(csv_path)
+            store.close()
+            print(f"カードDBから cards.csv を書き出し: {exported}枚")
         
-        # 方法1: pythonエンジンで読み込み
-        try:
-            self.cards_df = pd.read_csv(
-                csv_path,
-                encoding="utf-8",
-                on_bad_lines='skip',  # 問題のある行をスキップ
-                engine='python',  # pythonエンジンを使用
-                quotechar='"',
-                skipinitialspace=True
-            )
-            print(f"✅ カードデータ: {len(self.cards_df)}枚読み込み完了")
-            
-        except Exception as e:
-            print(f"⚠️  方法1失敗: {e}")
-            # 方法2: 手動で行ごとに読み込み
-            print("方法2で再試行中...")
-            try:
-                import csv
-                cards_data = []
-                with open(csv_path, 'r', encoding='utf-8') as f:
-                    reader = csv.DictReader(f)
-                    for i, row in enumerate(reader, 1):
-                        try:
-                            cards_data.append(row)
-                        except Exception as row_error:
-                            print(f"⚠️  行 {i} をスキップ: {row_error}")
-                
-                self.cards_df = pd.DataFrame(cards_data)
-                print(f"✅ カードデータ: {len(self.cards_df)}枚読み込み完了（方法2）")
-                
-            except Exception as e2:
-                print(f"❌ すべての方法で失敗: {e2}")
-                raise
+        # CSVファイル読み込み（Cエンジン。壊れた行はスキップ）
+        self.cards_df = pd.read_csv(
+            csv_path,
+            encoding="utf-8-sig",
+            on_bad_lines='skip'
+        )
+        print(f"✅ カードデータ: {len(self.cards_df)}枚読み込み完了")
         
         # カラム名を確認
         print(f"カラム: {list(self.cards_df.columns)}")
@@ -125,34 +122,60 @@ class DuelMastersDataProcessor:
         return "\n".join(parts)
     
     def generate_embeddings(self, text):
-        """Ollamaでテキストをベクトル化"""
+        """テキストをベクトル化（バックエンドは self.embedder）"""
         try:
-            response = ollama.embeddings(
-                model='nomic-embed-text',
-                prompt=text
-            )
-            return response['embedding']
+            return self.embedder.embed(text)
         except Exception as e:
             print(f"❌ エラー: {e}")
             return None
     
+    def embed_batch(self, texts):
+        """1バッチ分を embed_many の1回の呼び出しでベクトル化する
+
+        失敗したら再試行し、それでも駄目なら1件ずつ取り直す。取れなかったカードは None"""
+        for attempt in range(EMBED_RETRIES):
+            try:
+                vectors = self.embedder.embed_many(texts)
+                if len(vectors) == len(texts):
+                    return vectors
+                raise ValueError(f"{len(texts)}件に対して{len(vectors)}件の埋め込みが返されました")
+            except Exception as e:
+                print(f"⚠️  バッチの埋め込みに失敗（{attempt+1}/{EMBED_RETRIES}）: {e}")
+                time.sleep(2 ** attempt)
+        print("⚠️  1件ずつ埋め込みを取り直します")
+        return [self.generate_embeddings(text) for text in texts]
+    
     def process_and_store(self, batch_size=100):
         """カードデータを処理してChromaDBに保存"""
         print("\nデータ処理を開始...")
         
-        # コレクション作成（既存のものは削除）
-        try:
-            self.chroma_client.delete_collection("duel_masters_cards")
-        except:
-            pass
-        
+        # バージョン付きのコレクションを新規作成（稼働中の検索は旧バージョンを使い続ける）
+        version = time.strftime("%Y%m%d%H%M%S")
+        self.collection_name = COLLECTION_PREFIX + version
         collection = self.chroma_client.create_collection(
-            name="duel_masters_cards",
-            metadata={"description": "Duel Masters card database"}
+            name=self.collection_name,
+            metadata={
+                "description": "Duel Masters card database",
+                "version": version,
+                "embedding_backend": self.embedder.backend,
+            }
         )
         
+        # コーパスから統計を取る埋め込み（IDFなど）は先に学習して、インデックスと一緒に保存する
+        if hasattr(self.embedder, "fit"):
+            self.embedder.fit(self.create_search_text(row) for _, row in self.cards_df.iterrows())
+        self.embedding_meta = self.embedder.describe()
+        snapshot_dir = self.index_dir / "snapshots"
+        snapshot_dir.mkdir(parents=True, exist_ok=True)
+        state_path = self.embedder.save(snapshot_dir / f"embedder_{version}.npy")
+        if state_path is not None:
+            self.embedding_meta["state"] = str(state_path.relative_to(self.index_dir))
+        
         total_cards = len(self.cards_df)
         processed = 0
+        all_ids = []
+        all_embeddings = []
+        failed_cards = []  # 埋め込みを取れずインデックスに入れなかったカード名
         
         for i in range(0, total_cards, batch_size):
             batch = self.cards_df.iloc[i:i+batch_size]
@@ -160,7 +183,6 @@ class DuelMastersDataProcessor:
             documents = []
             metadatas = []
             ids = []
-            embeddings = []
             
             for idx, row in batch.iterrows():
                 # 検索用テキスト生成
@@ -180,37 +202,102 @@ class DuelMastersDataProcessor:
                 
                 # ID生成
                 ids.append(f"card_{idx}")
-                
-                # ベクトル化
-                embedding = self.generate_embeddings(search_text)
-                if embedding:
-                    embeddings.append(embedding)
-                else:
-                    # エラー時はダミーベクトル
-                    embeddings.append([0.0] * 768)
-                
-                processed += 1
-                if processed % 10 == 0:
-                    print(f"進捗: {processed}/{total_cards} ({processed/total_cards*100:.1f}%)")
+            
+            # ベクトル化（バッチごとに1回の呼び出し）。取れなかったカードは入れない
+            # （ダミーのゼロベクトルで入れると、どのクエリにも不定の順位で出てしまう）
+            embeddings = self.embed_batch(documents)
+            kept = [i for i, embedding in enumerate(embeddings) if embedding]
+            failed_cards.extend(metadata["card_name"] for metadata, embedding in zip(metadatas, embeddings)
+                                if not embedding)
+            processed += len(batch)
+            print(f"進捗: {processed}/{total_cards} ({processed/total_cards*100:.1f}%)")
+            if not kept:
+                continue
+            
+            all_ids.extend(batch.index[kept])
+            all_embeddings.extend(embeddings[i] for i in kept)
             
             # バッチ保存
             collection.add(
-                documents=documents,
-                metadatas=metadatas,
-                ids=ids,
-                embeddings=embeddings
+                documents=[documents[i] for i in kept],
+                metadatas=[metadatas[i] for i in kept],
+                ids=[ids[i] for i in kept],
+                embeddings=[embeddings[i] for i in kept]
             )
             
             # API制限対策（念のため）
             time.sleep(0.1)
         
-        print(f"\n✅ 完了！ {processed}枚のカードをデータベースに保存しました")
+        print(f"\n✅ 完了！ {len(all_ids)}枚のカードをデータベースに保存しました")
+        if failed_cards:
+            print(f"⚠️  埋め込みを取得できず、インデックスに含めなかったカード: {len(failed_cards)}枚")
+            for name in failed_cards[:20]:
+                print(f"   - {name}")
+        self.embedding_failures = len(failed_cards)
+        if not all_ids:
+            # 空のインデックスを公開すると検索が全く返らなくなるので、現行バージョンのままにする
+            raise RuntimeError("埋め込みを1件も取得できませんでした（インデックスは更新しません）")
+        
+        self.build_similarity_graph(version, all_ids, all_embeddings)
+        self.publish_version(version)
+    
+    def build_similarity_graph(self, version, card_ids, embeddings):
+        """「似たカード」用に、全カードの類似上位を事前計算して保存"""
+        print("類似カードのグラフを構築中...")
+        start = time.perf_counter()
+        neighbors, scores = build_knn_graph(embeddings)
+        
+        snapshot_dir = self.index_dir / "snapshots"
+        snapshot_dir.mkdir(parents=True, exist_ok=True)
+        save_graph(snapshot_dir / f"similar_{version}.npz", card_ids, neighbors, scores)
+        print(f"✅ 類似カード: {len(card_ids)}枚 × {neighbors.shape[1]}件 ({time.perf_counter() - start:.1f}秒)")
+    
+    def publish_version(self, version):
+        """構築したバージョンを有効化する（card_{idx} と対応するCSVも一緒に保存）"""
+        snapshot_dir = self.index_dir / "snapshots"
+        snapshot_dir.mkdir(parents=True, exist_ok=True)
+        cards_csv = snapshot_dir / f"cards_{version}.csv"
+        self.cards_df.to_csv(cards_csv, index=False, encoding="utf-8-sig")
+        
+        similar_graph = snapshot_dir / f"similar_{version}.npz"
+        
+        manifest = {
+            "version": version,
+            "collection": self.collection_name,
+            "cards_csv": str(cards_csv.relative_to(self.index_dir)),
+            "card_count": len(self.cards_df),
+            "embedding_failures": self.embedding_failures,
+            "similar_graph": str(similar_graph.relative_to(self.index_dir)) if similar_graph.exists() else None,
+            "embedding": self.embedding_meta,
+            "built_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        # 一時ファイルに書いてから置き換え、検索側が書きかけを読まないようにする
+        manifest_path = self.index_dir / MANIFEST_NAME
+        tmp_path = manifest_path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, manifest_path)
+        print(f"✅ インデックス {version} を有効化しました")
+        
+        # 古いバージョンを削除
+        versions = sorted(
+            c.name[len(COLLECTION_PREFIX):] for c in self.chroma_client.list_collections()
+            if c.name.startswith(COLLECTION_PREFIX)
+        )
+        for old_version in versions[:-KEEP_VERSIONS]:
+            self.chroma_client.delete_collection(COLLECTION_PREFIX + old_version)
+            for old_file in (snapshot_dir / f"cards_{old_version}.csv",
+                             snapshot_dir / f"similar_{old_version}.npz",
+                             snapshot_dir / f"embedder_{old_version}.npy"):
+                if old_file.exists():
+                    old_file.unlink()
+            print(f"旧インデックス {old_version} を削除しました")
         
     def test_search(self, query):
         """検索テスト"""
         print(f"\nテスト検索: '{query}'")
         
-        collection = self.chroma_client.get_collection("duel_masters_cards")
+        collection = self.chroma_client.get_collection(self.collection_name)
         
         # クエリをベクトル化
         query_embedding = self.generate_embeddings(query)
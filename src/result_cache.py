@@ -0,0 +1,149 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from text_normalize import fold_text
+
+# =========================
+# 設定
+# =========================
+FILTER_CACHE_SIZE = int(os.getenv("FILTER_CACHE_SIZE", "256"))  # 条件 -> 候補カードの件数上限（0で無効）
+RANK_CACHE_SIZE = int(os.getenv("RANK_CACHE_SIZE", "256"))      # (条件, クエリ埋め込み) -> 順位の件数上限（0で無効）
+
+# filter_by_conditions / match_bonuses が参照する項目（それ以外は結果に影響しないのでキーに含めない）
+CONDITION_FIELDS = [
+    "cost_min", "cost_max", "civilizations", "card_types", "keywords",
+    "race_keywords", "general_search", "effect_groups", "exclude_keywords",
+]
+
+
+def canonical_conditions(conditions):
+    """抽出条件を、結果が同じなら同じ文字列になるように正規化する
+
+    リストの順序はフィルタ（AND/OR）にもボーナスの合計にも影響しないので並べ替える。
+    文字列はフィルタと同じ fold_text で正規化する。重複はボーナスが二重に付くため残す"""
+    canonical = {}
+    for field in CONDITION_FIELDS:
+        value = conditions.get(field)
+        if field in ("cost_min", "cost_max"):
+            if value is None:
+                continue
+            if isinstance(value, float) and value.is_integer():
+                value = int(value)
+        elif not value:
+            continue  # 空のリスト・None はフィルタしないのと同じ
+        elif field == "effect_groups":
+            value = sorted((_sorted_group(group) for group in value), key=_dump)
+        elif isinstance(value, list):
+            value = sorted((_fold(item) for item in value), key=_dump)
+        canonical[field] = value
+    return _dump(canonical)
+
+
+def _sorted_group(group):
+    # 文字列のリストだけを並べ替える（入れ子の不正なグループは先頭要素が使われるのでそのまま）
+    if isinstance(group, list) and all(isinstance(item, str) for item in group):
+        return sorted(fold_text(item) for item in group)
+    return group
+
+
+def _fold(item):
+    return fold_text(item) if isinstance(item, str) else item
+
+
+def _dump(value):
+    return json.dumps(value, ensure_ascii=False, sort_keys=True)
+
+
+def embedding_key(vector):
+    """クエリ埋め込みのハッシュ（float32 に揃えてから計算する）"""
+    data = np.asarray(vector, dtype=np.float32).tobytes()
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+# =========================
+# LRU キャッシュ
+# =========================
+class LRUCache:
+    """件数上限付きの LRU キャッシュ（スレッドセーフ）"""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._data), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+
+# =========================
+# 検索結果のキャッシュ
+# =========================
+class ResultCache:
+    """フィルタ結果と順位付け結果の2段のキャッシュ
+
+    - filter: (インデックスのバージョン, 正規化した条件) -> 候補カードの idx の配列
+    - rank:   (バージョン, 条件, クエリ埋め込みのハッシュ) -> (top_k, 上位の idx, スコア)
+
+    どちらもキーにバージョンを含めるので、インデックスが切り替われば古い結果は使われない
+    （切り替え時に clear() で解放する）"""
+
+    def __init__(self, filter_size=FILTER_CACHE_SIZE, rank_size=RANK_CACHE_SIZE):
+        self.filter = LRUCache(filter_size)
+        self.rank = LRUCache(rank_size)
+
+    def get_filtered(self, version, condition_key):
+        return self.filter.get((version, condition_key))
+
+    def put_filtered(self, version, condition_key, card_ids):
+        self.filter.put((version, condition_key), np.asarray(card_ids))
+
+    def get_ranked(self, version, condition_key, query_key, top_k):
+        entry = self.rank.get((version, condition_key, query_key))
+        if entry is None:
+            return None
+        cached_k, card_ids, scores = entry
+        # 少ない件数で保存した結果から多い件数は作れない（候補が top_k 未満で全件入っている場合を除く）
+        if top_k > cached_k and len(card_ids) == cached_k:
+            return None
+        return card_ids[:top_k], scores[:top_k]
+
+    def put_ranked(self, version, condition_key, query_key, top_k, card_ids, scores):
+        self.rank.put((version, condition_key, query_key), (top_k, np.asarray(card_ids), np.asarray(scores)))
+
+    def clear(self):
+        self.filter.clear()
+        self.rank.clear()
+
+    def stats(self):
+        return {"filter": self.filter.stats(), "rank": self.rank.stats()}
@@ -1,26 +1,40 @@
+import asyncio
+import itertools
+from concurrent.futures import ProcessPoolExecutor
 import time
-import csv
 import os
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import StaleElementReferenceException, TimeoutException
+import requests
 
 from scrape_dm_cards import (
     create_driver,
-    parse_card_detail,
-    load_existing_names,
+    fetch_listing_urls,
+    parse_card_html,
+    load_legacy_seen,
     CSV_FILE,
-    BASE_DOMAIN
+    BASE_DOMAIN,
+    HEADERS
 )
+from async_fetcher import AsyncDetailFetcher
+from crawl_state import CrawlState, CRAWL_DB
+from http_cache import HttpCache
+from card_store import CardStore
+from scraper_metrics import ScraperMetrics
 
 # =========================
 # 設定
 # =========================
-SLEEP_SEC = 3  # ページ間の待機時間を増やす
+SLEEP_SEC = 3  # ページ間の待機時間を増やす（Selenium使用時）
+HTTP_SLEEP_SEC = 1  # HTTPで一覧を取得した場合のページ間待機
+KNOWN_PAGES_TO_STOP = 3  # 差分モード: 既知カードのみのページがこの数だけ続いたら終了
+USE_HTTP_CACHE = True  # ETag / Last-Modified による条件付きリクエストを使う
+LISTING_MODE = "http"  # "http": HTTP取得を優先しSeleniumはフォールバック / "selenium": 常にSelenium
 RESTART_INTERVAL = 10
 MAX_RETRY_GET = 3
 MAX_RETRY_STALE = 3  # Stale要素のリトライ回数
+DETAIL_CONCURRENCY = 4  # 詳細ページの同時取得数
+DETAIL_RATE_PER_SEC = 1.0  # 詳細ページのリクエスト数/秒（ホスト単位）
+PARSE_WORKERS = 2  # HTML解析用のプロセス数（クロール時）
+REPLAY_BATCH_SIZE = 500  # 再解析時にまとめて保存する件数
 
 
 # =========================
@@ -44,6 +58,9 @@ def build_page_url(page_num: int) -> str:
 # 安全な driver.get
 # =========================
 def safe_get(driver, wait, url):
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support import expected_conditions as EC
+
     for i in range(MAX_RETRY_GET):
         try:
             driver.get(url)
@@ -66,6 +83,9 @@ def safe_get(driver, wait, url):
 # =========================
 def extract_card_urls(driver):
     """カードのURLを安全に抽出する"""
+    from selenium.webdriver.common.by import By
+    from selenium.common.exceptions import StaleElementReferenceException
+
     for attempt in range(MAX_RETRY_STALE):
         try:
             # 毎回新しく要素を取得
@@ -124,120 +144,353 @@ def verify_page_content(driver, expected_page):
         return True  # 検証できない場合は続行
 
 
+# =========================
+# 一覧ページ取得（HTTP優先、Seleniumはフォールバック）
+# =========================
+class ListingFetcher:
+    """一覧ページからカードの詳細URLを取得する"""
+
+    def __init__(self, mode=LISTING_MODE, cache=None, metrics=None):
+        self.mode = mode
+        self.cache = cache
+        self.metrics = metrics or ScraperMetrics(log_path=None)
+        self.session = requests.Session()
+        self.session.headers.update(HEADERS)
+        self.driver = None
+        self.wait = None
+        self.selenium_pages = 0
+
+    def fetch(self, page):
+        """カードURLのリストを返す（ページ取得自体に失敗した場合は None）"""
+        url = build_page_url(page)
+
+        if self.mode == "http":
+            with self.metrics.timer("listing_http"):
+                detail_urls = fetch_listing_urls(self.session, url, cache=self.cache)
+            if detail_urls:
+                return detail_urls
+            print("⚠️  HTTPでカードを取得できず。Seleniumで再取得します")
+            detail_urls = self.fetch_with_selenium(page, url)
+            if detail_urls:
+                # JS描画が必要なページと判断し、以降はSeleniumに切り替える
+                print("ℹ️  以降のページはSeleniumで取得します")
+                self.mode = "selenium"
+            return detail_urls
+
+        return self.fetch_with_selenium(page, url)
+
+    def fetch_with_selenium(self, page, url):
+        # Chrome 定期再起動
+        if self.driver is not None and self.selenium_pages >= RESTART_INTERVAL:
+            print("\n=== Chrome 再起動 ===")
+            self.metrics.incr("chrome_restarts")
+            self.close()
+            time.sleep(3)
+
+        if self.driver is None:
+            from selenium.webdriver.support.ui import WebDriverWait
+
+            self.driver = create_driver()
+            self.wait = WebDriverWait(self.driver, 20)  # タイムアウトを延長
+            self.selenium_pages = 0
+
+        self.selenium_pages += 1
+        with self.metrics.timer("listing_selenium"):
+            if not safe_get(self.driver, self.wait, url):
+                return None
+
+        # ページ内容を検証
+        verify_page_content(self.driver, page)
+
+        # data-href を安全に抽出
+        return extract_card_urls(self.driver)
+
+    @property
+    def sleep_sec(self):
+        return HTTP_SLEEP_SEC if self.mode == "http" else SLEEP_SEC
+
+    def close(self):
+        if self.driver is not None:
+            self.driver.quit()
+            self.driver = None
+
+
 # =========================
 # メイン処理
 # =========================
-def main(start_page=1, end_page=None):
-    driver = create_driver()
-    wait = WebDriverWait(driver, 20)  # タイムアウトを延長
+def main(start_page=1, end_page=None, incremental=False, known_pages_to_stop=KNOWN_PAGES_TO_STOP,
+         state=None):
+    """incremental=True の場合、取得済みのカードは詳細ページを取得せずスキップし、
+    既知カードのみのページが known_pages_to_stop 回続いた時点で終了する（release_new 順前提）。
+    state（CrawlState）を渡すとページはフロンティアから確保し、処理状況を記録する"""
+    cache = HttpCache() if USE_HTTP_CACHE else None
+    metrics = ScraperMetrics()
+    listing = ListingFetcher(cache=cache, metrics=metrics)
 
-    existing_names = load_existing_names()
-    file_exists = os.path.exists(CSV_FILE)
+    # 詳細ページ用の非同期フェッチャー（ページをまたいでコネクションを使い回す）
+    loop = asyncio.new_event_loop()
+    parse_pool = ProcessPoolExecutor(max_workers=PARSE_WORKERS)
+    fetcher = AsyncDetailFetcher(
+        concurrency=DETAIL_CONCURRENCY, rate=DETAIL_RATE_PER_SEC, cache=cache,
+        parse_pool=parse_pool, parse_workers=PARSE_WORKERS, metrics=metrics
+    )
+    loop.run_until_complete(fetcher.open())
+
+    store = CardStore()
+    if len(store) == 0 and os.path.exists(CSV_FILE):
+        imported, skipped = store.import_csv(CSV_FILE)
+        print(f"既存の cards.csv を取り込み: {imported}枚（不正な行 {skipped}件をスキップ）")
+    existing_names = store.names()
+    # 取得済みの詳細URLは cards.db に記録する（旧 seen_cards.json があれば取り込む）
+    store.mark_seen(load_legacy_seen())
+    if incremental:
+        print(f"差分モード: 取得済み {store.seen_count()}件")
+
+    if state is not None:
+        released = state.recover()
+        if released:
+            print(f"ℹ️  中断されたページ {released}件 を再開対象に戻しました")
+        pages = state.iter_pages()
+    else:
+        pages = itertools.count(start_page)
     
     consecutive_empty_pages = 0  # 連続空ページカウンター
     MAX_EMPTY_PAGES = 3  # 3ページ連続で空なら終了
+    consecutive_known_pages = 0  # 既知カードのみのページの連続数
+    page = None
 
     try:
-        with open(CSV_FILE, "a", newline="", encoding="utf-8-sig") as f:
-            writer = csv.DictWriter(
-                f,
-                fieldnames=[
-                    "card_name",
-                    "civilization",
-                    "color_type",
-                    "card_type",
-                    "cost",
-                    "power",
-                    "race",
-                    "text",
-                    "tags"
-                ]
-            )
+        for page in pages:
+            if end_page is not None and page > end_page:
+                print("\n=== end_page に到達 ===")
+                break
 
-            if not file_exists:
-                writer.writeheader()
+            print(f"\n=== Page {page} ===")
+            page_start = time.perf_counter()
+            metrics.incr("pages")
 
-            page = start_page
-            while True:
-                if end_page is not None and page > end_page:
-                    print("\n=== end_page に到達 ===")
-                    break
-
-                # Chrome 定期再起動
-                if (page - start_page) % RESTART_INTERVAL == 0 and page != start_page:
-                    print("\n=== Chrome 再起動 ===")
-                    driver.quit()
-                    time.sleep(3)
-                    driver = create_driver()
-                    wait = WebDriverWait(driver, 20)
+            detail_urls = listing.fetch(page)
+            if detail_urls is None:
+                metrics.incr("listing_failures")
+                if state is not None:
+                    state.fail_page(page, "一覧ページ取得失敗")
+                    print("❌ ページ取得失敗。次のページへ")
+                    continue
+                print("❌ ページ取得失敗。終了")
+                break
 
-                print(f"\n=== Page {page} ===")
-                url = build_page_url(page)
-                #print(f"URL: {url}")
+            print(f"取得カード数: {len(detail_urls)}")
 
-                if not safe_get(driver, wait, url):
-                    print("❌ ページ取得失敗。終了")
+            if not detail_urls:
+                if state is not None:
+                    state.complete_page(page)
+                consecutive_empty_pages += 1
+                print(f"⚠️  カードなし（連続 {consecutive_empty_pages}/{MAX_EMPTY_PAGES}）")
+                
+                if consecutive_empty_pages >= MAX_EMPTY_PAGES:
+                    print("❌ 連続空ページ上限に到達。終了")
                     break
+                
+                time.sleep(listing.sleep_sec)
+                continue
+            else:
+                consecutive_empty_pages = 0  # リセット
 
-                # ページ内容を検証
-                verify_page_content(driver, page)
+            # フロンティア: 取得済みの詳細URLは再取得しない（失敗分のみ再試行）
+            if state is not None:
+                state.add_details(page, detail_urls)
+                detail_urls = state.pending_details(detail_urls)
 
-                # data-href を安全に抽出
-                detail_urls = extract_card_urls(driver)
-                
-                print(f"取得カード数: {len(detail_urls)}")
+            # 差分モード: 取得済みカードは詳細ページを取得しない
+            if incremental:
+                known_urls = store.known_detail_urls(detail_urls)
+                unknown_urls = [u for u in detail_urls if u not in known_urls]
+                print(f"  既知: {len(detail_urls) - len(unknown_urls)}件 / 未取得: {len(unknown_urls)}件")
+                for url in detail_urls:
+                    if state is not None and url not in unknown_urls:
+                        state.complete_detail(url)
+                detail_urls = unknown_urls
 
                 if not detail_urls:
-                    consecutive_empty_pages += 1
-                    print(f"⚠️  カードなし（連続 {consecutive_empty_pages}/{MAX_EMPTY_PAGES}）")
-                    
-                    if consecutive_empty_pages >= MAX_EMPTY_PAGES:
-                        print("❌ 連続空ページ上限に到達。終了")
+                    if state is not None:
+                        state.complete_page(page)
+                    consecutive_known_pages += 1
+                    print(f"ℹ️  既知カードのみ（連続 {consecutive_known_pages}/{known_pages_to_stop}）")
+                    if consecutive_known_pages >= known_pages_to_stop:
+                        print("✅ 新規カードなし。差分取得を終了")
                         break
-                    
-                    page += 1
-                    time.sleep(SLEEP_SEC)
+                    time.sleep(listing.sleep_sec)
                     continue
+                consecutive_known_pages = 0
+
+            # 各カードの詳細を並行取得
+            print(f"  詳細ページ {len(detail_urls)}件 を取得中...")
+            cards = loop.run_until_complete(fetcher.fetch_cards(detail_urls))
+
+            page_cards = []
+            failed_count = 0
+            for detail_url, card_data in zip(detail_urls, cards):
+                if not card_data:
+                    failed_count += 1
+                    if state is not None:
+                        state.fail_detail(detail_url, fetcher.errors.get(detail_url, "取得不能"))
+                    continue
+
+                name = card_data["card_name"]
+                if not name or name in existing_names:
+                    print(f"  スキップ: {name}")
                 else:
-                    consecutive_empty_pages = 0  # リセット
-
-                # 各カードの詳細を取得
-                new_cards_count = 0
-                for idx, detail_url in enumerate(detail_urls, 1):
-                    print(f"  [{idx}/{len(detail_urls)}] 処理中...")
-                    
-                    card_data = parse_card_detail(detail_url)
-                    if not card_data:
-                        continue
-
-                    name = card_data["card_name"]
-                    if not name or name in existing_names:
-                        print(f"  スキップ: {name}")
-                        continue
-
-                    writer.writerow(card_data)
-                    f.flush()  # 即座にファイルに書き込む
                     existing_names.add(name)
-                    new_cards_count += 1
                     print(f"  ✅ 追加: {name}")
+                card_data["detail_url"] = detail_url
+                page_cards.append(card_data)
 
-                print(f"ページ {page} 完了: {new_cards_count}枚の新規カードを追加")
-                
-                page += 1
-                time.sleep(SLEEP_SEC)
+            # ページ単位で1トランザクションにまとめて保存（既存カードは内容が変わった場合のみ更新）
+            new_cards_count, updated = store.upsert_many(page_cards)
+            if updated:
+                print(f"  🔄 更新: {updated}枚")
+
+            if state is not None:
+                for card_data in page_cards:
+                    state.complete_detail(card_data["detail_url"])
+
+            if state is not None:
+                if failed_count:
+                    state.fail_page(page, f"詳細ページ {failed_count}件 の取得に失敗")
+                else:
+                    state.complete_page(page)
+            print(f"ページ {page} 完了: {new_cards_count}枚の新規カードを追加")
+            metrics.observe("page", time.perf_counter() - page_start)
+            metrics.event(
+                "page", page=page, details=len(detail_urls), new=new_cards_count,
+                updated=updated, failed=failed_count,
+                seconds=round(time.perf_counter() - page_start, 3),
+            )
+            metrics.print_summary()
+            
+            time.sleep(listing.sleep_sec)
 
         print("\n=== 全カード取得完了 ===")
 
     except KeyboardInterrupt:
         print("\n⚠️  ユーザーによる中断") #ctrl+cで強制終了可能
+        if state is not None and page is not None:
+            state.fail_page(page, "ユーザーによる中断")
     except Exception as e:
         print(f"\n❌ 予期しないエラー: {e}")
         import traceback
         traceback.print_exc()
+        if state is not None and page is not None:
+            state.fail_page(page, f"予期しないエラー: {e}")
     finally:
-        driver.quit()
-        print(f"\n最終処理ページ: {page-1}")
+        listing.close()
+        loop.run_until_complete(fetcher.close())
+        loop.close()
+        parse_pool.shutdown()
+        # 検索用スナップショットを書き出す（分担実行では各ワーカーが書かず、全ワーカー終了後に --export で1回だけ）
+        if state is None:
+            exported = store.export_csv(CSV_FILE)
+            print(f"cards.csv を書き出し: {exported}枚")
+        else:
+            print("ℹ️  分担実行のため cards.csv は書き出しません（全ワーカーの終了後に --export で書き出します）")
+        store.close()
+        metrics.print_summary()
+        metrics.close()
+        print(f"\n最終処理ページ: {page}")
+        if state is not None:
+            print(f"クロール状態: {state.summary()}")
+
+
+# =========================
+# キャッシュからの再解析（オフライン）
+# =========================
+def parse_cached_detail(cache_dir, url):
+    """プロセスプール内でキャッシュから本文を読み、解析する"""
+    return parse_card_html(HttpCache(cache_dir).load_body(url))
+
+
+def replay(output_path=CSV_FILE, cache=None, workers=None):
+    """HTTPキャッシュ済みの詳細ページを parse_card_html で解析し直してカードDBを更新し、
+    CSV を書き出す。ネットワークには一切アクセスせず、解析は CPU コア数分のプロセスで並列に行う"""
+    cache = cache or HttpCache()
+    entries = sorted(cache.iter_entries(kind="detail"), key=lambda m: m["fetched_at"])
+    urls = [meta["url"] for meta in entries]
+    print(f"キャッシュ済み詳細ページ: {len(urls)}件")
+
+    store = CardStore()
+    inserted = updated = failed = 0
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(parse_cached_detail, cache.directory, url) for url in urls]
+        batch = []
+        for url, future in zip(urls, futures):
+            try:
+                card_data = future.result()
+            except Exception as e:
+                failed += 1
+                print(f"  解析失敗: {url} ({e})")
+                continue
+            card_data["detail_url"] = url
+            batch.append(card_data)
+            if len(batch) >= REPLAY_BATCH_SIZE:
+                added, changed = store.upsert_many(batch)
+                inserted, updated = inserted + added, updated + changed
+                batch = []
+        added, changed = store.upsert_many(batch)
+        inserted, updated = inserted + added, updated + changed
+
+    exported = store.export_csv(output_path)
+    store.close()
+
+    elapsed = time.perf_counter() - start
+    print(f"✅ 再解析完了: 追加 {inserted}枚 / 更新 {updated}枚 / 解析失敗 {failed}件 ({elapsed:.1f}秒)")
+    print(f"   {exported}枚を書き出し → {output_path}")
 
 
 if __name__ == "__main__":
-    main(start_page=76, end_page=423)
\ No newline at end of file
+    import argparse
+
+    parser = argparse.ArgumentParser(description="デュエル・マスターズ カードスクレイパー")
+    parser.add_argument("--start", type=int, default=None, help="開始ページ")
+    parser.add_argument("--end", type=int, default=None, help="終了ページ")
+    parser.add_argument("--incremental", action="store_true",
+                        help="差分モード（新しいカードから順に取得し、既知カードが続いたら終了）")
+    parser.add_argument("--known-pages", type=int, default=KNOWN_PAGES_TO_STOP,
+                        help="差分モードで終了とみなす既知ページの連続数")
+    parser.add_argument("--frontier", nargs="?", const=CRAWL_DB, default=None, metavar="DB",
+                        help="SQLiteのクロール状態を使って再開・複数プロセスでの分担を行う")
+    parser.add_argument("--status", action="store_true", help="クロール状態を表示して終了")
+    parser.add_argument("--replay", nargs="?", const=CSV_FILE, default=None, metavar="CSV",
+                        help="ネットワークを使わずHTTPキャッシュのHTMLを再解析してカードDBとCSVを作り直す")
+    parser.add_argument("--export", nargs="?", const=CSV_FILE, default=None, metavar="CSV",
+                        help="カードDBから検索用の cards.csv を書き出して終了（--frontier の分担実行の後に使う）")
+    args = parser.parse_args()
+
+    if args.replay:
+        replay(args.replay)
+        raise SystemExit
+    if args.export:
+        store = CardStore()
+        print(f"{store.export_csv(args.export)}枚を書き出し → {args.export}")
+        store.close()
+        raise SystemExit
+
+    state = CrawlState(args.frontier) if args.frontier or args.status else None
+    if args.status:
+        print(state.summary())
+        for kind, key, attempts, error in state.failures():
+            print(f"  {kind} {key} (試行 {attempts}回): {error}")
+    elif state is not None:
+        # 同じDBを指定して複数プロセスを起動すれば、ページを重複なく分担する
+        if args.start is not None or args.end is not None:
+            state.seed_pages(args.start or 1, args.end or 423)
+        elif state.page_count() == 0:
+            # 新しいクロールDBでは範囲の指定が無くても全ページ（1〜423）を登録する（何も取得せずに終わらないように）
+            print(f"ℹ️  クロール状態が空のため、ページ 1〜423 を登録します → {args.frontier}")
+            state.seed_pages(1, 423)
+        main(incremental=args.incremental, known_pages_to_stop=args.known_pages, state=state)
+    elif args.incremental:
+        main(start_page=args.start or 1, end_page=args.end,
+             incremental=True, known_pages_to_stop=args.known_pages)
+    else:
+        main(start_page=args.start or 76, end_page=args.end or 423)
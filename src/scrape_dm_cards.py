@@ -1,26 +1,29 @@
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
 import requests
 from bs4 import BeautifulSoup
 import os
 import re
-import csv
+import json
 import time
+from urllib.parse import urljoin, urlsplit, parse_qs
+
+from scraper_config import BASE_DIR, BASE_DOMAIN, HEADERS, SAVED_PAGES_DIR, START_URL  # noqa: F401
 
-BASE_DOMAIN = "https://dm.takaratomy.co.jp"
-START_URL = "https://dm.takaratomy.co.jp/card/"
-BASE_DIR = os.path.dirname(__file__)
 CSV_FILE = os.path.join(BASE_DIR, "data", "cards.csv")
+SEEN_FILE = os.path.join(BASE_DIR, "data", "seen_cards.json")  # 旧形式（取得済みURLは cards.db に移行）
+
+# 高速な lxml のパーサーを使う（requirements.txt に含む。入っていない環境では標準の html.parser）
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
 
-HEADERS = {
-    "User-Agent": (
-        "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
-        "AppleWebKit/537.36 (KHTML, like Gecko) "
-        "Chrome/120.0.0.0 Safari/537.36"
-    )
-}
 
 def create_driver():
+    # Selenium は一覧をHTTPで取得できない場合のフォールバックでのみ使うため、ここで読み込む
+    from selenium import webdriver
+    from selenium.webdriver.chrome.options import Options
+
     options = Options()
     options.add_argument("--headless=new")
     options.add_argument("--disable-gpu")
@@ -28,10 +31,105 @@ def create_driver():
     return webdriver.Chrome(options=options)
 
 
+# =========================
+# 一覧ページ解析（Selenium不要）
+# =========================
+def parse_listing_html(html, parser=HTML_PARSER):
+    """一覧ページのHTMLから .cardImage の data-href を詳細ページURLとして抽出する"""
+    soup = BeautifulSoup(html, parser)
+    return [
+        urljoin(BASE_DOMAIN, el["data-href"])
+        for el in soup.select(".cardImage[data-href]")
+        if el["data-href"]
+    ]
+
+
+def fetch_listing_urls(session, url, max_retry=3, cache=None):
+    """一覧ページをHTTPで取得してカードURLを返す（取得不能なら None）
+
+    cache（HttpCache）を渡すと条件付きリクエストを送り、304 ならキャッシュの本文を使う"""
+    for attempt in range(max_retry):
+        try:
+            headers = cache.conditional_headers(url) if cache else {}
+            res = session.get(url, headers=headers, timeout=10)
+
+            if res.status_code == 503:
+                raise requests.exceptions.HTTPError("503")
+
+            if res.status_code == 304 and cache:
+                body = cache.load_body(url)
+                if body is not None:
+                    cache.mark_validated(url)
+                    return parse_listing_html(body)
+                # キャッシュの本文が消えている → 条件なしで取り直す
+                res = session.get(url, timeout=10)
+                if res.status_code == 503:
+                    raise requests.exceptions.HTTPError("503")
+
+            res.raise_for_status()
+            if cache:
+                cache.store(url, res.content, res.headers, kind="listing")
+            # バイト列のまま渡して meta charset から文字コードを判定させる
+            return parse_listing_html(res.content)
+
+        except requests.exceptions.RequestException as e:
+            print(f"一覧取得失敗（{attempt+1}/{max_retry}）: {e}")
+            time.sleep(3)
+
+    return None
+
+
 # =========================
 # 詳細ページ解析
 # =========================
+def parse_card_html(html, parser=HTML_PARSER):
+    """詳細ページのHTMLからカード情報を抽出する（ネットワークに触れない純粋な解析処理）"""
+    soup = BeautifulSoup(html, parser)
+
+    def get_text(selector):
+        el = soup.select_one(selector)
+        return el.text.strip() if el else ""
+
+    raw_name = get_text(".card-name")
+    card_name = re.sub(r"\(.*?\)$", "", raw_name).strip()
+
+    card_type = get_text(".type")
+    civilization = get_text(".civil")
+    power = get_text(".power")
+    text = get_text(".skills.full")
+
+    cost = ""
+    race = ""
+
+    for row in soup.select("table tr"):
+        th = row.find("th")
+        td = row.find("td")
+        if not th or not td:
+            continue
+        key = th.text.strip()
+        val = td.text.strip()
+        if key == "コスト":
+            cost = val
+        elif key == "種族":
+            race = val
+
+    color_type = "多色" if "・" in civilization else "単色"
+
+    return {
+        "card_name": card_name,
+        "civilization": civilization,
+        "color_type": color_type,
+        "card_type": card_type,
+        "cost": cost,
+        "power": power,
+        "race": race,
+        "text": text,
+        "tags": ""
+    }
+
+
 def parse_card_detail(url, max_retry=5):
+    """1件ずつ同期で取得する（非同期フェッチャーが使えない場合のフォールバック）"""
     for attempt in range(max_retry):
         try:
             time.sleep(1.5)  
@@ -41,48 +139,7 @@ def parse_card_detail(url, max_retry=5):
                 raise requests.exceptions.HTTPError("503")
 
             res.raise_for_status()
-            soup = BeautifulSoup(res.text, "html.parser")
-
-            def get_text(selector):
-                el = soup.select_one(selector)
-                return el.text.strip() if el else ""
-
-            raw_name = get_text(".card-name")
-            card_name = re.sub(r"\(.*?\)$", "", raw_name).strip()
-
-            card_type = get_text(".type")
-            civilization = get_text(".civil")
-            power = get_text(".power")
-            text = get_text(".skills.full")
-
-            cost = ""
-            race = ""
-
-            for row in soup.select("table tr"):
-                th = row.find("th")
-                td = row.find("td")
-                if not th or not td:
-                    continue
-                key = th.text.strip()
-                val = td.text.strip()
-                if key == "コスト":
-                    cost = val
-                elif key == "種族":
-                    race = val
-
-            color_type = "多色" if "・" in civilization else "単色"
-
-            return {
-                "card_name": card_name,
-                "civilization": civilization,
-                "color_type": color_type,
-                "card_type": card_type,
-                "cost": cost,
-                "power": power,
-                "race": race,
-                "text": text,
-                "tags": ""
-            }
+            return parse_card_html(res.text)
 
         except Exception:
             print(f"詳細取得失敗（{attempt+1}/{max_retry}）: {url}")
@@ -93,14 +150,62 @@ def parse_card_detail(url, max_retry=5):
 
 
 # =========================
-# CSV既存カード名
+# 詳細ページURL
+# =========================
+def card_id_from_url(url):
+    """詳細ページURLからカードIDを取り出す（?id= が無ければパスをIDとみなす）"""
+    parts = urlsplit(url)
+    ids = parse_qs(parts.query).get("id")
+    if ids:
+        return ids[0]
+    return parts.path.rstrip("/")
+
+
+def load_legacy_seen(path=SEEN_FILE):
+    """以前の seen_cards.json（カードID -> {url, card_name}）を (URL, カード名) のリストで返す"""
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        return [(entry.get("url"), entry.get("card_name")) for entry in json.load(f).values()]
+
+
+# =========================
+# 保存済みHTMLの確認用
 # =========================
-def load_existing_names():
-    if not os.path.exists(CSV_FILE):
-        return set()
-    names = set()
-    with open(CSV_FILE, newline="", encoding="utf-8-sig") as f:
-        for row in csv.DictReader(f):
-            if row.get("card_name"):
-                names.add(row["card_name"])
-    return names
+def check_saved_pages(directory=SAVED_PAGES_DIR):
+    """保存済みの一覧・詳細ページ（fixtures）を解析し、expected.json と比べる。不一致の件数を返す"""
+    with open(os.path.join(directory, "expected.json"), encoding="utf-8") as f:
+        expected = json.load(f)
+    mismatches = 0
+    for name, ids in expected["listing"].items():
+        with open(os.path.join(directory, "listing", name), "rb") as f:
+            actual = [card_id_from_url(url) for url in parse_listing_html(f.read())]
+        ok = actual == ids
+        mismatches += not ok
+        print(f"{'✅' if ok else '❌'} 一覧 {name}: {len(actual)}件" + ("" if ok else f"（期待: {ids} / 実際: {actual}）"))
+    for name, fields in expected["detail"].items():
+        with open(os.path.join(directory, name), "rb") as f:
+            card = parse_card_html(f.read())
+        diff = {key: card.get(key) for key, value in fields.items() if card.get(key) != value}
+        mismatches += bool(diff)
+        print(f"{'✅' if not diff else '❌'} 詳細 {name}: {card['card_name']}" + (f"（不一致: {diff}）" if diff else ""))
+    return mismatches
+
+
+if __name__ == "__main__":
+    import sys
+
+    # 使い方: python scrape_dm_cards.py 一覧.html [詳細.html ...]
+    # 引数なしなら data/saved_pages の fixtures を解析して期待値と比べる
+    if len(sys.argv) == 1:
+        sys.exit(1 if check_saved_pages() else 0)
+    for path in sys.argv[1:]:
+        with open(path, "rb") as f:
+            html = f.read()
+        urls = parse_listing_html(html)
+        if urls:
+            print(f"{path}: 一覧ページ {len(urls)}件")
+            for url in urls:
+                print(f"  {url}")
+        else:
+            print(f"{path}: {parse_card_html(html)}")
@@ -0,0 +1,19 @@
+import os
+
+# =========================
+# スクレイパー共通の設定（重い依存を持たないモジュールから参照する）
+# =========================
+BASE_DIR = os.path.dirname(__file__)
+DATA_DIR = os.path.join(BASE_DIR, "data")
+SAVED_PAGES_DIR = os.path.join(DATA_DIR, "saved_pages")  # 解析確認・ローカル検証用の保存済みHTML
+
+BASE_DOMAIN = "https://dm.takaratomy.co.jp"
+START_URL = "https://dm.takaratomy.co.jp/card/"
+
+HEADERS = {
+    "User-Agent": (
+        "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
+        "AppleWebKit/537.36 (KHTML, like Gecko) "
+        "Chrome/120.0.0.0 Safari/537.36"
+    )
+}
@@ -0,0 +1,81 @@
+import json
+import os
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from latency_stats import latency_windows, quantiles
+from scraper_config import BASE_DIR
+
+METRICS_LOG = os.path.join(BASE_DIR, "data", "scraper_metrics.jsonl")
+
+# =========================
+# スクレイパーの計測
+# =========================
+class ScraperMetrics:
+    """ステージ別のカウンタとレイテンシを集計し、JSONL に書き出す
+
+    log_path=None の場合はメモリ上で集計するだけでファイルには書かない"""
+
+    def __init__(self, log_path=METRICS_LOG):
+        self.started = time.time()
+        self.counters = defaultdict(int)
+        self.latencies = latency_windows()
+        self._log = open(log_path, "a", encoding="utf-8") if log_path else None
+
+    def incr(self, name, n=1):
+        self.counters[name] += n
+
+    def observe(self, stage, seconds):
+        self.latencies[stage].append(seconds)
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def event(self, kind, **fields):
+        """1イベントを JSONL に追記する"""
+        if self._log is None:
+            return
+        record = {"ts": round(time.time(), 3), "event": kind, **fields}
+        self._log.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._log.flush()
+
+    def snapshot(self):
+        elapsed = max(time.time() - self.started, 1e-9)
+        stages = {}
+        for stage, values in self.latencies.items():
+            stages[stage] = {"count": len(values), **quantiles(values, (50, 90, 99))}
+        return {
+            "elapsed_sec": round(elapsed, 1),
+            "pages_per_min": round(self.counters["pages"] / elapsed * 60, 2),
+            "details_per_sec": round(self.counters["details_ok"] / elapsed, 3),
+            "counters": dict(self.counters),
+            "latency": stages,
+        }
+
+    def summary_line(self):
+        snap = self.snapshot()
+        c = self.counters
+        detail = snap["latency"].get("detail_fetch", {})
+        p50 = detail.get("p50")
+        p99 = detail.get("p99")
+        latency = f"{p50 * 1000:.0f}/{p99 * 1000:.0f}ms" if p50 is not None else "-"
+        return (
+            f"📊 {snap['pages_per_min']:.1f}ページ/分 | 詳細 {snap['details_per_sec']:.2f}件/秒 "
+            f"(p50/p99 {latency}) | 再試行 {c['retries']} (503: {c['http_503']}) | "
+            f"解析失敗 {c['parse_failures']} | 304 {c['not_modified']} | Chrome再起動 {c['chrome_restarts']}"
+        )
+
+    def print_summary(self):
+        print(self.summary_line())
+
+    def close(self):
+        self.event("summary", **self.snapshot())
+        if self._log is not None:
+            self._log.close()
+            self._log = None
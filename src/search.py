@@ -1,30 +1,63 @@
-import chromadb
-from chromadb.config import Settings
-import ollama
+import argparse
 import json
+import sys
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager, redirect_stdout
 from pathlib import Path
 import pandas as pd
 
+from card_catalog import MANIFEST_NAME, resolve_index
+from card_index import CardNameIndex, bigrams, normalize_name
+from similarity_graph import SimilarityGraph
+from search_metrics import SearchMetrics
+from search_executor import normalize_query
+from embeddings import EMBEDDING_BACKEND, load_embedder
+from result_cache import LRUCache, ResultCache, canonical_conditions, embedding_key
+from semantic_cache import SemanticConditionCache
+from ollama_router import get_router
+from text_normalize import AliasTable, contains_any, fold_columns, fold_text
+
+LEGACY_COLLECTION = "duel_masters_cards"
+RELOAD_INTERVAL = 30  # インデックス更新の確認間隔（秒）
+PROVISIONAL_K = 5     # 暫定結果として先に返す件数（Botの1ページ分）
+EXTRACT_WORKERS = 4   # まとめて検索する時に、LLMの条件抽出を同時に行う数
+QUERY_VECTOR_CACHE = 1024  # クエリの埋め込みを覚えておく件数（条件抽出の類似検索とランキングで共有）
+
+# 段階的な検索結果。stage は "provisional"（暫定）または "final"（確定）
+SearchUpdate = namedtuple("SearchUpdate", ["stage", "cards", "error", "elapsed"])
+
+
+class IndexSnapshot:
+    """1バージョン分のインデックス（カードデータとベクトルのコレクションの組）"""
+
+    def __init__(self, version, cards_df, collection_name, name_index, similar=None, embedder=None, folded=None):
+        self.version = version
+        self.cards_df = cards_df
+        self.folded = folded          # 照合用に正規化した列（フィルタ・ボーナス計算用）
+        self.collection_name = collection_name
+        self.collection = None        # ベクトル検索で初めて使う時に開く（Chroma の読み込みを遅らせる）
+        self.embedder = embedder      # このインデックスを構築したのと同じ埋め込み
+        self.name_index = name_index  # カード名・キーワード・種族の索引（オートコンプリート用）
+        self.similar = similar        # 類似カードのグラフ（未構築のインデックスでは None）
+        self.inflight = 0      # このバージョンを使って処理中の検索数
+        self.retired = False   # 新しいバージョンに切り替え済みか
+
+
 class DuelMastersHybridSearch:
-    def __init__(self):
-        script_dir = Path(__file__).parent
+    def __init__(self, base_dir=None, embedding_backend=None):
+        # base_dir を指定すると、その下の data/ と chroma_db/ を使う（ベンチマーク・評価用）
+        script_dir = Path(base_dir) if base_dir else Path(__file__).parent
+        self.script_dir = script_dir
+        # 埋め込みのバックエンド。インデックスを構築したものと違えば読み込み時にエラーにする
+        self.embedding_backend = embedding_backend or EMBEDDING_BACKEND
+        self.manifest_path = script_dir / "chroma_db" / MANIFEST_NAME
         
-        # ChromaDB クライアント初期化
-        self.chroma_client = chromadb.PersistentClient(
-            path=str(script_dir / "chroma_db"),
-            settings=Settings(anonymized_telemetry=False)
-        )
-        
-        # コレクション取得
-        self.collection = self.chroma_client.get_collection("duel_masters_cards")
-        
-        # カードデータをDataFrameとして保持
-        self.cards_df = pd.read_csv(
-            script_dir / "data" / "cards.csv",
-            encoding="utf-8",
-            on_bad_lines='skip',
-            engine='python'
-        )
+        # ChromaDB クライアントはベクトル検索で初めて使う時に作る
+        # （補完・カード引き・フィルタだけなら chromadb を読み込まない）
+        self._chroma_client = None
         
         # 用語集を読み込み（dataフォルダ内）
         glossary_path = script_dir / "data" / "duelmasters_glossary.json"
@@ -35,8 +68,8 @@ class DuelMastersHybridSearch:
             self.glossary = {}
             print("⚠️  用語集が見つかりません")
         
-        # 公式キーワードを読み込み
-        keywords_path = script_dir / "keywords.txt"
+        # 公式キーワードを読み込み（dataフォルダ内）
+        keywords_path = script_dir / "data" / "keywords.txt"
         self.official_keywords = []
         if keywords_path.exists():
             with open(keywords_path, "r", encoding="utf-8") as f:
@@ -44,12 +77,244 @@ class DuelMastersHybridSearch:
         else:
             print("⚠️  keywords.txtが見つかりません")
         
+        # 表記揺れ・俗語 -> 公式キーワード・正式表現（フィルタとボーナス計算で使う）
+        self.aliases = AliasTable.build(self.official_keywords, self.glossary)
+        
+        # インデックス（コレクション + カードデータ）を読み込み
+        # 検索中はスナップショットを固定し、再構築後は裏で読み込んでから切り替える
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._manifest_mtime = self._read_manifest_mtime()
+        self._snapshot = self._load_snapshot()
+        self._watcher = None
+        # 区間ごとの処理時間（抽出・フィルタ・埋め込み・ベクトル取得・ボーナス計算・整形）
+        self.metrics = SearchMetrics()
+        # 条件 -> 候補、(条件, クエリ埋め込み) -> 順位 のキャッシュ（インデックスのバージョンごと）
+        self.result_cache = ResultCache()
+        # 意味の近い過去のクエリから条件を使い回すキャッシュ（LLMの呼び出しを省く）
+        self.condition_cache = SemanticConditionCache(
+            keywords=self.official_keywords,
+            races=sorted({race for field in self.cards_df['race'].dropna() for race in str(field).split('/')}),
+            concepts=self.aliases.concepts,
+        )
+        self._query_vectors = LRUCache(QUERY_VECTOR_CACHE)
+        # 複数スレッドのクエリ埋め込みをまとめる仕組み（検索サーバーが設定する。embed(text, embedder) を持つ）
+        self.embedding_batcher = None
+        self._audit_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="extract-audit")
+        # 複数台の Ollama に振り分ける場合は、バックエンドごとのレイテンシも同じメトリクスに記録する
+        self.ollama_router = get_router()
+        if self.ollama_router is not None:
+            self.ollama_router.set_metrics(self.metrics)
+        
         print("✅ データベース接続完了")
+        print(f"インデックス: {self.index_version}（埋め込み: {self.embedding_backend}）")
         print(f"カードデータ: {len(self.cards_df)}枚読み込み")
         if self.glossary:
             print(f"用語集: 読み込み完了")
         if self.official_keywords:
             print(f"公式キーワード: {len(self.official_keywords)}件読み込み完了")
+        if self.ollama_router is not None:
+            pools = self.ollama_router.snapshot()
+            print(f"Ollama: chat {len(pools['chat'])}台 / 埋め込み {len(pools['embed'])}台に振り分け")
+    
+    # =========================
+    # インデックスのバージョン管理（ホットリロード）
+    # =========================
+    def _read_manifest_mtime(self):
+        try:
+            return self.manifest_path.stat().st_mtime
+        except FileNotFoundError:
+            return None
+    
+    def _load_snapshot(self):
+        """マニフェストが指すバージョンを読み込む（無ければ従来の固定コレクション）"""
+        manifest, csv_path = resolve_index(self.script_dir)
+        if manifest is not None:
+            version = manifest["version"]
+            collection_name = manifest["collection"]
+            graph_path = manifest.get("similar_graph")
+            similar = SimilarityGraph.load(self.manifest_path.parent / graph_path) if graph_path else None
+            embedder = load_embedder(manifest.get("embedding"), self.manifest_path.parent, self.embedding_backend)
+        else:
+            version = "legacy"
+            collection_name = LEGACY_COLLECTION
+            similar = None
+            embedder = load_embedder(None, self.manifest_path.parent, self.embedding_backend)
+        
+        # カードデータをDataFrameとして保持（インデックス構築時に使ったCSVと同じもの）
+        cards_df = pd.read_csv(
+            csv_path,
+            encoding="utf-8-sig",
+            on_bad_lines='skip'
+        )
+        name_index = CardNameIndex.build(
+            cards_df['card_name'].dropna().items(),
+            keywords=self.official_keywords,
+            races=cards_df['race'].dropna(),
+        )
+        folded = fold_columns(cards_df)
+        # 暫定ランキング用のカード名＋テキストの文字バイグラム（クエリごとに作り直さないよう、ここで1回だけ作る）
+        folded['grams'] = [
+            bigrams(normalize_name(f"{name}{text}")) for name, text in zip(cards_df['card_name'], cards_df['text'])
+        ]
+        return IndexSnapshot(version, cards_df, collection_name, name_index, similar, embedder, folded)
+    
+    def _current(self):
+        pinned = getattr(self._local, "snapshot", None)
+        return pinned if pinned is not None else self._snapshot
+    
+    @property
+    def cards_df(self):
+        return self._current().cards_df
+    
+    @property
+    def chroma_client(self):
+        if self._chroma_client is None:
+            import chromadb
+            from chromadb.config import Settings
+            
+            with self._lock:
+                if self._chroma_client is None:
+                    self._chroma_client = chromadb.PersistentClient(
+                        path=str(self.script_dir / "chroma_db"),
+                        settings=Settings(anonymized_telemetry=False)
+                    )
+        return self._chroma_client
+    
+    @property
+    def collection(self):
+        snapshot = self._current()
+        if snapshot.collection is None:
+            client = self.chroma_client
+            with self._lock:
+                if snapshot.collection is None:
+                    snapshot.collection = client.get_collection(snapshot.collection_name)
+        return snapshot.collection
+    
+    @property
+    def folded(self):
+        return self._current().folded
+    
+    @property
+    def index_version(self):
+        return self._current().version
+    
+    @property
+    def embedder(self):
+        return self._current().embedder
+    
+    @contextmanager
+    def pinned_snapshot(self, snapshot=None):
+        """このブロック内（同じスレッド）では、途中で切り替えがあっても同じバージョンを使う
+
+        snapshot を渡すとそのバージョンに固定する（別スレッドに処理を渡す時に、呼び出し元と同じ版を使わせる）"""
+        pinned = getattr(self._local, "snapshot", None)
+        if pinned is not None:
+            yield pinned
+            return
+        
+        with self._lock:
+            snapshot = snapshot or self._snapshot
+            snapshot.inflight += 1
+        self._local.snapshot = snapshot
+        try:
+            yield snapshot
+        finally:
+            self._local.snapshot = None
+            with self._lock:
+                snapshot.inflight -= 1
+                drained = snapshot.retired and snapshot.inflight == 0
+            if drained:
+                print(f"ℹ️  旧インデックス {snapshot.version} の処理が完了しました")
+    
+    def reload_if_changed(self):
+        """マニフェストが更新されていれば新しいバージョンを読み込んで切り替える"""
+        mtime = self._read_manifest_mtime()
+        if mtime == self._manifest_mtime:
+            return False
+        
+        # 読み込みは切り替え前に済ませる（その間も旧バージョンで検索できる）
+        new_snapshot = self._load_snapshot()
+        with self._lock:
+            old_snapshot = self._snapshot
+            self._snapshot = new_snapshot
+            self._manifest_mtime = mtime
+            old_snapshot.retired = True
+            inflight = old_snapshot.inflight
+        # 旧バージョンの結果はキーが一致しなくなるので、まとめて解放する
+        # （埋め込みもインデックスごとに変わりうるので、類似クエリの登録も捨てる）
+        self.result_cache.clear()
+        self._query_vectors.clear()
+        self.condition_cache.clear()
+        print(f"🔄 インデックスを切り替え: {old_snapshot.version} → {new_snapshot.version}"
+              f"（{len(new_snapshot.cards_df)}枚, 旧版で処理中 {inflight}件）")
+        return True
+    
+    def start_watcher(self, interval=RELOAD_INTERVAL):
+        """インデックスの更新をバックグラウンドで監視する"""
+        if self._watcher is not None:
+            return
+        
+        def watch():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.reload_if_changed()
+                except Exception as e:
+                    # 構築途中などで読めない場合は次回に再試行
+                    print(f"⚠️  インデックスの再読み込みに失敗: {e}")
+        
+        self._watcher = threading.Thread(target=watch, daemon=True, name="index-watcher")
+        self._watcher.start()
+    
+    # =========================
+    # 名前による補完・カード引き（LLM不使用）
+    # =========================
+    def complete(self, text, limit=25, kinds=None):
+        """入力途中の文字列から、カード名・公式キーワード・種族の候補を返す"""
+        return self._current().name_index.complete(text, limit=limit, kinds=kinds)
+    
+    def lookup_card(self, name, max_distance=2):
+        """カード名でカードを引く。戻り値は (カードのdict または None, 候補名のリスト)
+
+        完全一致（表記揺れは正規化で吸収）が無ければ、編集距離 max_distance 以内で最も近いカードを返す"""
+        with self.pinned_snapshot() as snapshot:
+            matches = snapshot.name_index.lookup(name, max_distance=max_distance)
+            if not matches:
+                return None, []
+            card_idx = matches[0]["card_idx"]
+            row = snapshot.cards_df.loc[[card_idx]]
+            card = row.astype(object).where(pd.notna(row), None).to_dict(orient="records")[0]
+            card["card_idx"] = card_idx
+            return card, [m["label"] for m in matches]
+    
+    def similar_cards(self, card_idx, limit=10, civilizations=None, cost_min=None, cost_max=None):
+        """事前計算したグラフから似たカードを返す（LLM・埋め込み不要）
+
+        戻り値は (類似度の列 similarity を付けたDataFrame, エラーメッセージ) のどちらか一方"""
+        with self.pinned_snapshot() as snapshot:
+            if snapshot.similar is None:
+                return None, "❌ 類似カードのデータがありません（prepare_database.py で再構築してください）"
+            if card_idx not in snapshot.similar:
+                return None, "❌ 指定されたカードが見つかりませんでした"
+            
+            ids, scores = snapshot.similar.neighbors_of(card_idx)
+            df = snapshot.cards_df.loc[ids].copy()
+            df['similarity'] = scores
+            
+            # 文明・コストで絞り込み（グラフは絞り込み前の上位なので、件数は減る）
+            if civilizations:
+                df = df[df['civilization'].apply(
+                    lambda x: any(civ in str(x) for civ in civilizations) if pd.notna(x) else False
+                )]
+            if cost_min is not None:
+                df = df[pd.to_numeric(df['cost'], errors='coerce') >= cost_min]
+            if cost_max is not None:
+                df = df[pd.to_numeric(df['cost'], errors='coerce') <= cost_max]
+            
+            if len(df) == 0:
+                return None, "❌ 条件に合う似たカードが見つかりませんでした"
+            return df.head(limit), None
     
     def build_glossary_examples(self):
         """用語集から検索例を生成"""
@@ -98,7 +363,50 @@ class DuelMastersHybridSearch:
         return "\n".join(examples)
     
     def extract_search_conditions(self, query):
+        """検索条件を抽出する（意味の近い過去のクエリがあれば、LLMを呼ばずにその条件を使う）"""
+        with self.metrics.span("extract") as span:
+            vector = self.query_embedding(query) if self.condition_cache.maxsize > 0 else None
+            hit = self.condition_cache.lookup(query, vector) if vector is not None else None
+            span.set(cache=hit is not None)
+            if hit is None:
+                conditions = self.extract_conditions_llm(query)
+                if vector is not None:
+                    self.condition_cache.add(query, vector, conditions)
+                return conditions
+        
+        conditions, cached_query, similarity, audit = hit
+        print(f"♻️  似た検索「{cached_query}」の条件を使います（類似度 {similarity:.3f}）")
+        if audit:
+            self._audit_pool.submit(self._audit_reuse, query, cached_query, similarity, conditions)
+        return conditions
+    
+    def _audit_reuse(self, query, cached_query, similarity, reused):
+        """使い回した条件を、裏で LLM でも抽出して答え合わせする"""
+        try:
+            actual = self.extract_conditions_llm(query, span="extract.audit")
+            if not self.condition_cache.record_audit(query, cached_query, similarity, reused, actual):
+                print(f"⚠️  条件の使い回しが誤っていました: 「{query}」←「{cached_query}」（類似度 {similarity:.3f}）")
+        except Exception as e:
+            print(f"⚠️  条件の答え合わせに失敗: {e}")
+    
+    def query_embedding(self, query):
+        """クエリの埋め込み（直近のものは覚えておき、条件抽出とランキングで1回で済ませる）"""
+        key = (self.index_version, query)
+        vector = self._query_vectors.get(key)
+        if vector is None:
+            with self.metrics.span("embed"):
+                vector = self.generate_embedding(query)
+            self._query_vectors.put(key, vector)
+        return vector
+    
+    def _remember_embeddings(self, queries, vectors, version):
+        for query, vector in zip(queries, vectors):
+            self._query_vectors.put((version, query), vector)
+    
+    def extract_conditions_llm(self, query, span="extract.llm"):
         """LLMで検索条件を抽出（用語集を活用）"""
+        import ollama_router
+        
         print("検索条件を抽出中...")
         
         glossary_examples = self.build_glossary_examples()
@@ -244,20 +552,21 @@ class DuelMastersHybridSearch:
 
 **必ずJSONのみを出力してください。説明は不要です。**"""
 
-        response = ollama.chat(
-            model='llama3.1:8b',
-            messages=[
-                {
-                    'role': 'system',
-                    'content': 'あなたはデュエル・マスターズのカード検索システムです。用語集を活用し、正確に条件を抽出してください。'
-                },
-                {
-                    'role': 'user',
-                    'content': prompt
-                }
-            ],
-            options={'temperature': 0.1}
-        )
+        with self.metrics.span(span):
+            response = ollama_router.chat(
+                model='llama3.1:8b',
+                messages=[
+                    {
+                        'role': 'system',
+                        'content': 'あなたはデュエル・マスターズのカード検索システムです。用語集を活用し、正確に条件を抽出してください。'
+                    },
+                    {
+                        'role': 'user',
+                        'content': prompt
+                    }
+                ],
+                options={'temperature': 0.1}
+            )
         
         # JSONをパース
         try:
@@ -275,8 +584,10 @@ class DuelMastersHybridSearch:
                 original_keywords = conditions['keywords'].copy()
                 conditions['keywords'] = [
                     kw for kw in conditions['keywords'] 
-                    if kw in self.official_keywords
+                    if self.aliases.canonical_keyword(kw) is not None
                 ]
+                # 別表記（「Sトリガー」など）は公式の表記に揃える
+                conditions['keywords'] = [self.aliases.canonical_keyword(kw) for kw in conditions['keywords']]
                 
                 # 除外された俗語をログ出力
                 removed = set(original_keywords) - set(conditions['keywords'])
@@ -293,150 +604,213 @@ class DuelMastersHybridSearch:
             return {}
     
     def filter_by_conditions(self, conditions):
-        """Pythonで明確な条件のみフィルタリング（厳密版）"""
+        """Pythonで明確な条件のみフィルタリング（厳密版）
+
+        照合は読み込み時に作った正規化済みの列に対して行う（全角半角・「・」の有無を区別しない）。
+        同じ項目に対する複数の語（グループ内OR・俗語の別表記）は1回の走査でまとめて判定する"""
         print("条件でフィルタリング中...")
         
-        df = self.cards_df.copy()
-        original_count = len(df)
+        folded = self.folded
+        mask = pd.Series(True, index=folded.index)
+        original_count = len(folded)
+        
+        @contextmanager
+        def stage(name):
+            # 各条件の前後の候補数を区間に記録する
+            with self.metrics.span(f"filter.{name}", before=int(mask.sum())) as span:
+                yield
+                span.set(candidates=int(mask.sum()))
         
         # コストでフィルタ
         if conditions.get('cost_min') is not None:
-            df = df[pd.to_numeric(df['cost'], errors='coerce') >= conditions['cost_min']]
+            with stage("cost_min"):
+                mask &= folded['cost'] >= conditions['cost_min']
         if conditions.get('cost_max') is not None:
-            df = df[pd.to_numeric(df['cost'], errors='coerce') <= conditions['cost_max']]
+            with stage("cost_max"):
+                mask &= folded['cost'] <= conditions['cost_max']
         
-        # 文明でフィルタ（厳密版）
+        # 文明でフィルタ（厳密版。「水」なら必ず「水」が含まれる）
         if conditions.get('civilizations'):
-            civs = conditions['civilizations']
-            # 文明は厳密に一致させる（「水」なら必ず「水」が含まれる）
-            df = df[df['civilization'].apply(
-                lambda x: any(civ in str(x) for civ in civs) if pd.notna(x) else False
-            )]
-            print(f"   文明フィルタ適用: {civs} → {len(df)}枚")
+            with stage("civilizations"):
+                civs = conditions['civilizations']
+                mask &= contains_any(folded['civilization'], [fold_text(civ) for civ in civs])
+                print(f"   文明フィルタ適用: {civs} → {int(mask.sum())}枚")
         
         # カードタイプでフィルタ
         if conditions.get('card_types'):
-            types = conditions['card_types']
-            df = df[df['card_type'].apply(
-                lambda x: any(t in str(x) for t in types) if pd.notna(x) else False
-            )]
+            with stage("card_types"):
+                mask &= contains_any(folded['card_type'], [fold_text(t) for t in conditions['card_types']])
         
-        # キーワードでフィルタ（重要なキーワードは厳密に）
+        # キーワードでフィルタ（公式キーワードのみ、必ず含む）
         if conditions.get('keywords'):
-            # 特に厳密にフィルタすべきキーワード（検索で重要度が高い）
-            high_priority_keywords = [
-                'S・トリガー', 'スーパー・S・トリガー', 'S・トリガー・プラス',
-                '侵略', 'S級侵略', 'SSS級侵略', '侵略ZERO',
-                '革命チェンジ', 'P革命チェンジ',
-                'スピードアタッカー', 'マッハファイター',
-                'ブロッカー'
-            ]
-            
-            for keyword in conditions['keywords']:
-                # 公式キーワードリストに含まれているか確認
-                if keyword not in self.official_keywords:
-                    print(f"   ⚠️  警告: '{keyword}' は公式キーワードリストに含まれていません（スキップ）")
-                    continue
-                
-                # 高優先度キーワードかチェック
-                is_high_priority = keyword in high_priority_keywords
-                
-                if is_high_priority:
-                    # 厳密一致（必ず含む）
-                    df = df[df['text'].apply(
-                        lambda x: keyword in str(x) if pd.notna(x) else False
-                    )]
-                    print(f"   厳密キーワードフィルタ: {keyword} → {len(df)}枚")
-                else:
-                    # 通常キーワード
-                    df = df[df['text'].apply(
-                        lambda x: keyword in str(x) if pd.notna(x) else False
-                    )]
+            with stage("keywords"):
+                for keyword in conditions['keywords']:
+                    official = self.aliases.canonical_keyword(keyword)
+                    if official is None:
+                        print(f"   ⚠️  警告: '{keyword}' は公式キーワードリストに含まれていません（スキップ）")
+                        continue
+                    mask &= contains_any(folded['text'], self.aliases.expand(official))
+                    print(f"   キーワードフィルタ: {official} → {int(mask.sum())}枚")
         
         # 種族でフィルタ
         if conditions.get('race_keywords'):
-            for race_kw in conditions['race_keywords']:
-                df = df[df['race'].apply(
-                    lambda x: race_kw in str(x) if pd.notna(x) else False
-                )]
+            with stage("race_keywords"):
+                for race_kw in conditions['race_keywords']:
+                    mask &= contains_any(folded['race'], [fold_text(race_kw)])
         
         # 全体検索（全カラム対象：card_name, civilization, color_type, card_type, cost, power, race, text）
         if conditions.get('general_search'):
-            for search_term in conditions['general_search']:
-                # すべてのカラムのいずれかに含まれていればOK
-                df = df[df.apply(
-                    lambda row: (
-                        (pd.notna(row.get('card_name')) and search_term in str(row['card_name'])) or
-                        (pd.notna(row.get('civilization')) and search_term in str(row['civilization'])) or
-                        (pd.notna(row.get('color_type')) and search_term in str(row['color_type'])) or
-                        (pd.notna(row.get('card_type')) and search_term in str(row['card_type'])) or
-                        (pd.notna(row.get('cost')) and search_term in str(row['cost'])) or
-                        (pd.notna(row.get('power')) and search_term in str(row['power'])) or
-                        (pd.notna(row.get('race')) and search_term in str(row['race'])) or
-                        (pd.notna(row.get('text')) and search_term in str(row['text']))
-                    ),
-                    axis=1
-                )]
+            with stage("general_search"):
+                for search_term in conditions['general_search']:
+                    mask &= contains_any(folded['all'], [fold_text(search_term)])
         
-        # 効果グループでフィルタ（グループ内OR、グループ間AND）
+        # 効果グループでフィルタ（グループ内OR、グループ間AND。俗語は正式表現に展開）
         if conditions.get('effect_groups'):
-            effect_groups = conditions['effect_groups']
-            
-            # effect_groupsの検証と修正
-            validated_groups = []
-            for group in effect_groups:
-                # 3重配列の場合は平坦化
-                if isinstance(group, list) and len(group) > 0 and isinstance(group[0], list):
-                    print(f"⚠️  3重配列を検出、修正中: {group}")
-                    group = group[0]  # 最初の要素を取り出す
-                
-                # グループが文字列のリストであることを確認
-                if isinstance(group, list) and all(isinstance(item, str) for item in group):
-                    validated_groups.append(group)
-                else:
-                    print(f"⚠️  不正なグループをスキップ: {group}")
-            
-            # 検証済みグループでフィルタ
-            for group in validated_groups:
-                df = df[df['text'].apply(
-                    lambda x: any(keyword in str(x) for keyword in group) if pd.notna(x) else False
-                )]
+            with stage("effect_groups"):
+                for group in self.validate_effect_groups(conditions['effect_groups']):
+                    mask &= contains_any(folded['text'], self.aliases.expand_all(group))
         
         # 除外キーワードでフィルタ（相手への干渉を除外など）
         if conditions.get('exclude_keywords'):
-            for exclude_kw in conditions['exclude_keywords']:
-                df = df[df['text'].apply(
-                    lambda x: exclude_kw not in str(x) if pd.notna(x) else True
-                )]
+            with stage("exclude_keywords"):
+                excluded = [fold_text(kw) for kw in conditions['exclude_keywords'] if fold_text(kw)]
+                if excluded:
+                    mask &= ~contains_any(folded['text'], excluded)
         
-        filtered_count = len(df)
-        print(f"✅ フィルタ結果: {original_count}枚 → {filtered_count}枚")
+        df = self.cards_df[mask]
+        print(f"✅ フィルタ結果: {original_count}枚 → {len(df)}枚")
         
         return df
     
-    def generate_embedding(self, text):
-        """テキストをベクトル化"""
-        response = ollama.embeddings(
-            model='nomic-embed-text',
-            prompt=text
+    def validate_effect_groups(self, effect_groups):
+        """effect_groups を文字列のリストのリストに揃える（LLMの出力の崩れを直す）"""
+        validated_groups = []
+        for group in effect_groups:
+            # 3重配列の場合は平坦化
+            if isinstance(group, list) and len(group) > 0 and isinstance(group[0], list):
+                print(f"⚠️  3重配列を検出、修正中: {group}")
+                group = group[0]  # 最初の要素を取り出す
+            
+            # グループが文字列のリストであることを確認
+            if isinstance(group, list) and all(isinstance(item, str) for item in group):
+                validated_groups.append(group)
+            else:
+                print(f"⚠️  不正なグループをスキップ: {group}")
+        return validated_groups
+    
+    def filter_cached(self, conditions):
+        """filter_by_conditions をキャッシュ付きで実行する → (DataFrame, キャッシュに当たったか)
+
+        言い回しが違っても抽出された条件が同じなら、フィルタをやり直さずに候補を返す"""
+        snapshot = self._current()
+        condition_key = canonical_conditions(conditions)
+        card_ids = self.result_cache.get_filtered(snapshot.version, condition_key)
+        if card_ids is not None:
+            return snapshot.cards_df.loc[card_ids], True
+        
+        filtered_df = self.filter_by_conditions(conditions)
+        self.result_cache.put_filtered(snapshot.version, condition_key, filtered_df.index.to_numpy())
+        return filtered_df, False
+    
+    def rank_cached(self, filtered_df, query, conditions, top_k=50, query_embedding=None):
+        """rank_by_vector_search をキャッシュ付きで実行する → (DataFrame, キャッシュに当たったか)
+
+        順位は条件（= 候補）とクエリの埋め込みだけで決まるので、その組をキーにする"""
+        snapshot = self._current()
+        if query_embedding is None:
+            query_embedding = self.query_embedding(query)
+        condition_key = canonical_conditions(conditions)
+        query_key = embedding_key(query_embedding)
+        cached = self.result_cache.get_ranked(snapshot.version, condition_key, query_key, top_k)
+        if cached is not None:
+            card_ids, scores = cached
+            ranked_df = snapshot.cards_df.loc[card_ids].copy()
+            ranked_df['score'] = scores
+            return ranked_df, True
+        
+        ranked_df = self.rank_by_vector_search(
+            filtered_df, query, conditions, top_k=top_k, query_embedding=query_embedding
         )
-        return response['embedding']
+        # ベクトル検索に失敗した時の代わりの結果（score 列なし）はキャッシュしない
+        if 'score' in ranked_df.columns:
+            self.result_cache.put_ranked(
+                snapshot.version, condition_key, query_key, top_k,
+                ranked_df.index.to_numpy(), ranked_df['score'].to_numpy(),
+            )
+        return ranked_df, False
+    
+    def generate_embedding(self, text):
+        """テキストをベクトル化（インデックスと同じ埋め込みを使う）"""
+        embedder = self.embedder  # このスレッドが固定しているバージョンの埋め込み
+        if self.embedding_batcher is not None:
+            return self.embedding_batcher.embed(text, embedder)
+        return embedder.embed(text)
+
+    def generate_embeddings(self, texts):
+        """複数テキストを1回の呼び出しでベクトル化"""
+        return self.embedder.embed_many(list(texts))
     
-    def rank_by_vector_search(self, filtered_df, query, conditions, top_k=50):
-        """ベクトル検索でランキング（完全一致ボーナス付き）"""
+    def match_bonuses(self, df, conditions):
+        """抽出条件との完全一致ボーナス（ベクトル検索・暫定ランキングで共通）。df と同じ index の Series"""
+        folded = self.folded.loc[df.index]
+        bonus = pd.Series(0.0, index=df.index)
+        
+        # 文明の完全一致ボーナス（重要度: 高）
+        for civ in conditions.get('civilizations') or []:
+            bonus += 0.5 * contains_any(folded['civilization'], [fold_text(civ)])
+        
+        # キーワードの完全一致ボーナス（重要度: 高）
+        for kw in conditions.get('keywords') or []:
+            bonus += 0.3 * contains_any(folded['text'], self.aliases.expand(kw))
+        
+        # 種族の完全一致ボーナス
+        for race_kw in conditions.get('race_keywords') or []:
+            bonus += 0.2 * contains_any(folded['race'], [fold_text(race_kw)])
+        
+        # 効果グループの一致ボーナス（グループ内は1回のみ）
+        for group in conditions.get('effect_groups') or []:
+            if isinstance(group, list):
+                terms = [term for term in group if isinstance(term, str)]
+                bonus += 0.15 * contains_any(folded['text'], self.aliases.expand_all(terms))
+        
+        return bonus
+    
+    def rank_by_lexical(self, filtered_df, query, conditions, top_k=PROVISIONAL_K):
+        """埋め込みを使わない暫定ランキング（完全一致ボーナス + クエリとの文字バイグラムの重なり）"""
+        if len(filtered_df) == 0:
+            return filtered_df
+        
+        query_grams = bigrams(normalize_name(query))
+        scores = self.match_bonuses(filtered_df, conditions)
+        if query_grams:
+            # カードのバイグラムはスナップショットで作成済み。ここでは集合の共通部分を数えるだけ
+            card_grams = self.folded['grams'].loc[filtered_df.index]
+            scores += card_grams.map(lambda grams: len(query_grams & grams)) / len(query_grams)
+        
+        order = (-scores.to_numpy()).argsort(kind="stable")
+        return filtered_df.iloc[order[:top_k]]
+    
+    def rank_by_vector_search(self, filtered_df, query, conditions, top_k=50, query_embedding=None):
+        """ベクトル検索でランキング（完全一致ボーナス付き）
+
+        query_embedding を渡すとクエリの埋め込みを省略する（まとめて計算済みの場合）。
+        結果には類似度 + ボーナスの score 列が付く"""
         if len(filtered_df) == 0:
             return filtered_df
         
         print(f"ベクトル検索でランキング中... (上位{min(top_k, len(filtered_df))}件)")
         
-        query_embedding = self.generate_embedding(query)
+        if query_embedding is None:
+            with self.metrics.span("embed"):
+                query_embedding = self.generate_embedding(query)
         filtered_ids = [f"card_{idx}" for idx in filtered_df.index]
         
         try:
-            results = self.collection.get(
-                ids=filtered_ids,
-                include=['embeddings']
-            )
+            with self.metrics.span("vector_fetch", candidates=len(filtered_ids)):
+                results = self.collection.get(
+                    ids=filtered_ids,
+                    include=['embeddings']
+                )
             
             if not results['ids']:
                 return filtered_df.head(top_k)
@@ -451,96 +825,256 @@ class DuelMastersHybridSearch:
             )
             
             # 完全一致ボーナスを追加
-            for i, card_id in enumerate(results['ids']):
-                card_idx = int(card_id.replace('card_', ''))
-                card = filtered_df.loc[card_idx]
-                bonus = 0.0
-                
-                # 文明の完全一致ボーナス（重要度: 高）
-                if conditions.get('civilizations'):
-                    for civ in conditions['civilizations']:
-                        if pd.notna(card['civilization']) and civ in str(card['civilization']):
-                            bonus += 0.5  # 高いボーナス
-                            print(f"   文明一致ボーナス: {card['card_name']} (+0.5)")
-                
-                # キーワードの完全一致ボーナス（重要度: 高）
-                if conditions.get('keywords'):
-                    for kw in conditions['keywords']:
-                        if pd.notna(card['text']) and kw in str(card['text']):
-                            bonus += 0.3  # 高いボーナス
-                            print(f"   キーワード一致ボーナス: {card['card_name']} (+0.3)")
-                
-                # 種族の完全一致ボーナス
-                if conditions.get('race_keywords'):
-                    for race_kw in conditions['race_keywords']:
-                        if pd.notna(card['race']) and race_kw in str(card['race']):
-                            bonus += 0.2
-                            print(f"   種族一致ボーナス: {card['card_name']} (+0.2)")
-                
-                # 効果グループの一致ボーナス
-                if conditions.get('effect_groups'):
-                    for group in conditions['effect_groups']:
-                        if isinstance(group, list):
-                            for effect_kw in group:
-                                if pd.notna(card['text']) and effect_kw in str(card['text']):
-                                    bonus += 0.15
-                                    print(f"   効果一致ボーナス: {card['card_name']} (+0.15)")
-                                    break  # グループ内は1回のみ
-                
+            with self.metrics.span("bonus", candidates=len(results['ids'])):
+                result_indices = [int(card_id.replace('card_', '')) for card_id in results['ids']]
+                bonuses = self.match_bonuses(filtered_df, conditions)
                 # ボーナスを適用（類似度は[-1, 1]の範囲なので、ボーナスで確実に上位に）
-                similarities[i] += bonus
+                similarities += bonuses.loc[result_indices].to_numpy()
+                print(f"   完全一致ボーナス: {int((bonuses > 0).sum())}枚")
             
             sorted_indices = np.argsort(similarities)[::-1][:top_k]
             sorted_ids = [results['ids'][i] for i in sorted_indices]
             
             card_indices = [int(id.replace('card_', '')) for id in sorted_ids]
-            return filtered_df.loc[card_indices]
-            
+            ranked_df = filtered_df.loc[card_indices].copy()
+            ranked_df['score'] = similarities[sorted_indices]
+            return ranked_df
+
+        except ImportError as e:
+            # chromadb が無い環境では、埋め込みを使わない暫定ランキングで代用する
+            print(f"⚠️  ベクトル検索を使えません（{e}）。文字列の一致で並べます")
+            return self.rank_by_lexical(filtered_df, query, conditions, top_k=top_k)
         except Exception as e:
             print(f"⚠️  ベクトル検索エラー: {e}")
             return filtered_df.head(top_k)
     
+    def iter_find_cards(self, query, top_k=50, provisional_k=PROVISIONAL_K):
+        """検索結果を段階的に返すカーソル（Bot・検索サーバー用）
+
+        フィルタ直後に暫定の上位 provisional_k 件（stage="provisional"）、
+        ベクトル検索後に確定結果（stage="final"）を SearchUpdate として yield する。
+        エラー時は error 付きの final を1回だけ返す"""
+        with self.metrics.trace(query):
+            started = time.perf_counter()
+            conditions = self.extract_search_conditions(query)
+            
+            if not conditions:
+                yield self._update("final", None, "❌ 検索条件の抽出に失敗しました", started)
+                return
+            
+            with self.pinned_snapshot():
+                with self.metrics.span("filter") as span:
+                    filtered_df, hit = self.filter_cached(conditions)
+                    span.set(candidates=len(filtered_df), cache=hit)
+                
+                if len(filtered_df) == 0:
+                    yield self._update("final", None, "❌ 条件に合うカードが見つかりませんでした", started)
+                    return
+                
+                if provisional_k:
+                    with self.metrics.span("lexical", candidates=len(filtered_df)):
+                        provisional_df = self.rank_by_lexical(filtered_df, query, conditions, top_k=provisional_k)
+                    yield self._update("provisional", provisional_df, None, started)
+                
+                with self.metrics.span("rank") as span:
+                    ranked_df, hit = self.rank_cached(filtered_df, query, conditions, top_k=top_k)
+                    span.set(candidates=len(ranked_df), cache=hit)
+                yield self._update("final", ranked_df, None, started)
+    
+    def _update(self, stage, cards, error, started):
+        elapsed = time.perf_counter() - started
+        if error is None:
+            self.metrics.observe(f"result.{stage}", elapsed)
+        return SearchUpdate(stage, cards, error, elapsed)
+    
+    def find_cards(self, query, top_k=50, on_provisional=None):
+        """条件抽出 → フィルタ → ランキングをまとめて実行（Bot・検索サーバー用）
+
+        戻り値は (ランキング済みDataFrame, エラーメッセージ) のどちらか一方。
+        on_provisional を渡すと、暫定結果が出た時点でその DataFrame を引数に呼ばれる"""
+        for update in self.iter_find_cards(query, top_k=top_k, provisional_k=PROVISIONAL_K if on_provisional else 0):
+            if update.stage == "provisional":
+                on_provisional(update.cards)
+        return update.cards, update.error
+    
+    def iter_search_many(self, queries, top_k=50, max_workers=EXTRACT_WORKERS):
+        """複数クエリをまとめて検索し、終わったものから (元の位置, 結果) を返す
+
+        同じクエリ（表記揺れを正規化）は1回だけ実行する。クエリの埋め込みは1回の呼び出しにまとめ、
+        LLMによる条件抽出は最大 max_workers 件ずつ並列に行う。
+        結果は {"query", "cards"(DataFrame), "error", "timings"(ミリ秒)} の dict"""
+        queries = list(queries)
+        positions = {}
+        for i, query in enumerate(queries):
+            positions.setdefault(normalize_query(query), []).append(i)
+        unique = [queries[indices[0]] for indices in positions.values()]
+        if not unique:
+            return
+        
+        with self.pinned_snapshot() as snapshot, ThreadPoolExecutor(max_workers=max_workers) as pool:
+            # プールのスレッドには固定が引き継がれないので、それぞれ同じバージョンに固定し直す
+            def timed_extract(query):
+                if self.condition_cache.maxsize > 0:
+                    embed_future.result()  # 類似クエリの検索には、まとめて計算した埋め込みを使う
+                start = time.perf_counter()
+                with self.pinned_snapshot(snapshot):
+                    conditions = self.extract_search_conditions(query)
+                return conditions, (time.perf_counter() - start) * 1000
+            
+            def timed_embed():
+                start = time.perf_counter()
+                with self.pinned_snapshot(snapshot), self.metrics.span("embed", batch=len(unique)):
+                    vectors = self.generate_embeddings(unique)
+                self._remember_embeddings(unique, vectors, snapshot.version)
+                return vectors, (time.perf_counter() - start) * 1000
+            
+            # 埋め込みは条件抽出と並行して1回で計算する
+            embed_future = pool.submit(timed_embed)
+            extract_futures = {pool.submit(timed_extract, query): n for n, query in enumerate(unique)}
+            
+            for future in as_completed(extract_futures):
+                n = extract_futures[future]
+                query = unique[n]
+                timings = {}
+                try:
+                    conditions, timings["extract"] = future.result()
+                    result = {"query": query, "cards": None, "error": None, "timings": timings}
+                    if not conditions:
+                        result["error"] = "❌ 検索条件の抽出に失敗しました"
+                    else:
+                        start = time.perf_counter()
+                        filtered_df, _ = self.filter_cached(conditions)
+                        timings["filter"] = (time.perf_counter() - start) * 1000
+                        if len(filtered_df) == 0:
+                            result["error"] = "❌ 条件に合うカードが見つかりませんでした"
+                        else:
+                            vectors, timings["embed_batch"] = embed_future.result()
+                            start = time.perf_counter()
+                            result["cards"], _ = self.rank_cached(
+                                filtered_df, query, conditions, top_k=top_k, query_embedding=vectors[n]
+                            )
+                            timings["rank"] = (time.perf_counter() - start) * 1000
+                except Exception as e:
+                    result = {"query": query, "cards": None, "error": f"❌ 検索エラー: {e}", "timings": timings}
+                
+                for i in positions[normalize_query(query)]:
+                    yield i, {**result, "query": queries[i]}
+    
+    def search_many(self, queries, top_k=50, max_workers=EXTRACT_WORKERS):
+        """iter_search_many の結果を入力と同じ順のリストで返す"""
+        queries = list(queries)
+        results = [None] * len(queries)
+        for i, result in self.iter_search_many(queries, top_k=top_k, max_workers=max_workers):
+            results[i] = result
+        return results
+    
+    def latency_summary(self):
+        """初回表示までの時間（provisional）と確定までの時間（final）の中央値・p95（秒）"""
+        summary = {}
+        for name, stats in self.metrics.snapshot().items():
+            if name.startswith("result."):
+                summary[name[len("result."):]] = {
+                    "count": stats["count"],
+                    "p50": round(stats["p50"], 3),
+                    "p95": round(stats["p95"], 3),
+                }
+        return summary
+    
     def search(self, query, max_display=10):
         """ハイブリッド検索（最終版）"""
         print(f"\n{'='*60}")
         print(f"検索クエリ: {query}")
         print(f"{'='*60}\n")
         
-        # Step 1: 明確な条件を抽出
-        conditions = self.extract_search_conditions(query)
-        
-        # Step 2: 条件でフィルタリング
-        filtered_df = self.filter_by_conditions(conditions) if conditions else self.cards_df.copy()
-        
-        if len(filtered_df) == 0:
-            print("❌ 条件に合うカードが見つかりませんでした")
-            return None
-        
-        # Step 3: ベクトル検索でランキング（完全一致ボーナス付き）
-        ranked_df = self.rank_by_vector_search(filtered_df, query, conditions, top_k=50)
-        
-        # Step 4: 結果表示
-        print(f"\n{'='*60}")
-        print(f"検索結果: {len(ranked_df)}件")
-        print(f"{'='*60}\n")
-        
-        for i, (idx, card) in enumerate(ranked_df.head(max_display).iterrows(), 1):
-            print(f"【{i}】{card['card_name']}")
-            print(f"   文明: {card['civilization']} | タイプ: {card['card_type']}")
-            print(f"   コスト: {card['cost']} | パワー: {card['power']}")
-            if pd.notna(card['race']) and str(card['race']) != 'nan':
-                print(f"   種族: {card['race']}")
-            if pd.notna(card['text']):
-                text = str(card['text'])[:200] + "..." if len(str(card['text'])) > 200 else str(card['text'])
-                print(f"   効果: {text}")
-            print()
-        
-        if len(ranked_df) > max_display:
-            print(f"... 他 {len(ranked_df) - max_display} 件")
+        with self.metrics.trace(query):
+            # Step 1: 明確な条件を抽出
+            conditions = self.extract_search_conditions(query)
+            
+            with self.pinned_snapshot():
+                # Step 2: 条件でフィルタリング
+                with self.metrics.span("filter") as span:
+                    filtered_df, hit = self.filter_cached(conditions or {})
+                    span.set(candidates=len(filtered_df), cache=hit)
+                
+                if len(filtered_df) == 0:
+                    print("❌ 条件に合うカードが見つかりませんでした")
+                    return None
+                
+                # Step 3: ベクトル検索でランキング（完全一致ボーナス付き）
+                with self.metrics.span("rank") as span:
+                    ranked_df, hit = self.rank_cached(filtered_df, query, conditions or {}, top_k=50)
+                    span.set(candidates=len(ranked_df), cache=hit)
+            
+            # Step 4: 結果表示
+            with self.metrics.span("render", candidates=min(max_display, len(ranked_df))):
+                print(f"\n{'='*60}")
+                print(f"検索結果: {len(ranked_df)}件")
+                print(f"{'='*60}\n")
+                
+                for i, (idx, card) in enumerate(ranked_df.head(max_display).iterrows(), 1):
+                    print(f"【{i}】{card['card_name']}")
+                    print(f"   文明: {card['civilization']} | タイプ: {card['card_type']}")
+                    print(f"   コスト: {card['cost']} | パワー: {card['power']}")
+                    if pd.notna(card['race']) and str(card['race']) != 'nan':
+                        print(f"   種族: {card['race']}")
+                    if pd.notna(card['text']):
+                        text = str(card['text'])[:200] + "..." if len(str(card['text'])) > 200 else str(card['text'])
+                        print(f"   効果: {text}")
+                    print()
+                
+                if len(ranked_df) > max_display:
+                    print(f"... 他 {len(ranked_df) - max_display} 件")
         
         return ranked_df
 
+def result_to_json(result):
+    """search_many の結果1件を JSONL 用の dict にする"""
+    cards = []
+    if result["cards"] is not None:
+        has_score = 'score' in result["cards"].columns
+        for idx, card in result["cards"].iterrows():
+            cards.append({
+                "card_idx": int(idx),
+                "card_name": card['card_name'],
+                "score": round(float(card['score']), 4) if has_score else None,
+            })
+    return {
+        "query": result["query"],
+        "cards": cards,
+        "error": result["error"],
+        "timings_ms": {stage: round(ms, 2) for stage, ms in result["timings"].items()},
+    }
+
+
+def run_batch(path, top_k=50, max_workers=EXTRACT_WORKERS):
+    """クエリを1行1件で読み込み、結果を JSONL で標準出力に流す（path が - なら標準入力）"""
+    source = sys.stdin if path == "-" else open(path, "r", encoding="utf-8")
+    with source:
+        queries = [line.strip() for line in source if line.strip()]
+    
+    out = sys.stdout
+    # 途中経過の表示は JSONL と混ざらないよう標準エラーへ
+    with redirect_stdout(sys.stderr):
+        searcher = DuelMastersHybridSearch()
+        start = time.perf_counter()
+        for i, result in searcher.iter_search_many(queries, top_k=top_k, max_workers=max_workers):
+            out.write(json.dumps({"line": i + 1, **result_to_json(result)}, ensure_ascii=False) + "\n")
+            out.flush()
+        print(f"✅ {len(queries)}件を {time.perf_counter() - start:.1f}秒で検索しました")
+
+
 def main():
+    parser = argparse.ArgumentParser(description="デュエル・マスターズ カード検索")
+    parser.add_argument("--batch", metavar="FILE",
+                        help="クエリを1行1件で読み込み、結果を JSONL で出力する（- で標準入力）")
+    parser.add_argument("--top-k", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=EXTRACT_WORKERS, help="条件抽出の並列数")
+    args = parser.parse_args()
+    
+    if args.batch:
+        run_batch(args.batch, top_k=args.top_k, max_workers=args.workers)
+        return
+    
     searcher = DuelMastersHybridSearch()
     
     print("\n" + "="*60)
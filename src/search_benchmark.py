@@ -0,0 +1,264 @@
+import argparse
+import contextlib
+import io
+import json
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from card_store import CSV_FIELDS
+from fake_ollama import FakeOllama, fake_vector
+from result_cache import ResultCache
+
+SRC_DIR = Path(__file__).parent
+DATA_FILES = ["keywords.txt", "tags.txt", "duelmasters_glossary.json"]  # 合成コーパスにもそのまま使う
+ADD_BATCH = 5000  # Chroma への一括追加件数
+
+# 合成カードの材料
+NAME_HEADS = ["ボルシャック", "ジャバジャック", "ドギラゴン", "ヘブンズ", "ガイアール", "ジョリー", "バロム",
+              "アクア", "デュアル", "ミラクル", "ザ・ジョニー", "ゼロ", "ギャラクシー", "シャングリラ", "モモキング"]
+NAME_TAILS = ["ドラゴン", "カイザー", "ロード", "ナイト", "ショック", "リターン", "ガード", "スパーク",
+              "バスター", "ストーム", "ゲート", "マスター", "ファイター", "X", "NEX"]
+CIVS = ["火", "水", "自然", "光", "闇", "火/水", "光/闇", "水/自然", "火/自然", "光/水/自然"]
+RACES = ["アーマード・ドラゴン", "メガ・コマンド・ドラゴン", "サイバー・ロード", "グランド・デビル",
+         "ビートジョッキー", "マジック", "ジョーカーズ", "メタリカ", "ジャイアント", "ビーストフォーク",
+         "エンジェル・コマンド", "デーモン・コマンド", "リキッド・ピープル", "ガーディアン", "ハンター"]
+EFFECTS = [
+    "このクリーチャーが出た時、カードを1枚引く。",
+    "このクリーチャーが出た時、自分の山札の上から1枚目をマナゾーンに置く。",
+    "相手のクリーチャーを1体選び、持ち主の手札に戻す。",
+    "相手のパワー{p}以下のクリーチャーを1体破壊する。",
+    "相手の手札を見ないで1枚選び、捨てさせる。",
+    "自分の墓地からクリーチャーを1体、手札に戻す。",
+    "このクリーチャーは、相手プレイヤーを攻撃できない。",
+    "相手のシールドを1つ選び、持ち主の手札に加える。",
+    "このターン、自分のクリーチャー全体のパワーを+{p}する。",
+    "このクリーチャーが攻撃する時、相手のクリーチャーを1体選び、タップする。",
+    "自分の山札を見る。その中からカードを1枚選び、相手に見せてから手札に加える。その後、山札をシャッフルする。",
+]
+
+
+# =========================
+# 合成コーパス
+# =========================
+def generate_corpus(n, seed=0, keywords=()):
+    """それらしいカード名・文明・種族・コスト・効果テキストを持つカードを n 枚作る"""
+    rnd = random.Random(seed)
+    keywords = [kw for kw in keywords if len(kw) > 1]
+    rows = []
+    for i in range(n):
+        card_type = rnd.choices(["クリーチャー", "呪文", "タマシード"], weights=[6, 3, 1])[0]
+        civilization = rnd.choice(CIVS)
+        lines = []
+        for keyword in rnd.sample(keywords, k=rnd.randint(0, 2)) if keywords else []:
+            lines.append(f"■{keyword}")
+        for effect in rnd.sample(EFFECTS, k=rnd.randint(1, 3)):
+            lines.append("■" + effect.format(p=rnd.choice([2000, 3000, 5000, 6000])))
+        is_creature = card_type == "クリーチャー"
+        rows.append({
+            "card_name": f"{rnd.choice(NAME_HEADS)}・{rnd.choice(NAME_TAILS)}{i}",
+            "civilization": civilization,
+            "color_type": "多色" if "/" in civilization else "単色",
+            "card_type": card_type,
+            "cost": rnd.randint(1, 12),
+            "power": rnd.randint(1, 25) * 1000 if is_creature else None,
+            "race": "/".join(rnd.sample(RACES, k=rnd.randint(1, 2))) if is_creature else None,
+            "text": "\n".join(lines),
+            "tags": None,
+        })
+    return pd.DataFrame(rows, columns=CSV_FIELDS)
+
+
+def prepare_workspace(base_dir):
+    data_dir = Path(base_dir) / "data"
+    data_dir.mkdir(parents=True, exist_ok=True)
+    for name in DATA_FILES:
+        if (SRC_DIR / "data" / name).exists():
+            shutil.copy(SRC_DIR / "data" / name, data_dir / name)
+    return data_dir
+
+
+def build_index(base_dir, cards_df):
+    """埋め込みを一括で計算してインデックスを作る（大規模コーパス用。1枚ずつの Ollama 呼び出しは省略）"""
+    from prepare_database import COLLECTION_PREFIX, DuelMastersDataProcessor
+
+    processor = DuelMastersDataProcessor(base_dir=base_dir)
+    processor.cards_df = cards_df
+    version = time.strftime("%Y%m%d%H%M%S")
+    processor.collection_name = COLLECTION_PREFIX + version
+    collection = processor.chroma_client.create_collection(name=processor.collection_name)
+    for start in range(0, len(cards_df), ADD_BATCH):
+        batch = cards_df.iloc[start:start + ADD_BATCH]
+        texts = [processor.create_search_text(row) for _, row in batch.iterrows()]
+        collection.add(
+            ids=[f"card_{idx}" for idx in batch.index],
+            documents=texts,
+            embeddings=[fake_vector(text) for text in texts],
+        )
+    processor.publish_version(version)
+
+
+# =========================
+# 計測
+# =========================
+BENCH_QUERIES = [
+    "5コスト以上の革命チェンジ先のドラゴン",
+    "火文明のスピードアタッカーで3コスト以下のクリーチャー",
+    "自然のマッハファイター",
+    "軽量のバウンス呪文",
+    "S・トリガー付きの光の呪文",
+]
+
+
+def timed(func, *args, repeat=1, **kwargs):
+    """(最後の戻り値, 各回の秒数のリスト)"""
+    times = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        times.append(time.perf_counter() - start)
+    return result, times
+
+
+def stats(times):
+    ordered = sorted(times)
+    return {
+        "n": len(ordered),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 3),
+        "p50_ms": round(ordered[len(ordered) // 2] * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+
+
+def bench_size(n, args, keywords):
+    base_dir = Path(tempfile.mkdtemp(prefix=f"dm_bench_{n}_", dir=args.workdir))
+    result = {"cards": n}
+    try:
+        prepare_workspace(base_dir)
+        cards_df = generate_corpus(n, seed=args.seed, keywords=keywords)
+        cards_df.to_csv(base_dir / "data" / "cards.csv", index=False, encoding="utf-8-sig")
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            _, times = timed(build_index, base_dir, cards_df)
+        result["index_build_sec"] = round(times[0], 3)
+
+        from search import DuelMastersHybridSearch
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            searcher, times = timed(DuelMastersHybridSearch, base_dir=base_dir)
+            result["startup_sec"] = round(times[0], 3)
+
+            result["filter"], result["rank"], result["search"], result["search_cached"] = {}, {}, {}, {}
+            for query in BENCH_QUERIES:
+                conditions = searcher.extract_search_conditions(query)
+                filtered_df, times = timed(searcher.filter_by_conditions, conditions, repeat=args.repeat)
+                result["filter"][query] = {**stats(times), "candidates": len(filtered_df)}
+                _, times = timed(searcher.rank_by_vector_search, filtered_df, query, conditions, repeat=args.repeat)
+                result["rank"][query] = stats(times)
+                # 結果キャッシュなしの計測（以前の結果と比べられるように）と、キャッシュありの計測
+                searcher.result_cache = ResultCache(filter_size=0, rank_size=0)
+                _, times = timed(searcher.find_cards, query, repeat=args.repeat)
+                result["search"][query] = stats(times)
+                searcher.result_cache = ResultCache()
+                _, times = timed(searcher.find_cards, query, repeat=args.repeat + 1)
+                result["search_cached"][query] = stats(times[1:])
+            result["stages"] = searcher.metrics.snapshot()
+        del searcher
+    finally:
+        if not args.keep:
+            shutil.rmtree(base_dir, ignore_errors=True)
+    return result
+
+
+def bench_store(args):
+    """prepare_database.process_and_store の処理速度（1枚ずつ埋め込み + Chroma 保存）"""
+    from prepare_database import DuelMastersDataProcessor
+
+    base_dir = Path(tempfile.mkdtemp(prefix="dm_bench_store_", dir=args.workdir))
+    try:
+        prepare_workspace(base_dir)
+        processor = DuelMastersDataProcessor(base_dir=base_dir)
+        processor.cards_df = generate_corpus(args.store_cards, seed=args.seed)
+        with contextlib.redirect_stdout(io.StringIO()):
+            _, times = timed(processor.process_and_store, batch_size=50)
+        return {
+            "cards": args.store_cards,
+            "sec": round(times[0], 3),
+            "cards_per_sec": round(args.store_cards / times[0], 1),
+        }
+    finally:
+        if not args.keep:
+            shutil.rmtree(base_dir, ignore_errors=True)
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=SRC_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="検索パイプラインのベンチマーク（合成コーパス + Ollama の代役）")
+    parser.add_argument("--sizes", type=int, nargs="*", default=[10_000, 50_000],
+                        help="合成コーパスの枚数（例: --sizes 10000 100000 500000）")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--chat-latency", type=float, default=0.0, help="chat 1回あたりの擬似レイテンシ（秒）")
+    parser.add_argument("--embed-latency", type=float, default=0.0, help="埋め込み1回あたりの擬似レイテンシ（秒）")
+    parser.add_argument("--store-cards", type=int, default=500, help="process_and_store を計測する枚数（0で省略）")
+    parser.add_argument("--workdir", default=None, help="作業ディレクトリの置き場所（省略時は一時ディレクトリ）")
+    parser.add_argument("--keep", action="store_true", help="作業ディレクトリを削除しない")
+    parser.add_argument("--output", default="search_benchmark.json", help="結果のJSONの出力先")
+    args = parser.parse_args()
+
+    with open(SRC_DIR / "data" / "keywords.txt", encoding="utf-8") as f:
+        keywords = [line.strip() for line in f if line.strip()]
+    fake = FakeOllama(chat_latency=args.chat_latency, embed_latency=args.embed_latency,
+                      keywords=keywords, races=RACES + ["ドラゴン", "コマンド"]).install()
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "started_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "args": vars(args),
+        },
+        "sizes": [],
+    }
+
+    for n in args.sizes:
+        print(f"[{n}枚] 計測中...")
+        result = bench_size(n, args, keywords)
+        report["sizes"].append(result)
+        search_p50 = statistics.median(s["p50_ms"] for s in result["search"].values())
+        filter_p50 = statistics.median(s["p50_ms"] for s in result["filter"].values())
+        cached_p50 = statistics.median(s["p50_ms"] for s in result["search_cached"].values())
+        print(f"[{n}枚] 起動 {result['startup_sec']:.2f}秒 | フィルタ p50 {filter_p50:.1f}ms | "
+              f"検索 p50 {search_p50:.1f}ms（キャッシュあり {cached_p50:.1f}ms）")
+
+    if args.store_cards:
+        report["process_and_store"] = bench_store(args)
+        print(f"[保存] {report['process_and_store']['cards_per_sec']:.1f}枚/秒")
+
+    report["fake_ollama_calls"] = fake.calls
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"✅ 結果を {args.output} に保存しました")
+
+
+if __name__ == "__main__":
+    main()
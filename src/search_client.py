@@ -0,0 +1,146 @@
+import json
+import os
+import urllib.request
+
+DEFAULT_URL = os.getenv("SEARCH_SERVER_URL", "http://127.0.0.1:8765")
+TIMEOUT_SEC = 120  # LLMの条件抽出を含むため長め
+
+
+# =========================
+# 検索サーバーのクライアント
+# =========================
+class SearchClient:
+    """search_server.py に接続する軽量クライアント（インデックスやモデルを持たない）"""
+
+    def __init__(self, base_url=DEFAULT_URL, timeout=TIMEOUT_SEC):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+    def _call(self, path, payload=None):
+        data = None
+        if payload is not None:
+            data = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        request = urllib.request.Request(
+            self.base_url + path,
+            data=data,
+            headers={"Content-Type": "application/json"},
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as res:
+            return json.loads(res.read())
+
+    def health(self):
+        return self._call("/health")
+
+    @property
+    def index_version(self):
+        return self.health()["index_version"]
+
+    def extract_search_conditions(self, query):
+        return self._call("/extract_conditions", {"query": query})["conditions"]
+
+    def rank(self, query, conditions=None, top_k=50):
+        """カードのレコード（dict）のリストを返す"""
+        return self._call("/rank", {"query": query, "conditions": conditions, "top_k": top_k})["cards"]
+
+    def complete(self, text, limit=25, kinds=None):
+        return self._call("/complete", {"text": text, "limit": limit, "kinds": kinds})["entries"]
+
+    def lookup_card(self, name, max_distance=2):
+        """(カードのレコード または None, 候補名のリスト) を返す"""
+        result = self._call("/card", {"name": name, "max_distance": max_distance})
+        return result["card"], result["candidates"]
+
+    def metrics_snapshot(self):
+        """(区間ごとの集計, Prometheus 形式のテキスト) を返す"""
+        result = self._call("/metrics")
+        return result["spans"], result["prometheus"]
+
+    def profile(self, query, cpu=True, memory=True):
+        """検索1件を計測付きで実行し、トレース（dict）を返す"""
+        return self._call("/profile", {"query": query, "cpu": cpu, "memory": memory})["trace"]
+
+    def similar_cards(self, card_idx, limit=10, civilizations=None, cost_min=None, cost_max=None):
+        """DuelMastersHybridSearch.similar_cards と同じ形式（DataFrame, エラー）で返す"""
+        result = self._call("/similar", {
+            "card_idx": card_idx,
+            "limit": limit,
+            "civilizations": civilizations,
+            "cost_min": cost_min,
+            "cost_max": cost_max,
+        })
+        if result["error"]:
+            return None, result["error"]
+        return _to_df(result["cards"]), None
+
+    def search(self, query, top_k=50):
+        """(カードのレコードのリスト, エラーメッセージ) を返す"""
+        result = self._call("/search", {"query": query, "top_k": top_k})
+        return result["cards"], result["error"]
+
+    def iter_search(self, query, top_k=50):
+        """暫定結果・確定結果を届いた順に dict（stage, cards, error, elapsed）で返す"""
+        data = json.dumps({"query": query, "top_k": top_k}, ensure_ascii=False).encode("utf-8")
+        request = urllib.request.Request(
+            self.base_url + "/search_stream",
+            data=data,
+            headers={"Content-Type": "application/json"},
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as res:
+            for line in res:
+                if line.strip():
+                    yield json.loads(line)
+
+    def find_cards(self, query, top_k=50, on_provisional=None):
+        """DuelMastersHybridSearch.find_cards と同じ形式（DataFrame, エラー）で返す"""
+        if on_provisional is None:
+            records, error = self.search(query, top_k=top_k)
+            if error:
+                return None, error
+            return _to_df(records), None
+
+        for update in self.iter_search(query, top_k=top_k):
+            if update["error"]:
+                return None, update["error"]
+            if update["stage"] == "provisional":
+                on_provisional(_to_df(update["cards"]))
+            else:
+                return _to_df(update["cards"]), None
+        return None, "❌ 検索サーバーからの応答が途中で切れました"
+
+
+def _to_df(records):
+    import pandas as pd
+
+    df = pd.DataFrame(records)
+    if len(df):
+        df = df.set_index("card_idx")
+    return df
+
+
+def main():
+    client = SearchClient()
+    print(f"検索サーバー: {client.base_url} ({client.health()['cards']}枚)")
+    print("検索したいカードの条件を入力してください（終了: end）\n")
+
+    while True:
+        query = input("検索> ")
+        if query.lower() in ['end', 'exit']:
+            print("終了します")
+            break
+        if not query.strip():
+            continue
+
+        cards, error = client.search(query)
+        if error:
+            print(error)
+            continue
+        print(f"\n検索結果: {len(cards)}件\n")
+        for i, card in enumerate(cards[:10], 1):
+            print(f"【{i}】{card['card_name']}")
+            print(f"   文明: {card['civilization']} | タイプ: {card['card_type']}")
+            print(f"   コスト: {card['cost']} | パワー: {card['power']}")
+            print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,413 @@
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import math
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+
+import pandas as pd
+
+from card_catalog import resolve_index
+from fake_ollama import FakeOllama, rule_based_conditions
+
+SRC_DIR = Path(__file__).parent
+GOLDEN_QUERIES = SRC_DIR / "data" / "golden_queries.json"
+EVAL_CACHE = SRC_DIR / "data" / "eval_cache.json"  # --record で作る、LLMの出力（とクエリ埋め込み）のキャッシュ
+EVAL_CARDS = SRC_DIR / "data" / "eval_cards.csv"   # 評価用に固定したカードデータ（正解のカード集合はこれに対して決める）
+CORPUS_FILES = ["keywords.txt", "duelmasters_glossary.json", "tags.txt"]  # 評価用インデックスにも使う data/ のファイル
+TOP_K = 50
+FAKE_LLM = "fake_ollama"  # 代役で記録したキャッシュの llm（LLMの出力としては比べられない）
+LLM_CONFIGS = ["baseline"]  # LLMによる条件抽出の良し悪しを見る構成（代役の出力では比較しない）
+
+
+# =========================
+# 正解データ
+# =========================
+def load_golden(path=GOLDEN_QUERIES):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def cards_version(csv_path):
+    """カードデータの版（CSVの内容のハッシュ）。正解のカード集合・キャッシュがどのデータに対するものかを示す"""
+    with open(csv_path, "rb") as f:
+        # 改行コード（チェックアウト時の変換）で版が変わらないようにそろえる
+        return hashlib.sha256(f.read().replace(b"\r\n", b"\n")).hexdigest()[:16]
+
+
+def _contains_any(series, terms):
+    mask = pd.Series(False, index=series.index)
+    for term in terms:
+        mask |= series.fillna("").astype(str).str.contains(term, regex=False)
+    return mask
+
+
+def relevant_ids(cards_df, spec, names=()):
+    """正解条件に合うカードの idx の集合"""
+    mask = pd.Series(True, index=cards_df.index)
+    cost = pd.to_numeric(cards_df["cost"], errors="coerce")
+    if spec.get("cost_min") is not None:
+        mask &= cost >= spec["cost_min"]
+    if spec.get("cost_max") is not None:
+        mask &= cost <= spec["cost_max"]
+    if spec.get("civilizations_any"):
+        mask &= _contains_any(cards_df["civilization"], spec["civilizations_any"])
+    if spec.get("card_types_any"):
+        mask &= _contains_any(cards_df["card_type"], spec["card_types_any"])
+    if spec.get("race_any"):
+        mask &= _contains_any(cards_df["race"], spec["race_any"])
+    for term in spec.get("text_all", []):
+        mask &= _contains_any(cards_df["text"], [term])
+    if spec.get("text_any"):
+        mask &= _contains_any(cards_df["text"], spec["text_any"])
+    if spec.get("text_none"):
+        mask &= ~_contains_any(cards_df["text"], spec["text_none"])
+    ids = set(cards_df.index[mask])
+    if names:
+        ids |= set(cards_df.index[cards_df["card_name"].isin(names)])
+    return ids
+
+
+def expected_ids(cards_df, item):
+    """正解のカード集合（--freeze で固定したカード名）を idx の集合にする。固定されていなければ条件から求める"""
+    if "expected" in item:
+        return set(cards_df.index[cards_df["card_name"].isin(item["expected"])])
+    return relevant_ids(cards_df, item["relevant"], item.get("names", ()))
+
+
+def freeze_expected(golden, cards_df, version):
+    """正解条件をカードデータに当てはめ、カード名の集合として固定する（データが変わっても正解が動かないように）"""
+    for item in golden["queries"]:
+        ids = relevant_ids(cards_df, item["relevant"], item.get("names", ()))
+        item["expected"] = sorted(cards_df.loc[sorted(ids), "card_name"].tolist())
+    golden["cards_version"] = version
+    return golden
+
+
+def write_golden(path, golden):
+    """正解データを書き出す（差分が読みやすいよう、クエリごとの条件と正解は1行にまとめる）"""
+    header = {key: value for key, value in golden.items() if key != "queries"}
+    lines = json.dumps(header, ensure_ascii=False, indent=2)[:-2].splitlines()
+    lines[-1] += ","
+    lines.append('  "queries": [')
+    for i, item in enumerate(golden["queries"]):
+        fields = [f'      {json.dumps(key, ensure_ascii=False)}: {json.dumps(value, ensure_ascii=False)}'
+                  for key, value in item.items()]
+        lines.append("    {\n" + ",\n".join(fields) + "\n    }" + ("," if i < len(golden["queries"]) - 1 else ""))
+    lines += ["  ]", "}"]
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+# =========================
+# 評価指標
+# =========================
+def recall_at(ranked, relevant, k):
+    """上位 k 件に入った正解の割合（正解が k 件より多い場合は k 件取れれば 1.0）"""
+    if not relevant:
+        return None
+    return len(set(ranked[:k]) & relevant) / min(k, len(relevant))
+
+
+def ndcg_at(ranked, relevant, k):
+    """2値の関連度による nDCG@k"""
+    if not relevant:
+        return None
+    dcg = sum(1 / math.log2(i + 2) for i, idx in enumerate(ranked[:k]) if idx in relevant)
+    ideal = sum(1 / math.log2(i + 2) for i in range(min(k, len(relevant))))
+    return dcg / ideal
+
+
+# =========================
+# LLM出力・埋め込みのキャッシュ（オフライン再現用）
+# =========================
+class EvalCache:
+    """record モードでは実際に呼び出して保存し、replay モードでは保存済みの値だけを返す
+
+    LLMの条件抽出は記録時の所要時間（llm_ms）も保存し、再生時にその時間を報告できるようにする"""
+
+    def __init__(self, path=EVAL_CACHE, mode="replay"):
+        self.path = Path(path)
+        self.mode = mode
+        self.data = {"meta": {}, "conditions": {}, "embeddings": {}, "llm_ms": {}}
+        if self.path.exists():
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.data.update(json.load(f))
+
+    @property
+    def synthetic(self):
+        """LLMの出力が代役（fake_ollama）のものか"""
+        return self.data["meta"].get("llm") == FAKE_LLM
+
+    def recorded_ms(self, query):
+        return self.data["llm_ms"].get(query)
+
+    def wrap(self, kind, func):
+        store = self.data[kind]
+
+        def cached(key):
+            if key in store:
+                return store[key]
+            if self.mode != "record":
+                raise KeyError(f"{kind} のキャッシュがありません: {key!r}（--record で作成してください）")
+            store[key] = func(key)
+            return store[key]
+
+        return cached
+
+    def attach(self, searcher):
+        """LLMの呼び出しだけを差し替える（extract の区間は再生時もそのまま計測される）"""
+        llm = searcher.extract_conditions_llm
+
+        def timed_llm(query):
+            start = time.perf_counter()
+            conditions = llm(query)
+            self.data["llm_ms"][query] = round((time.perf_counter() - start) * 1000, 2)
+            return conditions
+
+        cached = self.wrap("conditions", timed_llm)
+
+        def extract_conditions_llm(query, span="extract.llm"):
+            with searcher.metrics.span(span, cache=query in self.data["conditions"]):
+                return cached(query)
+
+        searcher.extract_conditions_llm = extract_conditions_llm
+        # プロセス内で計算する埋め込み（hashed）は決定的なので、Ollama の埋め込みだけを保存する
+        if searcher.embedding_backend == "ollama":
+            searcher.generate_embedding = self.wrap("embeddings", searcher.generate_embedding)
+
+    def save(self, **meta):
+        self.data["meta"].update(meta)
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump(self.data, f, ensure_ascii=False, indent=1)
+            f.write("\n")
+
+
+# =========================
+# 評価用インデックス（固定のカードデータから作る）
+# =========================
+def build_eval_index(work_dir, cards_csv=EVAL_CARDS):
+    """cards_csv と data/ の用語集・キーワードから、プロセス内の埋め込み（hashed）で一時インデックスを作る
+
+    Ollama を使わないので、同じカードデータからは常に同じインデックスができる"""
+    from prepare_database import DuelMastersDataProcessor
+
+    data_dir = Path(work_dir) / "data"
+    data_dir.mkdir(parents=True, exist_ok=True)
+    shutil.copyfile(cards_csv, data_dir / "cards.csv")
+    for name in CORPUS_FILES:
+        if (SRC_DIR / "data" / name).exists():
+            shutil.copyfile(SRC_DIR / "data" / name, data_dir / name)
+    with contextlib.redirect_stdout(io.StringIO()):
+        processor = DuelMastersDataProcessor(base_dir=work_dir, embedding_backend="hashed")
+        processor.load_data()
+        processor.process_and_store(batch_size=100)
+
+
+# =========================
+# 評価する構成
+# =========================
+def run_baseline(searcher, query):
+    """LLMで条件抽出 → フィルタ → ベクトル検索（本番と同じ）"""
+    ranked_df, _ = searcher.find_cards(query, top_k=TOP_K)
+    return ranked_df
+
+
+def run_lexical(searcher, query):
+    """ベクトル検索を使わず、暫定ランキング（完全一致ボーナス + 文字バイグラム）だけで並べる"""
+    conditions = searcher.extract_search_conditions(query)
+    if not conditions:
+        return None
+    with searcher.metrics.span("filter"):
+        filtered_df = searcher.filter_by_conditions(conditions)
+    with searcher.metrics.span("lexical"):
+        return searcher.rank_by_lexical(filtered_df, query, conditions, top_k=TOP_K)
+
+
+def run_rule_based(searcher, query):
+    """LLMの代わりにルールベースで条件を作り、以降は本番と同じ"""
+    with searcher.metrics.span("extract.rules"):
+        races = sorted({race for field in searcher.cards_df["race"].dropna() for race in str(field).split("/")})
+        conditions = rule_based_conditions(query, searcher.official_keywords, races)
+    with searcher.metrics.span("filter"):
+        filtered_df = searcher.filter_by_conditions(conditions)
+    if len(filtered_df) == 0:
+        return None
+    return searcher.rank_by_vector_search(filtered_df, query, conditions, top_k=TOP_K)
+
+
+CONFIGS = {
+    "baseline": run_baseline,
+    "lexical": run_lexical,
+    "rule_based": run_rule_based,
+}
+
+
+def evaluate(searcher, config, golden, cache=None):
+    run = CONFIGS[config]
+    per_query = []
+    # 前の構成で抽出した条件を使い回さないよう、構成ごとに条件のキャッシュを空にする
+    searcher.condition_cache.clear()
+    for item in golden:
+        relevant = expected_ids(searcher.cards_df, item)
+        with contextlib.redirect_stdout(io.StringIO()):
+            with searcher.metrics.trace(item["query"]) as trace:
+                try:
+                    ranked_df = run(searcher, item["query"])
+                    error = None
+                except KeyError as e:
+                    ranked_df, error = None, str(e)
+        ranked = [int(idx) for idx in ranked_df.index] if ranked_df is not None else []
+        stages = defaultdict(float)
+        for span in trace.spans:
+            stages[span.name] += span.seconds * 1000
+        per_query.append({
+            "query": item["query"],
+            "relevant": len(relevant),
+            "returned": len(ranked),
+            "recall@5": recall_at(ranked, relevant, 5),
+            "recall@50": recall_at(ranked, relevant, 50),
+            "ndcg@50": ndcg_at(ranked, relevant, 50),
+            "total_ms": round(trace.seconds * 1000, 2),
+            "stages_ms": {name: round(ms, 2) for name, ms in stages.items()},
+            # キャッシュから再生した場合の、記録時のLLMの所要時間（extract.llm の実際のコスト）
+            "llm_recorded_ms": cache.recorded_ms(item["query"]) if cache is not None and "extract.llm" in stages else None,
+            "error": error,
+        })
+
+    def mean(key):
+        values = [q[key] for q in per_query if q[key] is not None]
+        return round(statistics.fmean(values), 4) if values else None
+
+    stage_names = sorted({name for q in per_query for name in q["stages_ms"]})
+    return {
+        "recall@5": mean("recall@5"),
+        "recall@50": mean("recall@50"),
+        "ndcg@50": mean("ndcg@50"),
+        "mean_ms": mean("total_ms"),
+        "llm_recorded_ms": mean("llm_recorded_ms"),
+        "stages_ms": {
+            name: round(statistics.fmean(q["stages_ms"].get(name, 0.0) for q in per_query), 2)
+            for name in stage_names
+        },
+        "errors": sum(1 for q in per_query if q["error"]),
+        "queries": per_query,
+    }
+
+
+def print_table(results):
+    print(f"\n{'構成':<12}{'recall@5':>10}{'recall@50':>11}{'nDCG@50':>10}{'平均ms':>10}{'エラー':>6}")
+    for config, r in results.items():
+        cells = [f"{r[key]:.3f}" if r[key] is not None else "-" for key in ("recall@5", "recall@50", "ndcg@50")]
+        print(f"{config:<12}{cells[0]:>10}{cells[1]:>11}{cells[2]:>10}{r['mean_ms'] or 0:>10.1f}{r['errors']:>6}")
+    print("\n区間ごとの平均（ms）")
+    for config, r in results.items():
+        line = f"  {config}: " + ", ".join(f"{name} {ms:.1f}" for name, ms in r["stages_ms"].items())
+        if r["llm_recorded_ms"] is not None:
+            line += f"（LLMの記録時の所要時間 {r['llm_recorded_ms']:.1f}）"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="正解付きクエリで検索の精度と速度を構成ごとに比較する")
+    parser.add_argument("--configs", nargs="*", default=list(CONFIGS), choices=list(CONFIGS))
+    parser.add_argument("--golden", default=str(GOLDEN_QUERIES))
+    parser.add_argument("--cache", default=str(EVAL_CACHE), help="LLM出力・埋め込みのキャッシュ")
+    parser.add_argument("--record", action="store_true", help="Ollama（--fake なら代役）を呼び出してキャッシュを作成・追記する")
+    parser.add_argument("--fake", action="store_true",
+                        help="Ollama の代役（fake_ollama）を使う。--record なしならキャッシュは使わない")
+    parser.add_argument("--cards", default=str(EVAL_CARDS),
+                        help="評価用のカードデータ。一時インデックスを作って評価する（既定: 固定の data/eval_cards.csv）")
+    parser.add_argument("--base-dir", default=None,
+                        help="既存のインデックス（data/ と chroma_db/）で評価する。--cards より優先")
+    parser.add_argument("--freeze", action="store_true",
+                        help="正解条件をカードデータに当てはめ、正解のカード集合とデータの版を --golden に書き込む")
+    parser.add_argument("--output", default=None, help="結果のJSONの出力先")
+    args = parser.parse_args()
+
+    golden = load_golden(args.golden)
+    if args.base_dir is not None:
+        _, csv_path = resolve_index(args.base_dir)
+    else:
+        csv_path = Path(args.cards)
+    if not Path(csv_path).exists():
+        print(f"❌ カードデータがありません: {csv_path}", file=sys.stderr)
+        print("   固定の評価データ（--cards data/eval_cards.csv）を使うか、"
+              "スクレイパーと prepare_database.py で cards.csv を作ってください", file=sys.stderr)
+        sys.exit(1)
+    version = cards_version(csv_path)
+
+    if args.freeze:
+        cards_df = pd.read_csv(csv_path, encoding="utf-8-sig")
+        write_golden(args.golden, freeze_expected(golden, cards_df, version))
+        print(f"✅ 正解のカード集合を固定しました（カードデータの版: {version}） → {args.golden}")
+        return
+
+    if golden.get("cards_version") and golden["cards_version"] != version:
+        print(f"⚠️  正解はカードデータ {golden['cards_version']} に対して固定されています（評価するデータ: {version}）。"
+              "存在しないカードは正解から外れます")
+
+    from search import DuelMastersHybridSearch
+
+    with tempfile.TemporaryDirectory(prefix="search_eval_") as work_dir:
+        if args.base_dir is not None:
+            base_dir, embedding_backend = args.base_dir, None
+        else:
+            build_eval_index(work_dir, csv_path)
+            base_dir, embedding_backend = work_dir, "hashed"
+        with contextlib.redirect_stdout(io.StringIO()):
+            searcher = DuelMastersHybridSearch(base_dir=base_dir, embedding_backend=embedding_backend)
+
+        cache = None
+        if args.fake:
+            FakeOllama(keywords=searcher.official_keywords).install()
+        if not args.fake or args.record:
+            cache = EvalCache(args.cache, mode="record" if args.record else "replay")
+            cache.attach(searcher)
+
+        # 代役のLLMの出力は本物の抽出結果ではないので、LLMによる条件抽出の比較はしない
+        synthetic = args.fake or (cache is not None and cache.synthetic)
+        configs = args.configs
+        if synthetic:
+            configs = [config for config in configs if config not in LLM_CONFIGS]
+            print(f"⚠️  LLMの出力は代役（{FAKE_LLM}）のもので、結果は合成データです。"
+                  f"LLMによる条件抽出の比較（{', '.join(LLM_CONFIGS)}）は行いません")
+
+        queries = golden["queries"]
+        print(f"正解付きクエリ: {len(queries)}件 / カード: {len(searcher.cards_df)}枚 "
+              f"/ カードデータ: {version} / インデックス: {searcher.index_version}")
+        results = {}
+        for config in configs:
+            results[config] = evaluate(searcher, config, queries, cache)
+        print_table(results)
+        index_version = searcher.index_version
+        card_count = len(searcher.cards_df)
+
+    if cache is not None and args.record:
+        cache.save(llm=FAKE_LLM if args.fake else "llama3.1:8b", cards_version=version,
+                   recorded_at=time.strftime("%Y-%m-%d %H:%M:%S"))
+        print(f"\n✅ キャッシュを {args.cache} に保存しました")
+    if args.output:
+        report = {
+            "cards_version": version,
+            "index_version": index_version,
+            "cards": card_count,
+            "llm": FAKE_LLM if synthetic else (cache.data["meta"].get("llm") if cache is not None else None),
+            "synthetic": synthetic,
+            "evaluated_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "results": results,
+        }
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"✅ 結果を {args.output} に保存しました")
+
+
+if __name__ == "__main__":
+    main()
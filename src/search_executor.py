@@ -0,0 +1,108 @@
+import asyncio
+import re
+import unicodedata
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+# =========================
+# 設定
+# =========================
+MAX_WORKERS = 2       # 同時に実行する検索の数（LLM・埋め込みはOllama側で直列化されるため少なめ）
+MAX_QUEUE = 10        # 実行待ちにできる検索の数。これを超えたら「混雑中」で断る
+PER_USER_LIMIT = 1    # 1ユーザーが同時に実行できる検索の数
+
+
+def normalize_query(query):
+    """同一クエリ判定用の正規化（全角半角・空白の揺れを吸収）"""
+    query = unicodedata.normalize("NFKC", query)
+    return re.sub(r"\s+", " ", query).strip().lower()
+
+
+class SearchRejected(Exception):
+    """受け付けられなかった検索（混雑・ユーザーごとの上限超過）"""
+
+    def __init__(self, reason, message):
+        super().__init__(message)
+        self.reason = reason
+        self.message = message
+
+
+class SearchTicket:
+    """受け付けた検索。wait() で結果を待つ"""
+
+    def __init__(self, future, queued, collapsed):
+        self.future = future
+        self.queued = queued          # 受付時点で自分より前に待っている件数（0なら即実行）
+        self.collapsed = collapsed    # 実行中の同一クエリに相乗りしたか
+
+    async def wait(self):
+        # 呼び出し側がキャンセルされても、相乗りしている他の検索は止めない
+        return await asyncio.shield(self.future)
+
+
+# =========================
+# 検索実行キュー
+# =========================
+class SearchExecutor:
+    """ブロッキングな検索処理をスレッドプールで実行し、イベントループを止めないようにする。
+
+    - 実行数 + 待ち数が上限を超えたら SearchRejected("busy")
+    - 1ユーザーの同時実行数が上限を超えたら SearchRejected("user")
+    - 同じクエリが実行中なら新たに実行せず結果を共有する（singleflight）
+    """
+
+    def __init__(self, max_workers=MAX_WORKERS, max_queue=MAX_QUEUE, per_user_limit=PER_USER_LIMIT):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.per_user_limit = per_user_limit
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="search")
+        self.active = 0                      # 実行中 + 待機中の検索数（相乗りは含まない）
+        self.user_inflight = defaultdict(int)
+        self.inflight = {}                   # クエリキー -> asyncio.Future
+        self.stats = Counter()
+
+    @property
+    def queue_depth(self):
+        return max(0, self.active - self.max_workers)
+
+    def submit(self, user_id, key, func, *args):
+        """検索を受け付けて SearchTicket を返す（イベントループ上から呼ぶこと）"""
+        if self.user_inflight.get(user_id, 0) >= self.per_user_limit:
+            self.stats["rejected_user"] += 1
+            raise SearchRejected("user", "⏳ 前の検索を処理中です。結果が出てからもう一度お試しください")
+
+        future = self.inflight.get(key)
+        collapsed = future is not None
+        if collapsed:
+            self.stats["collapsed"] += 1
+            queued = 0
+        else:
+            if self.active >= self.max_workers + self.max_queue:
+                self.stats["rejected_busy"] += 1
+                raise SearchRejected(
+                    "busy", f"🙇 現在検索が混み合っています（待ち {self.queue_depth}件）。少し時間をおいてお試しください"
+                )
+            queued = max(0, self.active + 1 - self.max_workers)
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self.pool, func, *args)
+            self.inflight[key] = future
+            self.active += 1
+            self.stats["executed"] += 1
+            future.add_done_callback(lambda f: self._finish(key, f))
+
+        self.user_inflight[user_id] += 1
+        future.add_done_callback(lambda f: self._release_user(user_id))
+        return SearchTicket(future, queued, collapsed)
+
+    def _finish(self, key, future):
+        self.active -= 1
+        if self.inflight.get(key) is future:
+            del self.inflight[key]
+
+    def _release_user(self, user_id):
+        self.user_inflight[user_id] -= 1
+        if self.user_inflight[user_id] <= 0:
+            del self.user_inflight[user_id]
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
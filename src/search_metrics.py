@@ -0,0 +1,215 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+
+from latency_stats import LATENCY_WINDOW, latency_windows, quantiles
+
+# =========================
+# 設定
+# =========================
+TRACE_LOG = os.getenv("SEARCH_TRACE_LOG")  # 設定されていれば検索ごとのトレースを JSONL で追記する
+PROFILE_TOP = 25       # cProfile の結果として残す関数の数
+METRIC_PREFIX = "dm_search"
+
+
+def summary_lines(spans):
+    """snapshot() の結果を人が読む用の一覧（ミリ秒）にする"""
+    lines = []
+    for name, stats in sorted(spans.items()):
+        line = (f"{name}: n={stats['count']} p50={stats['p50'] * 1000:.0f}ms "
+                f"p95={stats['p95'] * 1000:.0f}ms p99={stats['p99'] * 1000:.0f}ms")
+        if "cache_hit" in stats:
+            line += f" hit={stats['cache_hit']}/{stats['cache_hit'] + stats['cache_miss']}"
+        lines.append(line)
+    return lines
+
+
+class Span:
+    """計測区間。with ブロック内で set() により件数やキャッシュの当否を付け加える"""
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+        self.seconds = None
+
+    def set(self, **fields):
+        self.fields.update(fields)
+
+    def to_dict(self):
+        return {"name": self.name, "ms": round(self.seconds * 1000, 2), **self.fields}
+
+
+class Trace:
+    """1回の検索リクエスト分の区間の記録"""
+
+    def __init__(self, query):
+        self.query = query
+        self.started = time.time()
+        self.spans = []
+        self.seconds = None
+        self.profile = None    # cProfile の上位関数（テキスト）
+        self.peak_kb = None    # tracemalloc で計測したメモリ使用量のピーク
+
+    def to_dict(self):
+        record = {
+            "ts": round(self.started, 3),
+            "query": self.query,
+            "total_ms": round(self.seconds * 1000, 2),
+            "spans": [span.to_dict() for span in self.spans],
+        }
+        if self.peak_kb is not None:
+            record["peak_kb"] = self.peak_kb
+        if self.profile is not None:
+            record["profile"] = self.profile
+        return record
+
+
+# =========================
+# 検索パイプラインの計測
+# =========================
+class SearchMetrics:
+    """区間（抽出・各フィルタ・埋め込み・ベクトル取得・ボーナス計算・整形）ごとの処理時間を集計する
+
+    - 区間ごとに直近 LATENCY_WINDOW 件の処理時間を保持し、p50/p95/p99 を出す
+    - cache=True/False を付けた区間はキャッシュのヒット・ミスとして数える
+    - log_path を指定すると検索1回ごとのトレースを JSONL に追記する"""
+
+    def __init__(self, log_path=TRACE_LOG, window=LATENCY_WINDOW):
+        self.latencies = latency_windows(window)
+        self.totals = defaultdict(lambda: [0, 0.0])   # 区間 -> [回数, 合計秒]（起動からの累計）
+        self.cache = defaultdict(lambda: [0, 0])      # 区間 -> [ヒット, ミス]
+        self.last_trace = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._profile_next = None
+        self._log = open(log_path, "a", encoding="utf-8") if log_path else None
+
+    def observe(self, name, seconds):
+        with self._lock:
+            self.latencies[name].append(seconds)
+            total = self.totals[name]
+            total[0] += 1
+            total[1] += seconds
+
+    @contextmanager
+    def span(self, name, **fields):
+        """区間を計測する。実行中のトレースがあればそこにも記録する"""
+        span = Span(name, fields)
+        start = time.perf_counter()
+        try:
+            yield span
+        finally:
+            span.seconds = time.perf_counter() - start
+            self.observe(name, span.seconds)
+            if "cache" in span.fields:
+                with self._lock:
+                    self.cache[name][0 if span.fields["cache"] else 1] += 1
+            trace = getattr(self._local, "trace", None)
+            if trace is not None:
+                trace.spans.append(span)
+
+    def profile_next(self, cpu=True, memory=True):
+        """次の1リクエストだけ cProfile / tracemalloc を有効にする"""
+        self._profile_next = {"cpu": cpu, "memory": memory}
+
+    @contextmanager
+    def trace(self, query, cpu=False, memory=False):
+        """1リクエスト分のトレース。同じスレッド内の span() がここにまとまる
+
+        cpu=True で cProfile、memory=True で tracemalloc を、このリクエストの間だけ有効にする"""
+        if getattr(self._local, "trace", None) is not None:
+            # 入れ子の場合は外側のトレースに記録する
+            yield self._local.trace
+            return
+
+        trace = Trace(query)
+        armed, self._profile_next = self._profile_next, None
+        if armed:
+            cpu = cpu or armed["cpu"]
+            memory = memory or armed["memory"]
+        profiler = cProfile.Profile() if cpu else None
+        trace_memory = memory and not tracemalloc.is_tracing()
+        if trace_memory:
+            tracemalloc.start()
+        if profiler is not None:
+            profiler.enable()
+
+        self._local.trace = trace
+        start = time.perf_counter()
+        try:
+            yield trace
+        finally:
+            trace.seconds = time.perf_counter() - start
+            self._local.trace = None
+            if profiler is not None:
+                profiler.disable()
+                out = io.StringIO()
+                pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(PROFILE_TOP)
+                trace.profile = out.getvalue()
+            if trace_memory:
+                trace.peak_kb = round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+                tracemalloc.stop()
+            self.observe("request", trace.seconds)
+            self.last_trace = trace
+            self._write(trace.to_dict())
+
+    def _write(self, record):
+        if self._log is None:
+            return
+        with self._lock:
+            self._log.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._log.flush()
+
+    def snapshot(self):
+        with self._lock:
+            latencies = {name: list(values) for name, values in self.latencies.items()}
+            totals = {name: tuple(total) for name, total in self.totals.items()}
+            cache = {name: tuple(counts) for name, counts in self.cache.items()}
+        spans = {}
+        for name, values in latencies.items():
+            spans[name] = {
+                "count": totals[name][0],
+                "sum_sec": round(totals[name][1], 4),
+                **quantiles(values, (50, 95, 99)),
+            }
+            if name in cache:
+                spans[name]["cache_hit"], spans[name]["cache_miss"] = cache[name]
+        return spans
+
+    def summary_lines(self):
+        return summary_lines(self.snapshot())
+
+    def prometheus(self):
+        """Prometheus のテキスト形式（summary）で書き出す"""
+        snap = self.snapshot()
+        lines = [f"# TYPE {METRIC_PREFIX}_span_seconds summary"]
+        for name, stats in sorted(snap.items()):
+            for q, key in (("0.5", "p50"), ("0.95", "p95"), ("0.99", "p99")):
+                lines.append(f'{METRIC_PREFIX}_span_seconds{{span="{name}",quantile="{q}"}} {stats[key]:.6f}')
+            lines.append(f'{METRIC_PREFIX}_span_seconds_sum{{span="{name}"}} {stats["sum_sec"]:.6f}')
+            lines.append(f'{METRIC_PREFIX}_span_seconds_count{{span="{name}"}} {stats["count"]}')
+        cached = [(name, stats) for name, stats in sorted(snap.items()) if "cache_hit" in stats]
+        if cached:
+            lines.append(f"# TYPE {METRIC_PREFIX}_cache_total counter")
+            for name, stats in cached:
+                lines.append(f'{METRIC_PREFIX}_cache_total{{span="{name}",result="hit"}} {stats["cache_hit"]}')
+                lines.append(f'{METRIC_PREFIX}_cache_total{{span="{name}",result="miss"}} {stats["cache_miss"]}')
+        return "\n".join(lines) + "\n"
+
+    def export_jsonl(self, path):
+        """現在の集計を1行の JSON として追記する"""
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"ts": round(time.time(), 3), "event": "summary", "spans": self.snapshot()},
+                               ensure_ascii=False) + "\n")
+
+    def close(self):
+        if self._log is not None:
+            self._log.close()
+            self._log = None
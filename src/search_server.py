@@ -0,0 +1,277 @@
+import json
+import os
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+
+from search import DuelMastersHybridSearch
+
+# =========================
+# 設定
+# =========================
+HOST = os.getenv("SEARCH_SERVER_HOST", "127.0.0.1")
+PORT = int(os.getenv("SEARCH_SERVER_PORT", "8765"))
+EMBED_MAX_BATCH = 32     # 1回の埋め込み呼び出しにまとめる最大件数
+EMBED_MAX_WAIT = 0.01    # 同時に来たリクエストを待ち合わせる最大秒数
+
+
+def df_to_records(df):
+    """DataFrame を JSON 用のレコードに変換（card_idx に元の index を入れる）"""
+    if df is None:
+        return []
+    records = df.astype(object).where(pd.notna(df), None).to_dict(orient="records")
+    for idx, record in zip(df.index, records):
+        record["card_idx"] = int(idx)
+    return records
+
+
+# =========================
+# 埋め込みのマイクロバッチ
+# =========================
+class EmbeddingBatcher:
+    """複数スレッドからの埋め込み要求を短時間まとめて、1回の呼び出しで処理する
+
+    要求には呼び出し元が固定しているインデックスの埋め込み（embedder）を添える。
+    まとめる単位は embedder ごとなので、切り替え前後の要求が混ざっても
+    それぞれ検索するインデックスと同じ埋め込みで計算される"""
+
+    def __init__(self, max_batch=EMBED_MAX_BATCH, max_wait=EMBED_MAX_WAIT):
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue = queue.Queue()
+        self.batches = 0
+        self.requests = 0
+        threading.Thread(target=self._loop, daemon=True).start()
+
+    def embed(self, text, embedder):
+        """1件分の埋め込みを返す（同じ embedder への他の要求と束ねて実行される）"""
+        item = {"text": text, "embedder": embedder, "done": threading.Event(), "result": None, "error": None}
+        self.queue.put(item)
+        item["done"].wait()
+        if item["error"] is not None:
+            raise item["error"]
+        return item["result"]
+
+    def _loop(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            groups = {}
+            for item in batch:
+                groups.setdefault(id(item["embedder"]), []).append(item)
+            for items in groups.values():
+                try:
+                    vectors = items[0]["embedder"].embed_many([item["text"] for item in items])
+                    for item, vector in zip(items, vectors):
+                        item["result"] = vector
+                except Exception as e:
+                    for item in items:
+                        item["error"] = e
+                self.batches += 1
+            self.requests += len(batch)
+            for item in batch:
+                item["done"].set()
+
+
+# =========================
+# 検索サーバー
+# =========================
+class SearchService:
+    """インデックスを1プロセスで保持し、複数のBot・CLIから共有する"""
+
+    def __init__(self):
+        self.searcher = DuelMastersHybridSearch()
+        self.batcher = EmbeddingBatcher()
+        # クエリの埋め込みはバッチャー経由にする（各要求は固定したインデックスの埋め込みを添えて渡す）
+        self.searcher.embedding_batcher = self.batcher
+        # インデックスが再構築されたら無停止で切り替える
+        self.searcher.start_watcher()
+
+    def health(self, _):
+        return {
+            "status": "ok",
+            "index_version": self.searcher.index_version,
+            "cards": len(self.searcher.cards_df),
+            "embedding": self.searcher.embedder.describe(),
+            "embed_requests": self.batcher.requests,
+            "embed_batches": self.batcher.batches,
+            "latency": self.searcher.latency_summary(),
+            "ollama": self._ollama_backends(),
+        }
+
+    def search(self, body):
+        ranked_df, error = self.searcher.find_cards(body["query"], top_k=body.get("top_k", 50))
+        return {"cards": df_to_records(ranked_df), "error": error}
+
+    def search_stream(self, body):
+        """暫定結果・確定結果を順に返す（1要素が1行のJSONになる）"""
+        for update in self.searcher.iter_find_cards(body["query"], top_k=body.get("top_k", 50)):
+            yield {
+                "stage": update.stage,
+                "cards": df_to_records(update.cards),
+                "error": update.error,
+                "elapsed": round(update.elapsed, 3),
+            }
+
+    def complete(self, body):
+        return {"entries": self.searcher.complete(body["text"], limit=body.get("limit", 25), kinds=body.get("kinds"))}
+
+    def card(self, body):
+        card, candidates = self.searcher.lookup_card(body["name"], max_distance=body.get("max_distance", 2))
+        return {"card": card, "candidates": candidates}
+
+    def metrics(self, _):
+        metrics = self.searcher.metrics
+        return {
+            "spans": metrics.snapshot(),
+            "prometheus": metrics.prometheus(),
+            "result_cache": self.searcher.result_cache.stats(),
+            "condition_cache": self.searcher.condition_cache.summary(),
+            "ollama": self._ollama_backends(),
+        }
+
+    def _ollama_backends(self):
+        router = self.searcher.ollama_router
+        return router.snapshot() if router is not None else None
+
+    def profile(self, body):
+        """1件の検索を cProfile / tracemalloc 付きで実行し、そのトレースを返す"""
+        metrics = self.searcher.metrics
+        with metrics.trace(body["query"], cpu=body.get("cpu", True), memory=body.get("memory", True)) as trace:
+            self.searcher.find_cards(body["query"], top_k=body.get("top_k", 50))
+        return {"trace": trace.to_dict()}
+
+    def similar(self, body):
+        similar_df, error = self.searcher.similar_cards(
+            body["card_idx"],
+            limit=body.get("limit", 10),
+            civilizations=body.get("civilizations"),
+            cost_min=body.get("cost_min"),
+            cost_max=body.get("cost_max"),
+        )
+        return {"cards": df_to_records(similar_df), "error": error}
+
+    def extract_conditions(self, body):
+        return {"conditions": self.searcher.extract_search_conditions(body["query"])}
+
+    def rank(self, body):
+        """条件（省略時は抽出）でフィルタしてランキングする"""
+        conditions = body.get("conditions")
+        if conditions is None:
+            conditions = self.searcher.extract_search_conditions(body["query"])
+        with self.searcher.pinned_snapshot():
+            filtered_df, _ = self.searcher.filter_cached(conditions or {})
+            ranked_df, _ = self.searcher.rank_cached(
+                filtered_df, body["query"], conditions or {}, top_k=body.get("top_k", 50)
+            )
+        return {"conditions": conditions, "cards": df_to_records(ranked_df)}
+
+
+def make_handler(service):
+    routes = {
+        "/health": service.health,
+        "/search": service.search,
+        "/extract_conditions": service.extract_conditions,
+        "/rank": service.rank,
+        "/complete": service.complete,
+        "/card": service.card,
+        "/similar": service.similar,
+        "/metrics": service.metrics,
+        "/profile": service.profile,
+    }
+    # 結果を段階的に返す（chunked で JSON Lines を送る）
+    stream_routes = {
+        "/search_stream": service.search_stream,
+    }
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _reply(self, status, payload):
+            data = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _stream(self, updates):
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson; charset=utf-8")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            try:
+                for update in updates:
+                    line = json.dumps(update, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+                    self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+                    self.wfile.flush()
+            except Exception as e:
+                # ヘッダー送信後なのでエラーも1行として返す
+                print(f"⚠️  検索サーバーエラー: {e}")
+                line = json.dumps({"stage": "final", "cards": [], "error": str(e)}, ensure_ascii=False).encode("utf-8") + b"\n"
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+            self.wfile.write(b"0\r\n\r\n")
+
+        def _dispatch(self, body):
+            if self.path in stream_routes:
+                if "query" not in body:
+                    self._reply(400, {"error": "missing field: 'query'"})
+                    return
+                self._stream(stream_routes[self.path](body))
+                return
+            route = routes.get(self.path)
+            if route is None:
+                self._reply(404, {"error": f"unknown path: {self.path}"})
+                return
+            try:
+                self._reply(200, route(body))
+            except KeyError as e:
+                self._reply(400, {"error": f"missing field: {e}"})
+            except Exception as e:
+                print(f"⚠️  検索サーバーエラー: {e}")
+                self._reply(500, {"error": str(e)})
+
+        def do_GET(self):
+            self._dispatch({})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            try:
+                body = json.loads(self.rfile.read(length) or b"{}")
+            except json.JSONDecodeError:
+                self._reply(400, {"error": "invalid JSON"})
+                return
+            self._dispatch(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def main():
+    service = SearchService()
+    server = ThreadingHTTPServer((HOST, PORT), make_handler(service))
+    print(f"✅ 検索サーバー起動: http://{HOST}:{PORT}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("終了します")
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
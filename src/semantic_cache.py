@@ -0,0 +1,195 @@
+import copy
+import os
+import re
+import threading
+from collections import Counter, deque
+
+import numpy as np
+
+from result_cache import canonical_conditions
+from search_executor import normalize_query
+from text_normalize import fold_text
+
+# =========================
+# 設定
+# =========================
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", "512"))            # 保持するクエリ数（0で無効）
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))  # 再利用するコサイン類似度の下限
+SEMANTIC_CACHE_AUDIT = float(os.getenv("SEMANTIC_CACHE_AUDIT", "0.05"))        # ヒットのうちLLMで答え合わせする割合
+AUDIT_EXAMPLES = 20  # 誤った再利用の例を直近何件残すか
+
+CIVILIZATIONS = ["火", "水", "自然", "光", "闇"]
+CARD_TYPES = ["クリーチャー", "呪文", "クロスギア", "城", "フィールド", "タマシード"]
+
+
+def rule_based_conditions(query, keywords=(), races=()):
+    """クエリから数字・文明・タイプ・キーワード・種族を拾って検索条件を作る（LLMの代わり）"""
+    conditions = {
+        "cost_min": None, "cost_max": None, "civilizations": [], "card_types": [],
+        "keywords": [], "race_keywords": [], "effect_groups": [], "exclude_keywords": [],
+        "general_search": [],
+    }
+    match = re.search(r"(\d+)\s*コスト|コスト\s*(\d+)", query)
+    if match:
+        cost = int(match.group(1) or match.group(2))
+        tail = query[match.end():match.end() + 3]
+        if tail.startswith("以上"):
+            conditions["cost_min"] = cost
+        elif tail.startswith("以下"):
+            conditions["cost_max"] = cost
+        else:
+            conditions["cost_min"] = conditions["cost_max"] = cost
+    conditions["civilizations"] = [civ for civ in CIVILIZATIONS if civ in query]
+    conditions["card_types"] = [t for t in CARD_TYPES if t in query]
+    # 長いキーワードを優先（「S・トリガー」より「スーパー・S・トリガー」）
+    for keyword in sorted(keywords, key=len, reverse=True):
+        if keyword in query and not any(keyword in found for found in conditions["keywords"]):
+            conditions["keywords"].append(keyword)
+    conditions["race_keywords"] = [race for race in races if race in query]
+    return conditions
+
+
+def find_conflicts(query_rules, cached_rules, cached_conditions):
+    """似たクエリの条件を使い回してよいかを、クエリに明示された値で確かめる
+
+    - コスト: 新しいクエリに数字があれば、使い回す条件のコストと一致すること
+      （「軽量の」→ cost_max 3 のように、数字の無い側は LLM の解釈に任せる）
+    - 文明・タイプ・キーワード・種族・用語集の概念: 両方のクエリに書かれているものが同じであること
+      （「軽量バウンス呪文」と「軽量ハンデス呪文」は概念が違うので使い回さない）
+    衝突した項目名のリストを返す（空なら再利用してよい）"""
+    conflicts = []
+    for field in ("cost_min", "cost_max"):
+        if query_rules[field] is not None and cached_conditions.get(field) != query_rules[field]:
+            conflicts.append(field)
+    for field in ("civilizations", "card_types", "keywords", "race_keywords", "concepts"):
+        if set(query_rules.get(field, ())) != set(cached_rules.get(field, ())):
+            conflicts.append(field)
+    return conflicts
+
+
+class SemanticConditionCache:
+    """条件抽出の前に置く、意味の近いクエリのキャッシュ
+
+    過去に条件を抽出したクエリの埋め込みを保持し、新しいクエリと最も近いものの
+    類似度が threshold 以上で、ルールベースの確認で衝突が無ければその条件を返す。
+    ヒットの一部（audit_rate）は呼び出し側が LLM でも抽出し、record_audit() で答え合わせする"""
+
+    def __init__(self, maxsize=SEMANTIC_CACHE_SIZE, threshold=SEMANTIC_CACHE_THRESHOLD,
+                 audit_rate=SEMANTIC_CACHE_AUDIT, keywords=(), races=(), concepts=None):
+        self.maxsize = maxsize
+        self.threshold = threshold
+        self.audit_rate = audit_rate
+        self.keywords = list(keywords)
+        self.races = list(races)
+        self.concepts = concepts or {}  # AliasTable.concepts（正規化した俗語・概念名 -> 正式表現）
+        self.stats = Counter()
+        self.false_reuse = deque(maxlen=AUDIT_EXAMPLES)
+        self._vectors = None  # maxsize × 次元（正規化済み）。古いものから上書きする
+        self._entries = []    # (正規化したクエリ, ルールベースの条件, 抽出された条件)
+        self._next = 0
+        self._lock = threading.Lock()
+        self._rng = np.random.default_rng()
+
+    def _rules(self, query):
+        rules = rule_based_conditions(query, self.keywords, self.races)
+        # 俗語・概念名は正式表現にまとめて比べる（「ランデス」と「マナ破壊」は同じ概念）
+        folded = fold_text(query)
+        rules["concepts"] = sorted({
+            self.concepts[term] for term in self.concepts if term and term in folded
+        })
+        return rules
+
+    @staticmethod
+    def _unit(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, query, vector):
+        """再利用できる条件があれば (条件のコピー, 元のクエリ, 類似度, 答え合わせするか)、無ければ None"""
+        if self.maxsize <= 0:
+            return None
+        unit = self._unit(vector)
+        with self._lock:
+            self.stats["lookups"] += 1
+            if not self._entries or self._vectors.shape[1] != len(unit):
+                self.stats["miss_empty"] += 1
+                return None
+            similarities = self._vectors[:len(self._entries)] @ unit
+            best = int(np.argmax(similarities))
+            similarity = float(similarities[best])
+            cached_query, cached_rules, cached_conditions = self._entries[best]
+            if similarity < self.threshold:
+                self.stats["miss_threshold"] += 1
+                return None
+
+        conflicts = find_conflicts(self._rules(query), cached_rules, cached_conditions)
+        with self._lock:
+            if conflicts:
+                self.stats["miss_conflict"] += 1
+                for field in conflicts:
+                    self.stats[f"conflict.{field}"] += 1
+                return None
+            self.stats["hits"] += 1
+            audit = self._rng.random() < self.audit_rate
+            if audit:
+                self.stats["audits"] += 1
+        return copy.deepcopy(cached_conditions), cached_query, similarity, audit
+
+    def add(self, query, vector, conditions):
+        """LLM で抽出した条件を登録する（失敗した抽出は登録しない）"""
+        if self.maxsize <= 0 or not conditions:
+            return
+        unit = self._unit(vector)
+        entry = (normalize_query(query), self._rules(query), copy.deepcopy(conditions))
+        with self._lock:
+            if self._vectors is None or self._vectors.shape[1] != len(unit):
+                # 埋め込みの次元が変わったら（インデックスの切り替え後など）登録済みのクエリごと作り直す
+                self._entries = []
+                self._next = 0
+                self._vectors = np.zeros((self.maxsize, len(unit)), dtype=np.float32)
+            slot = self._next
+            self._vectors[slot] = unit
+            if slot < len(self._entries):
+                self._entries[slot] = entry
+            else:
+                self._entries.append(entry)
+            self._next = (slot + 1) % self.maxsize
+
+    def clear(self):
+        """登録済みのクエリを捨てる（埋め込みが変わるインデックスの切り替え時）。集計は残す"""
+        with self._lock:
+            self._vectors = None  # 次の埋め込みの次元で作り直す
+            self._entries = []
+            self._next = 0
+
+    def record_audit(self, query, cached_query, similarity, reused, actual):
+        """答え合わせの結果を記録する。使い回した条件が LLM の抽出と違えば誤った再利用として数える"""
+        if not actual:
+            return True
+        matched = canonical_conditions(reused) == canonical_conditions(actual)
+        with self._lock:
+            if not matched:
+                self.stats["false_reuse"] += 1
+                self.false_reuse.append({
+                    "query": query,
+                    "cached_query": cached_query,
+                    "similarity": round(similarity, 4),
+                })
+        return matched
+
+    def summary(self):
+        with self._lock:
+            stats = dict(self.stats)
+            examples = list(self.false_reuse)
+            size = len(self._entries)
+        lookups = stats.get("lookups", 0)
+        audits = stats.get("audits", 0)
+        return {
+            "size": size,
+            "threshold": self.threshold,
+            "hit_rate": round(stats.get("hits", 0) / lookups, 4) if lookups else None,
+            "false_reuse_rate": round(stats.get("false_reuse", 0) / audits, 4) if audits else None,
+            "counters": stats,
+            "false_reuse_examples": examples,
+        }
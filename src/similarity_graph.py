@@ -0,0 +1,72 @@
+import numpy as np
+
+# =========================
+# 設定
+# =========================
+SIMILAR_K = 20      # 1枚あたりに保存する類似カードの数
+BLOCK_SIZE = 1024   # 一度に類似度を計算する行数（メモリ使用量は BLOCK_SIZE × カード数 に比例）
+
+
+def build_knn_graph(embeddings, k=SIMILAR_K, block_size=BLOCK_SIZE):
+    """全カード間のコサイン類似度から、各カードの上位 k 件を求める
+
+    行列積はブロック単位で行うため、カード数が増えても n×n の行列は作らない。
+    戻り値は (近傍の行番号 int32 [n, k], 類似度 float16 [n, k])。類似度の高い順"""
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    n = len(vectors)
+    k = min(k, max(n - 1, 0))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors = vectors / np.where(norms == 0, 1, norms)
+
+    neighbors = np.empty((n, k), dtype=np.int32)
+    scores = np.empty((n, k), dtype=np.float16)
+    if k == 0:
+        return neighbors, scores
+
+    for start in range(0, n, block_size):
+        end = min(start + block_size, n)
+        sims = vectors[start:end] @ vectors.T
+        # 自分自身は除外
+        sims[np.arange(end - start), np.arange(start, end)] = -np.inf
+
+        top = np.argpartition(sims, -k, axis=1)[:, -k:]
+        top_sims = np.take_along_axis(sims, top, axis=1)
+        order = np.argsort(-top_sims, axis=1)
+        neighbors[start:end] = np.take_along_axis(top, order, axis=1)
+        scores[start:end] = np.take_along_axis(top_sims, order, axis=1)
+
+    return neighbors, scores
+
+
+def save_graph(path, card_ids, neighbors, scores):
+    """card_ids[i] が i 行目のカード（card_{idx} の idx）"""
+    np.savez(path, card_ids=np.asarray(card_ids, dtype=np.int32), neighbors=neighbors, scores=scores)
+
+
+# =========================
+# 類似カードの検索
+# =========================
+class SimilarityGraph:
+    """prepare_database.py が保存した類似カードのグラフ（読み込み後は計算なしで引ける）"""
+
+    def __init__(self, card_ids, neighbors, scores):
+        self.card_ids = card_ids
+        self.neighbors = neighbors
+        self.scores = scores
+        self.row_of = {int(card_idx): row for row, card_idx in enumerate(card_ids)}
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data["card_ids"], data["neighbors"], data["scores"])
+
+    def __contains__(self, card_idx):
+        return card_idx in self.row_of
+
+    def neighbors_of(self, card_idx):
+        """(類似カードの idx のリスト, 類似度のリスト) を類似度の高い順に返す"""
+        row = self.row_of.get(card_idx)
+        if row is None:
+            return [], []
+        ids = [int(self.card_ids[j]) for j in self.neighbors[row]]
+        return ids, [float(score) for score in self.scores[row]]
@@ -0,0 +1,108 @@
+import math
+import re
+import unicodedata
+
+# 語の中の区切り（「S・トリガー」「Sトリガー」「Ｓ・トリガー」を同じにする）
+_JOINERS = re.compile(r"[\s・･\-‐－]+")
+# 文・項目の区切り。語をまたいで一致しないよう1文字の境界に揃える
+# 「/」は複数の種族・文明の区切り（「ドラゴン/ガーディアン」）なので、消さずに境界にする
+_BOUNDARIES = re.compile(r"[。、，,.:：;；!！?？「」『』（）()【】\[\]■□◆◇▶→/／]+")
+BOUNDARY = "|"
+
+SEARCH_FIELDS = ['card_name', 'civilization', 'color_type', 'card_type', 'cost', 'power', 'race', 'text']
+
+
+def fold_text(text):
+    """照合用の正規化: NFKC（全角半角）・小文字化・語中の区切り記号の除去・句読点を境界に統一
+
+    カードのテキストと検索語の両方にかけてから部分一致をとる"""
+    if text is None or (isinstance(text, float) and math.isnan(text)):
+        return ""
+    text = unicodedata.normalize("NFKC", str(text)).lower()
+    text = _BOUNDARIES.sub(BOUNDARY, text)
+    return _JOINERS.sub("", text)
+
+
+def fold_columns(cards_df):
+    """フィルタ・ボーナス計算用の正規化済みの列（カードデータとは別の DataFrame、同じ index）"""
+    import pandas as pd
+
+    columns = {field: cards_df[field].map(fold_text) for field in SEARCH_FIELDS}
+    folded = pd.DataFrame({
+        "name": columns["card_name"],
+        "civilization": columns["civilization"],
+        "card_type": columns["card_type"],
+        "race": columns["race"],
+        "text": columns["text"],
+        # 全体検索用（どの項目に含まれていてもよい）。項目の間は境界文字で区切る
+        "all": columns[SEARCH_FIELDS[0]].str.cat([columns[field] for field in SEARCH_FIELDS[1:]], sep=BOUNDARY),
+    }, index=cards_df.index)
+    folded["cost"] = pd.to_numeric(cards_df["cost"], errors="coerce")
+    return folded
+
+
+def contains_any(series, patterns):
+    """正規化済みの列が patterns（正規化済み）のいずれかを含むか。1回の走査で判定する
+
+    空のパターンは空文字列と同じく全件に一致する扱い（全て True）"""
+    patterns = sorted({p for p in patterns if p}, key=len, reverse=True)
+    if not patterns:
+        return series.map(lambda _: True).astype(bool)
+    if len(patterns) == 1:
+        return series.str.contains(patterns[0], regex=False)
+    return series.str.contains("|".join(map(re.escape, patterns)), regex=True)
+
+
+# =========================
+# 別名の表
+# =========================
+class AliasTable:
+    """表記揺れ・俗語を正式な語にまとめる表（keywords.txt と用語集から作る）
+
+    - keywords: 正規化した別名 -> 公式キーワード（「Sトリガー」→「S・トリガー」）
+    - concepts: 正規化した俗語・概念名 -> 効果テキストの正式表現（「ランデス」→「相手のマナゾーンから」）"""
+
+    def __init__(self, keywords=None, concepts=None):
+        self.keywords = keywords or {}
+        self.concepts = concepts or {}
+
+    @classmethod
+    def build(cls, official_keywords=(), glossary=None):
+        keywords = {}
+        for keyword in official_keywords:
+            keywords.setdefault(fold_text(keyword), keyword)
+
+        concepts = {}
+        for entries in (glossary or {}).values():
+            if not isinstance(entries, dict):
+                continue
+            for name, entry in entries.items():
+                if not isinstance(entry, dict):
+                    continue
+                # 用語集の見出し（「Sトリガー」など）-> 公式キーワード
+                official = entry.get("キーワード") or entry.get("正式名")
+                if isinstance(official, str) and fold_text(official) in keywords:
+                    keywords.setdefault(fold_text(name), keywords[fold_text(official)])
+                # 概念名と俗語 -> 正式表現（効果テキストに現れる形）
+                formal = entry.get("正式表現", []) + entry.get("キーワード能力", [])
+                if formal:
+                    patterns = tuple(sorted({fold_text(term) for term in formal if fold_text(term)}))
+                    for variant in [name] + entry.get("俗語", []):
+                        concepts.setdefault(fold_text(variant), patterns)
+        return cls(keywords, concepts)
+
+    def canonical_keyword(self, term):
+        """公式キーワード（別名も可）なら正式な表記を返す。そうでなければ None"""
+        return self.keywords.get(fold_text(term))
+
+    def expand(self, term):
+        """効果テキストで探す正規化済みのパターン（俗語・概念名には正式表現を加える）"""
+        folded = fold_text(term)
+        patterns = {folded}
+        patterns.update(self.concepts.get(folded, ()))
+        if folded in self.keywords:
+            patterns.add(fold_text(self.keywords[folded]))
+        return patterns
+
+    def expand_all(self, terms):
+        return {pattern for term in terms for pattern in self.expand(term)}